@@ -0,0 +1,318 @@
+import asyncio
+import contextvars
+import json
+import time
+import typing
+
+import backend.async_store
+import backend.bulk_io
+import backend.file_manager
+import backend.live_check
+import backend.logic_engine
+import backend.marking
+import backend.marking_executor
+import backend.metrics
+import backend.question_pool
+import backend.server_config
+import backend.truth_table
+
+# ASGI entry point serving the same routes as main.py without a thread per request, e.g. with
+# uvicorn asgi:app --host 127.0.0.1 --port 8888
+# Storage runs on worker threads and marking on the marking executor's processes, so the event loop stays free for
+# the many connected students that are idle most of the time.
+
+store: backend.async_store.AsyncFileManager = backend.async_store.AsyncFileManager(
+    backend.server_config.create_file_manager())
+marking_executor: typing.Optional[backend.marking_executor.MarkingExecutor] = \
+    backend.server_config.create_marking_executor()
+question_pool: typing.Optional[backend.question_pool.QuestionPool] = backend.server_config.create_question_pool()
+live_checker: backend.live_check.LiveChecker = backend.server_config.create_live_checker()
+backend.server_config.register_metrics(store.file_manager, marking_executor, question_pool, live_checker)
+
+Headers = typing.Dict[str, str]
+
+# the address of the client whose request is being handled, for routes that need more than its headers and body
+client_address: contextvars.ContextVar = contextvars.ContextVar('client_address', default='')
+Response = typing.Tuple[int, str, str]  # status, content type, body
+
+# streamed responses are sent in chunks of about this many bytes
+STREAM_CHUNK_SIZE: int = 64 * 1024
+
+CORS_HEADERS: typing.List[typing.Tuple[bytes, bytes]] = [(b'access-control-allow-origin', b'*'),
+                                                         (b'access-control-allow-headers', b'*'),
+                                                         (b'access-control-allow-methods', b'GET, POST, OPTIONS')]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status: int = status
+
+
+def text(body: str) -> Response:
+    return 200, 'text/html; charset=utf-8', body
+
+
+def json_response(body: typing.Any) -> Response:
+    return 200, 'application/json', json.dumps(body)
+
+
+async def post_json(headers: Headers, body: bytes) -> Response:
+    return text(await store.write_to_file(backend.file_manager.json_to_question_set(body.decode())))
+
+
+async def get_json(headers: Headers, body: bytes) -> Response:
+    return text((await store.retrieve_from_file(headers.get('identifier'), hide_answer=True)).to_json_string)
+
+
+async def get_random_question_set(headers: Headers, body: bytes) -> Response:
+    questions: backend.file_manager.QuestionSet = await asyncio.to_thread(
+        backend.file_manager.generate_random_questions, int(headers.get('question_count')),
+        backend.logic_engine.generate_question if question_pool is None else question_pool.take)
+    await store.write_to_file(questions)
+    return text(store.file_manager.hide_answers(questions).to_json_string)
+
+
+async def mark_answer(headers: Headers, body: bytes) -> Response:
+    question: typing.Optional[backend.file_manager.Question] = await store.retrieve_question(headers.get('set_id'),
+                                                                                             headers.get('question_id'))
+    if question is None:
+        raise HttpError(404, backend.marking.QUESTION_NOT_FOUND)
+    arguments: tuple = (headers.get('user_answer'), question.correct_formula, question.prohibited_formula,
+                        question.correct_grammar, question.artifact)
+    if marking_executor is None:
+        return text(await asyncio.to_thread(backend.logic_engine.validate_answer, *arguments))
+    try:
+        return text(await marking_executor.mark_async(*arguments))
+    except backend.marking_executor.MarkingQueueFullError:
+        raise HttpError(503, 'Too many answers are being marked, try again shortly')
+
+
+async def mark_answers(headers: Headers, body: bytes) -> Response:
+    try:
+        submissions: typing.Any = json.loads(body)
+    except ValueError:
+        raise HttpError(400, 'Expected a JSON list of submissions')
+    if marking_executor is None:
+        return json_response(await asyncio.to_thread(backend.marking.mark_submissions, store.file_manager,
+                                                     submissions))
+    try:
+        return json_response(await backend.marking.mark_submissions_async(store, submissions, marking_executor))
+    except backend.marking_executor.MarkingQueueFullError:
+        raise HttpError(503, 'Too many answers are being marked, try again shortly')
+
+
+async def check_partial(headers: Headers, body: bytes) -> Response:
+    if not headers.get('session_id'):
+        raise HttpError(400, 'A session_id header is required')
+    question: typing.Optional[backend.file_manager.Question] = await store.retrieve_question(headers.get('set_id'),
+                                                                                             headers.get('question_id'))
+    if question is None:
+        raise HttpError(404, backend.marking.QUESTION_NOT_FOUND)
+    try:
+        pending: backend.live_check.PendingCheck = live_checker.admit(client_address.get(), headers['session_id'],
+                                                                      headers.get('set_id'), question,
+                                                                      headers.get('user_answer', ''))
+    except backend.live_check.RateLimitedError as error:
+        raise HttpError(429, str(error))
+    except backend.live_check.AnswerTooLongError as error:
+        raise HttpError(413, str(error))
+    await asyncio.sleep(pending.delay)
+    return json_response(await asyncio.to_thread(live_checker.check, pending))
+
+
+async def truth_table(headers: Headers, body: bytes) -> Response:
+    output_format: str = headers.get('format', 'json')
+    if output_format not in backend.truth_table.CONTENT_TYPES:
+        raise HttpError(400, 'Unknown truth table format ' + output_format)
+    try:
+        page: int = int(headers.get('page', '0'))
+        page_size: int = int(headers.get('page_size', '256'))
+    except ValueError:
+        raise HttpError(400, 'page and page_size must be whole numbers')
+    try:
+        rendered: str = await asyncio.to_thread(
+            backend.logic_engine.render_truth_table_page, headers.get('formula'), headers.get('grammar', 'prop'),
+            output_format, headers.get('order', 'binary'), page, page_size)
+    except backend.logic_engine.InvalidTruthTableRequestError as error:
+        raise HttpError(400, str(error))
+    return 200, backend.truth_table.CONTENT_TYPES[output_format], rendered
+
+
+async def metrics(headers: Headers, body: bytes) -> Response:
+    return 200, backend.metrics.CONTENT_TYPE, backend.metrics.registry.render()
+
+
+ROUTES: typing.Dict[typing.Tuple[str, str], typing.Callable[[Headers, bytes], typing.Awaitable[Response]]] = {
+    ('POST', '/post_json'): post_json,
+    ('GET', '/get_json'): get_json,
+    ('GET', '/random'): get_random_question_set,
+    ('GET', '/mark_answer'): mark_answer,
+    ('POST', '/mark_answers'): mark_answers,
+    ('GET', '/check_partial'): check_partial,
+    ('GET', '/truth_table'): truth_table,
+    ('GET', '/metrics'): metrics,
+}
+
+
+# Routes streaming their request or response bodies, which are given receive and send, and return the status sent
+async def import_jsonl(headers: Headers, receive, send) -> int:
+    if not backend.bulk_io.is_authorized(headers.get('bank_token')):
+        raise HttpError(403, 'Importing question banks needs a valid bank_token header')
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    try:
+        reports: typing.Iterator[backend.bulk_io.Report] = backend.bulk_io.import_lines(
+            store.file_manager, receive_lines(receive, loop), int(headers.get('set_size', '50')),
+            headers.get('name', 'Imported questions'), int(headers.get('batch_size', '100')),
+            headers.get('keep_ids', 'false') == 'true')
+    except ValueError:
+        raise HttpError(400, 'set_size and batch_size must be whole numbers of at least 1')
+    await start_stream(send, 200, backend.bulk_io.CONTENT_TYPE)
+    # the pipeline and the store writes run on a worker thread, which pulls the body from the event loop as it goes
+    await asyncio.to_thread(send_lines, backend.bulk_io.report_lines(reports), send, loop)
+    return 200
+
+
+async def export_jsonl(headers: Headers, receive, send) -> int:
+    if not backend.bulk_io.is_authorized(headers.get('bank_token')):
+        raise HttpError(403, 'Exporting question banks needs a valid bank_token header')
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    await start_stream(send, 200, backend.bulk_io.CONTENT_TYPE)
+    await asyncio.to_thread(send_lines, backend.bulk_io.export_lines(store.file_manager), send, loop)
+    return 200
+
+
+STREAMING_ROUTES: typing.Dict[typing.Tuple[str, str], typing.Callable[..., typing.Awaitable[int]]] = {
+    ('POST', '/import_jsonl'): import_jsonl,
+    ('GET', '/export_jsonl'): export_jsonl,
+}
+
+
+# Splits the request body into lines as it arrives, for a worker thread
+def receive_lines(receive, loop: asyncio.AbstractEventLoop) -> typing.Iterator[bytes]:
+    rest: bytes = b''
+    while True:
+        message: dict = asyncio.run_coroutine_threadsafe(receive(), loop).result()
+        lines: typing.List[bytes] = (rest + message.get('body', b'')).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+        if not message.get('more_body', False):
+            break
+    if rest:
+        yield rest
+
+
+async def start_stream(send, status: int, content_type: str) -> typing.NoReturn:
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode())] + CORS_HEADERS})
+
+
+# Sends lines as the response body from a worker thread, in chunks of about STREAM_CHUNK_SIZE bytes
+def send_lines(lines: typing.Iterable[str], send, loop: asyncio.AbstractEventLoop) -> typing.NoReturn:
+    chunk: typing.List[bytes] = []
+    size: int = 0
+    for line in lines:
+        encoded: bytes = line.encode()
+        chunk.append(encoded)
+        size += len(encoded)
+        if size >= STREAM_CHUNK_SIZE:
+            asyncio.run_coroutine_threadsafe(
+                send({'type': 'http.response.body', 'body': b''.join(chunk), 'more_body': True}), loop).result()
+            chunk, size = [], 0
+    asyncio.run_coroutine_threadsafe(send({'type': 'http.response.body', 'body': b''.join(chunk)}), loop).result()
+
+
+async def read_body(receive) -> bytes:
+    body: bytes = b''
+    while True:
+        message: dict = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def send_response(send, status: int, content_type: str, body: str) -> typing.NoReturn:
+    encoded: bytes = body.encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()),
+                            (b'content-length', str(len(encoded)).encode())] + CORS_HEADERS})
+    await send({'type': 'http.response.body', 'body': encoded})
+
+
+async def lifespan(receive, send) -> typing.NoReturn:
+    while True:
+        message: dict = await receive()
+        if message['type'] == 'lifespan.startup':
+            if question_pool is not None:
+                question_pool.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if marking_executor is not None:
+                await asyncio.to_thread(marking_executor.shutdown)
+            if question_pool is not None:
+                await asyncio.to_thread(question_pool.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def request_headers(scope) -> Headers:
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+# Errors raised before a streaming route starts its response are sent as for other routes. Once started, its status
+# can't change, so a later error just ends the response early.
+async def stream(handler, scope, receive, send) -> typing.NoReturn:
+    start: float = time.perf_counter()
+    profile = backend.metrics.profiler.start()
+    try:
+        status: int = await handler(request_headers(scope), receive, send)
+    except HttpError as error:
+        status = error.status
+        await send_response(send, status, 'text/plain', str(error))
+    finally:
+        backend.metrics.profiler.finish(profile, scope['path'])
+    backend.metrics.registry.observe(backend.metrics.REQUEST_SECONDS, time.perf_counter() - start,
+                                     {'route': scope['path'], 'method': scope['method'], 'status': status})
+
+
+async def app(scope, receive, send) -> typing.NoReturn:
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    streaming_handler = STREAMING_ROUTES.get((scope['method'], scope['path']))
+    if streaming_handler is not None:
+        await stream(streaming_handler, scope, receive, send)
+        return
+
+    body: bytes = await read_body(receive)
+    if scope['method'] == 'OPTIONS':   # CORS preflight
+        await send_response(send, 204, 'text/plain', '')
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await send_response(send, 404, 'text/plain', 'Not Found')
+        return
+
+    headers: Headers = request_headers(scope)
+    client_address.set(scope['client'][0] if scope.get('client') else '')
+    start: float = time.perf_counter()
+    profile = backend.metrics.profiler.start()
+    try:
+        status, content_type, response_body = await handler(headers, body)
+    except HttpError as error:
+        status, content_type, response_body = error.status, 'text/plain', str(error)
+    except FileNotFoundError:
+        status, content_type, response_body = 404, 'text/plain', 'Question set not found'
+    except backend.file_manager.InvalidJsonFormatError as error:
+        status, content_type, response_body = 400, 'text/plain', str(error)
+    except backend.marking.InvalidSubmissionsError as error:
+        status, content_type, response_body = 400, 'text/plain', str(error)
+    finally:
+        backend.metrics.profiler.finish(profile, scope['path'])
+    backend.metrics.registry.observe(backend.metrics.REQUEST_SECONDS, time.perf_counter() - start,
+                                     {'route': scope['path'], 'method': scope['method'], 'status': status})
+    await send_response(send, status, content_type, response_body)
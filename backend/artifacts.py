@@ -0,0 +1,40 @@
+import typing
+
+# Everything marking needs to know about a question's reference formulas, worked out once when the question is stored
+# (see backend.logic_engine.compile_question) and kept with it, so marking doesn't parse the reference formulas again:
+#   - the letters of the correct formula
+#   - its truth table bitmask, as in backend.formula.Formula.signature, or None if it has too many letters
+#   - the canonical form of the prohibited formula as text, see backend.canonical, or None if there is none
+# Stored artifacts from another ARTIFACT_VERSION are ignored and the formulas parsed as before, so this must be
+# increased whenever any of these, or the way they are computed, changes.
+
+ARTIFACT_VERSION: int = 1
+
+
+class QuestionArtifact:
+    __slots__ = ('letters', 'signature', 'prohibited_form')
+
+    def __init__(self, letters: typing.Sequence[str], signature: typing.Optional[int],
+                 prohibited_form: typing.Optional[str]) -> typing.NoReturn:
+        self.letters: typing.Tuple[str, ...] = tuple(letters)
+        self.signature: typing.Optional[int] = signature
+        self.prohibited_form: typing.Optional[str] = prohibited_form
+
+    @property
+    def to_dict(self) -> dict:
+        return {'version': ARTIFACT_VERSION,
+                'letters': list(self.letters),
+                'signature': None if self.signature is None else format(self.signature, 'x'),
+                'prohibited_form': self.prohibited_form}
+
+
+# Returns None for missing, malformed or outdated artifacts, so their questions are marked from the formulas instead
+def artifact_from_dict(dictionary: typing.Optional[dict]) -> typing.Optional[QuestionArtifact]:
+    if not isinstance(dictionary, dict) or dictionary.get('version') != ARTIFACT_VERSION:
+        return None
+    try:
+        signature: typing.Optional[str] = dictionary['signature']
+        return QuestionArtifact(dictionary['letters'], None if signature is None else int(signature, 16),
+                                dictionary['prohibited_form'])
+    except (KeyError, TypeError, ValueError):
+        return None
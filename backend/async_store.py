@@ -0,0 +1,21 @@
+import asyncio
+import typing
+
+import backend.file_manager
+
+
+# Wraps a FileManager compatible store for use from an asyncio event loop. Every call runs on a worker thread, so
+# disk and database access never blocks the loop.
+class AsyncFileManager:
+    def __init__(self, file_manager: backend.file_manager.FileManager) -> typing.NoReturn:
+        self.file_manager: backend.file_manager.FileManager = file_manager
+
+    async def retrieve_from_file(self, identifier: str, hide_answer: bool) -> backend.file_manager.QuestionSet:
+        return await asyncio.to_thread(self.file_manager.retrieve_from_file, identifier, hide_answer)
+
+    async def retrieve_question(self, set_id: str,
+                                question_id: str) -> typing.Optional[backend.file_manager.Question]:
+        return await asyncio.to_thread(self.file_manager.retrieve_question, set_id, question_id)
+
+    async def write_to_file(self, question_set: backend.file_manager.QuestionSet) -> str:
+        return await asyncio.to_thread(self.file_manager.write_to_file, question_set)
@@ -0,0 +1,78 @@
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import typing
+
+import backend.logic_engine
+
+GeneratedQuestion = typing.Tuple[str, str, str, str, str]
+
+
+# Every question gets its own random stream derived from the seed and its index, so the output for a seed doesn't
+# depend on how the work is split between processes
+def question_rng(seed: int, index: int) -> random.Random:
+    return random.Random(f'{seed}:{index}')
+
+
+def generate_range(seed: int, start: int, stop: int) -> typing.List[GeneratedQuestion]:
+    return [backend.logic_engine.generate_question(rng=question_rng(seed, index)) for index in range(start, stop)]
+
+
+# Yields count generated questions in index order as they are made, using a pool of worker processes unless
+# workers is 1. At most a few chunks per worker are in flight, so memory stays flat however many are generated.
+def generate_bulk(seed: int, count: int, workers: typing.Optional[int] = None,
+                  chunk_size: int = 64) -> typing.Iterator[GeneratedQuestion]:
+    workers = workers or os.cpu_count() or 1
+    chunks: typing.Iterator[typing.Tuple[int, int]] = ((start, min(start + chunk_size, count))
+                                                       for start in range(0, count, chunk_size))
+    if workers == 1:
+        for start, stop in chunks:
+            yield from generate_range(seed, start, stop)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight: typing.Deque[concurrent.futures.Future] = collections.deque()
+        for start, stop in itertools.islice(chunks, workers * 2):
+            in_flight.append(pool.submit(generate_range, seed, start, stop))
+        while in_flight:
+            questions: typing.List[GeneratedQuestion] = in_flight.popleft().result()
+            for start, stop in itertools.islice(chunks, 1):
+                in_flight.append(pool.submit(generate_range, seed, start, stop))
+            yield from questions
+
+
+def question_to_dict(index: int, question: GeneratedQuestion) -> typing.Dict[str, str]:
+    return {'id': str(index),
+            'source': 'randomly generated',
+            'prompt': question[3],
+            'input_method': question[4],
+            'correct_grammar': question[0],
+            'correct_formula': question[1],
+            'prohibited_formula': question[2]}
+
+
+def main() -> typing.NoReturn:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Generate questions reproducibly from a seed, writing one JSON question per line')
+    parser.add_argument('--seed', type=int, required=True)
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to one per core')
+    parser.add_argument('--output', default='-', help='file to write to, defaults to standard output')
+    args: argparse.Namespace = parser.parse_args()
+
+    output: typing.TextIO = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for index, question in enumerate(generate_bulk(args.seed, args.count, args.workers)):
+            output.write(json.dumps(question_to_dict(index, question)) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
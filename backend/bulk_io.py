@@ -0,0 +1,269 @@
+import argparse
+import hmac
+import json
+import os
+import re
+import sys
+import typing
+
+import backend.server_config
+from backend.file_manager import (FileManager, InvalidJsonFormatError, NonUniqueQuestionIdError, Question,
+                                  QuestionSet)
+
+# Streams question banks in and out of a question store as JSON Lines, for /import_jsonl, /export_jsonl and
+#   python -m backend.bulk_io import bank.jsonl
+#   python -m backend.bulk_io export --output bank.jsonl
+# Each line of an import is either a question set, {"name": ..., "questions": [...]}, or a single question, as
+# written by backend.bulk_generator. Consecutive question lines are gathered into sets of set_size questions.
+# Lines go through a pipeline of generators, reading, validating and compiling one line at a time and writing
+# batch_size sets per store write, so memory use doesn't grow with the size of the bank. A line that can't be
+# imported is reported and skipped, without stopping the import.
+# Every line gets a report, in line order, saying which set (and question) it was stored as, or why it wasn't:
+#   {"line": 3, "set_id": "123456", "question_id": "2"}
+#   {"line": 4, "error": "Question on line 4 has an invalid formula: ..."}
+# followed by a count of the lines imported and the lines with errors, {"imported": 1, "errors": 1}
+# Exports write one question set per line, with their answers, so the endpoints need the LOGIC_LEARNER_BANK_TOKEN
+# shared secret in a bank_token header, and are turned off if it isn't set.
+
+QUESTION_FIELDS: typing.Tuple[str, ...] = ('source', 'prompt', 'input_method', 'correct_grammar', 'correct_formula',
+                                           'prohibited_formula')
+# set ids become file names in the JSON file store, so imported ids are restricted to safe characters
+SET_ID_PATTERN: typing.Pattern = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+CONTENT_TYPE: str = 'application/x-ndjson'
+
+Report = typing.Dict[str, typing.Any]
+
+
+class LineError(Exception):
+    pass
+
+
+# An item of the pipeline: a set made from a set line or from question lines, or why a line couldn't be imported
+class _Item:
+    __slots__ = ('lines', 'question_set', 'error', 'gathered')
+
+    def __init__(self, lines: typing.List[int], question_set: typing.Optional[QuestionSet] = None,
+                 error: typing.Optional[str] = None, gathered: bool = False) -> typing.NoReturn:
+        self.lines: typing.List[int] = lines
+        self.question_set: typing.Optional[QuestionSet] = question_set
+        self.error: typing.Optional[str] = error
+        # whether the set was gathered from question lines, one per question
+        self.gathered: bool = gathered
+
+
+def is_authorized(token: typing.Optional[str]) -> bool:
+    expected: str = os.environ.get('LOGIC_LEARNER_BANK_TOKEN', '')
+    return expected != '' and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+# Numbers the lines, skipping blank ones, and parses each as JSON
+def read_records(lines: typing.Iterable[typing.Union[str, bytes]]) -> typing.Iterator[
+        typing.Tuple[int, typing.Union[dict, LineError]]]:
+    number: int
+    for number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if line.strip() == '':
+                continue
+            record: typing.Any = json.loads(line)
+        except (UnicodeDecodeError, ValueError) as error:
+            yield number, LineError(f'Not a line of JSON: {error}')
+            continue
+        if not isinstance(record, dict):
+            yield number, LineError('Expected a JSON object')
+            continue
+        yield number, record
+
+
+# Builds a question from its JSON and compiles it, which checks its formulas parse in their grammar. Any stored
+# artifact in the JSON is ignored, as artifacts are only trusted if compiled by the store.
+def compile_question(record: typing.Any, default_id: str) -> Question:
+    if not isinstance(record, dict):
+        raise LineError('Expected a question object')
+    for field in QUESTION_FIELDS:
+        if not isinstance(record.get(field), str):
+            raise LineError(f'Question field {field} is missing or not a string')
+    identifier: typing.Any = record.get('id', default_id)
+    return Question(str(identifier), *(record[field] for field in QUESTION_FIELDS)).compiled()
+
+
+def compile_set(record: dict, keep_ids: bool) -> QuestionSet:
+    if not isinstance(record.get('name'), str) or not isinstance(record.get('questions'), list):
+        raise LineError('Question set name or questions are missing')
+    identifier: str = ''
+    if keep_ids:
+        identifier = record.get('id')
+        if not isinstance(identifier, str) or SET_ID_PATTERN.fullmatch(identifier) is None:
+            raise LineError('Question set id is missing or not made of letters, digits, "_" and "-"')
+    question_set: QuestionSet = QuestionSet(identifier, record['name'])
+    position: int
+    for position, question in enumerate(record['questions']):
+        try:
+            question_set.add_question(compile_question(question, str(position)))
+        except LineError as error:
+            raise LineError(f'Question {position}: {error}')
+        except InvalidJsonFormatError as error:     # already says which question
+            raise LineError(str(error))
+        except NonUniqueQuestionIdError:
+            raise LineError(f'Question {position}: more than one question has id {question.get("id")}')
+    return question_set
+
+
+def _with_id(question: Question, identifier: str) -> Question:
+    return Question(identifier, question.source, question.prompt, question.input_method, question.correct_grammar,
+                    question.correct_formula, question.prohibited_formula, question.artifact)
+
+
+# Turns records into sets, gathering consecutive question lines into sets of set_size questions named name. Items are
+# yielded in groups covering consecutive lines, so reports can be put in line order one group at a time: the items of
+# lines between the questions of a gathered set are held back until the set is done. The set is closed early if
+# set_size lines are held back, so a group never holds more than 2 * set_size lines.
+def build_sets(records: typing.Iterable[typing.Tuple[int, typing.Union[dict, LineError]]], set_size: int, name: str,
+               keep_ids: bool) -> typing.Iterator[typing.List[_Item]]:
+    gathered: typing.List[int] = []
+    gathered_set: QuestionSet = QuestionSet('', name)
+    held: typing.List[_Item] = []
+    for number, record in records:
+        item: typing.Optional[_Item] = None
+        try:
+            if isinstance(record, LineError):
+                raise record
+            if 'questions' in record:
+                item = _Item([number], compile_set(record, keep_ids))
+            else:
+                # question ids are positions in the gathered set, as ids from different sources would clash, but until
+                # the question is added errors name its line, as that's where it is in the input
+                question: Question = compile_question(dict(record, id=f'on line {number}'), '')
+                gathered_set.add_question(_with_id(question, str(len(gathered))))
+                gathered.append(number)
+        except (LineError, InvalidJsonFormatError) as error:
+            item = _Item([number], error=str(error))
+        if item is not None:
+            if not gathered:
+                yield [item]
+                continue
+            held.append(item)
+        if len(gathered) == set_size or len(held) == set_size:
+            yield [_Item(gathered, gathered_set, gathered=True)] + held
+            gathered, gathered_set, held = [], QuestionSet('', name), []
+    if gathered:
+        yield [_Item(gathered, gathered_set, gathered=True)] + held
+
+
+# Writes the sets in batches of about batch_size, reporting on every line in order once its batch is written
+def write_batches(store: FileManager, groups: typing.Iterable[typing.List[_Item]], batch_size: int,
+                  keep_ids: bool) -> typing.Iterator[Report]:
+    batch: typing.List[_Item] = []
+    for group in groups:
+        batch.extend(group)
+        if len(batch) >= batch_size:
+            yield from _write_batch(store, batch, keep_ids)
+            batch = []
+    yield from _write_batch(store, batch, keep_ids)
+
+
+def _write_batch(store: FileManager, batch: typing.List[_Item], keep_ids: bool) -> typing.Iterator[Report]:
+    # sets gathered from question lines have no ids of their own
+    store.write_compiled_sets([item.question_set for item in batch if item.question_set is not None
+                               and (item.gathered or not keep_ids)])
+    if keep_ids:
+        store.write_compiled_sets([item.question_set for item in batch if item.question_set is not None
+                                   and not item.gathered], keep_ids=True)
+    reports: typing.List[Report] = []
+    item: _Item
+    for item in batch:
+        if item.question_set is None:
+            reports.append({'line': item.lines[0], 'error': item.error})
+        elif item.gathered:
+            reports.extend({'line': number, 'set_id': item.question_set.id, 'question_id': question.id}
+                           for number, question in zip(item.lines, item.question_set.questions))
+        else:
+            reports.append({'line': item.lines[0], 'set_id': item.question_set.id})
+    reports.sort(key=lambda report: report['line'])
+    yield from reports
+
+
+# The whole import pipeline, yielding a report for every non-blank line in line order
+def import_lines(store: FileManager, lines: typing.Iterable[typing.Union[str, bytes]], set_size: int = 50,
+                 name: str = 'Imported questions', batch_size: int = 100,
+                 keep_ids: bool = False) -> typing.Iterator[Report]:
+    if set_size < 1 or batch_size < 1:
+        raise ValueError('set_size and batch_size must be at least 1')
+    return write_batches(store, build_sets(read_records(lines), set_size, name, keep_ids), batch_size, keep_ids)
+
+
+# The reports as JSON Lines, ending with a count of the lines imported and the lines with errors
+def report_lines(reports: typing.Iterable[Report]) -> typing.Iterator[str]:
+    imported: int = 0
+    errors: int = 0
+    for report in reports:
+        if 'error' in report:
+            errors += 1
+        else:
+            imported += 1
+        yield json.dumps(report) + '\n'
+    yield json.dumps({'imported': imported, 'errors': errors}) + '\n'
+
+
+# One question set per line, without the compiled artifacts, which are compiled again on import
+def export_lines(store: FileManager) -> typing.Iterator[str]:
+    question_set: QuestionSet
+    for question_set in store.iter_sets():
+        dictionary: dict = question_set.to_dict
+        for question in dictionary['questions']:
+            question.pop('compiled', None)
+        yield json.dumps(dictionary) + '\n'
+
+
+def positive_int(value: str) -> int:
+    number: int = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is less than 1')
+    return number
+
+
+def main() -> typing.NoReturn:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Import or export a question bank as JSON Lines, using the question store main.py would use')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_command: argparse.ArgumentParser = commands.add_parser(
+        'import', help='import question sets or questions, writing a report for each line to standard output')
+    import_command.add_argument('input', nargs='?', default='-', help='file to read, defaults to standard input')
+    import_command.add_argument('--set-size', type=positive_int, default=50,
+                                help='questions per set made from question lines')
+    import_command.add_argument('--name', default='Imported questions', help='name of sets made from question lines')
+    import_command.add_argument('--batch-size', type=positive_int, default=100, help='sets per store write')
+    import_command.add_argument('--keep-ids', action='store_true',
+                                help='store question set lines under their own ids, replacing sets with those ids')
+    export_command: argparse.ArgumentParser = commands.add_parser('export', help='export every question set')
+    export_command.add_argument('--output', default='-', help='file to write to, defaults to standard output')
+    args: argparse.Namespace = parser.parse_args()
+
+    store: FileManager = backend.server_config.create_file_manager()
+    if args.command == 'export':
+        output: typing.TextIO = sys.stdout if args.output == '-' else open(args.output, 'w')
+        try:
+            output.writelines(export_lines(store))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        return
+
+    source: typing.TextIO = sys.stdin if args.input == '-' else open(args.input, 'r')
+    line: str = ''
+    try:
+        for line in report_lines(import_lines(store, source, args.set_size, args.name, args.batch_size,
+                                              args.keep_ids)):
+            sys.stdout.write(line)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    summary: dict = json.loads(line)
+    print(f'Imported {summary["imported"]} lines, {summary["errors"]} lines had errors', file=sys.stderr)
+    if summary['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
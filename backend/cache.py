@@ -0,0 +1,69 @@
+import collections
+import threading
+import typing
+
+K = typing.TypeVar('K')
+V = typing.TypeVar('V')
+
+
+# Thread safe least-recently-used cache with a bounded number of entries, counting hits and misses
+class LRUCache(typing.Generic[K, V]):
+    def __init__(self, max_size: int) -> typing.NoReturn:
+        self.__max_size: int = max_size
+        self.__entries: 'collections.OrderedDict[K, V]' = collections.OrderedDict()
+        self.__lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, key: K) -> bool:
+        with self.__lock:
+            return key in self.__entries
+
+    @property
+    def max_size(self) -> int:
+        return self.__max_size
+
+    def get(self, key: K, default: typing.Optional[V] = None) -> typing.Optional[V]:
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: K, value: V) -> typing.NoReturn:
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    # values are computed outside the lock, so two threads missing on the same key may both compute it
+    def get_or_compute(self, key: K, compute: typing.Callable[[], V]) -> V:
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+            self.misses += 1
+        value: V = compute()
+        self.put(key, value)
+        return value
+
+    def invalidate(self, key: K) -> typing.NoReturn:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self) -> typing.NoReturn:
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {'size': len(self.__entries), 'max_size': self.__max_size, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,226 @@
+import re
+import threading
+import typing
+
+from backend.formula import Formula
+
+# Canonical forms of formulas, used to detect answers that merely restate a prohibited formula. Two formulas get the
+# same canonical id if they only differ by
+#   - brackets
+#   - the order and grouping of the operands of "and"/"or" chains, or of the two sides of an equivalence
+#   - repeated operands of "and"/"or" (x ^ x is x)
+#   - pairs of negations that cancel out
+# Every canonical subformula is hash-consed into a table: its key holds the ids of its children, so building and
+# comparing keys takes constant time per node, and comparing two whole formulas is comparing two ids.
+
+CanonicalKey = typing.Tuple[typing.Any, ...]
+# (table generation, id within the table), as ids from before the table was last cleared mean nothing after it
+CanonicalId = typing.Tuple[int, int]
+
+ASSOCIATIVE_OPERATIONS: typing.Dict[str, str] = {"_and": "and", "_or": "or"}
+# canonical operations whose operands are unordered
+SYMMETRIC_OPERATIONS: typing.Tuple[str, ...] = ("and", "or", "equivalent")
+
+
+class CanonicalTable:
+    # the table is cleared when it grows beyond max_entries, so the ids of a long running server stay bounded
+    def __init__(self, max_entries: int = 1 << 20) -> typing.NoReturn:
+        self.max_entries: int = max_entries
+        self.generation: int = 0
+        self.__ids: typing.Dict[CanonicalKey, int] = {}
+        self.__keys: typing.List[CanonicalKey] = []
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    def intern(self, key: CanonicalKey) -> int:
+        identifier: typing.Optional[int] = self.__ids.get(key)
+        if identifier is None:
+            with self.__lock:
+                identifier = self.__ids.get(key)
+                if identifier is None:
+                    identifier = len(self.__keys)
+                    self.__keys.append(key)
+                    self.__ids[key] = identifier
+        return identifier
+
+    def key(self, identifier: int) -> CanonicalKey:
+        return self.__keys[identifier]
+
+    def canonical_id(self, formula: Formula) -> CanonicalId:
+        while True:
+            with self.__lock:
+                if len(self.__keys) > self.max_entries:
+                    self.__ids = {}
+                    self.__keys = []
+                    self.generation += 1
+                generation: int = self.generation
+            try:
+                identifier: int = self.__canonicalize(formula)
+            except IndexError:  # the table was cleared part way through and refilled less far
+                continue
+            if generation == self.generation:   # otherwise the table was cleared part way through, so start again
+                return generation, identifier
+
+    # The canonical form as text that stays meaningful in other processes, unlike ids: an s-expression such as
+    # (and p (not q)), with the operands of "and", "or" and equivalences in sorted order
+    def text(self, identifier: int) -> str:
+        texts: typing.Dict[int, str] = {}
+        stack: typing.List[int] = [identifier]
+        while stack:    # post-order without recursion, each distinct subformula rendered once
+            current: int = stack[-1]
+            key: CanonicalKey = self.key(current)
+            if key[0] == "letter":
+                texts[current] = key[1]
+                stack.pop()
+                continue
+            operands: typing.Tuple[int, ...] = _key_operands(key)
+            pending: typing.List[int] = [operand for operand in operands if operand not in texts]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            operand_texts: typing.List[str] = [texts[operand] for operand in operands]
+            if key[0] in SYMMETRIC_OPERATIONS:
+                operand_texts.sort()
+            texts[current] = "(" + " ".join([key[0]] + operand_texts) + ")"
+        return texts[identifier]
+
+    def canonical_text(self, formula: Formula) -> str:
+        while True:
+            generation, identifier = self.canonical_id(formula)
+            try:
+                text: str = self.text(identifier)
+            except IndexError:  # the table was cleared and refilled less far
+                continue
+            if generation == self.generation:
+                return text
+
+    # Interns the canonical form written by text, giving the id the original formula would have had
+    def canonical_id_from_text(self, text: str) -> CanonicalId:
+        while True:
+            with self.__lock:
+                generation: int = self.generation
+            try:
+                identifier: int = self.__parse_text(text)
+            except IndexError:  # the table was cleared part way through and refilled less far
+                continue
+            if generation == self.generation:
+                return generation, identifier
+
+    def __parse_text(self, text: str) -> int:
+        frames: typing.List[typing.List[typing.Any]] = [[None]]     # [operation, operand ids...]
+        expecting_operation: bool = False
+        for token in re.findall(r"\(|\)|[^\s()]+", text):
+            if token == "(":
+                expecting_operation = True
+            elif expecting_operation:
+                frames.append([token])
+                expecting_operation = False
+            elif token == ")":
+                if len(frames) < 2:
+                    raise ValueError("Unbalanced canonical form " + text)
+                operation, *operands = frames.pop()
+                frames[-1].append(self.intern(_key(operation, operands)))
+            else:
+                frames[-1].append(self.intern(("letter", token)))
+        if len(frames) != 1 or len(frames[0]) != 2:
+            raise ValueError("Malformed canonical form " + text)
+        return frames[0][1]
+
+    def __not(self, identifier: int) -> int:
+        key: CanonicalKey = self.key(identifier)
+        if key[0] == "not":     # double negations cancel out
+            return key[1]
+        return self.intern(("not", identifier))
+
+    def __associative(self, operation: str, operands: typing.List[int]) -> int:
+        members: typing.Set[int] = set()
+        for operand in operands:
+            key: CanonicalKey = self.key(operand)
+            if key[0] == operation:     # e.g. an "and" that only appeared after cancelling negations around it
+                members.update(key[1])
+            else:
+                members.add(operand)
+        if len(members) == 1:
+            return members.pop()
+        return self.intern((operation, tuple(sorted(members))))
+
+    # bottom-up walk without recursion, treating each maximal "and"/"or" chain as one operation with many operands
+    def __canonicalize(self, formula: Formula) -> int:
+        values: typing.List[int] = []
+        stack: typing.List[typing.Tuple[Formula, int]] = [(formula, -1)]     # (node, number of operands, or -1 if unvisited)
+        while stack:
+            node, operand_count = stack.pop()
+            while node.op == "brackets":
+                node = node.children[0]
+
+            if node.op == "letter":
+                values.append(self.intern(("letter", node.letter)))
+            elif node.op == "not_letter":
+                values.append(self.__not(self.intern(("letter", node.letter))))
+            elif operand_count < 0:
+                operands: typing.Sequence[Formula] = node.children
+                if node.op in ASSOCIATIVE_OPERATIONS:
+                    operands = _chain_operands(node)
+                stack.append((node, len(operands)))
+                for operand in operands:
+                    stack.append((operand, -1))
+            else:
+                children: typing.List[int] = values[len(values) - operand_count:]
+                del values[len(values) - operand_count:]
+                if node.op == "not_formula":
+                    values.append(self.__not(children[0]))
+                elif node.op in ASSOCIATIVE_OPERATIONS:
+                    values.append(self.__associative(ASSOCIATIVE_OPERATIONS[node.op], children))
+                elif node.op == "equivalent":
+                    values.append(self.intern(("equivalent",) + tuple(sorted(children))))
+                else:
+                    values.append(self.intern((node.op,) + tuple(children)))
+        return values[0]
+
+
+def _key_operands(key: CanonicalKey) -> typing.Tuple[int, ...]:
+    if key[0] in ASSOCIATIVE_OPERATIONS.values():
+        return key[1]
+    return key[1:]
+
+
+# the key of an already canonical operation, matching the keys built by CanonicalTable's walk
+def _key(operation: str, operands: typing.List[int]) -> CanonicalKey:
+    if operation in ASSOCIATIVE_OPERATIONS.values():
+        return operation, tuple(sorted(set(operands)))
+    if operation in SYMMETRIC_OPERATIONS:
+        return (operation,) + tuple(sorted(operands))
+    return (operation,) + tuple(operands)
+
+
+# the operands of a chain of the same associative operation, looking through brackets
+def _chain_operands(node: Formula) -> typing.List[Formula]:
+    operands: typing.List[Formula] = []
+    stack: typing.List[Formula] = list(node.children)
+    while stack:
+        child: Formula = stack.pop()
+        while child.op == "brackets":
+            child = child.children[0]
+        if child.op == node.op:
+            stack.extend(child.children)
+        else:
+            operands.append(child)
+    return operands
+
+
+canonical_table: CanonicalTable = CanonicalTable()
+
+
+def canonical_id(formula: Formula) -> CanonicalId:
+    return canonical_table.canonical_id(formula)
+
+
+def canonical_text(formula: Formula) -> str:
+    return canonical_table.canonical_text(formula)
+
+
+def canonical_id_from_text(text: str) -> CanonicalId:
+    return canonical_table.canonical_id_from_text(text)
@@ -0,0 +1,273 @@
+import itertools
+import typing
+
+from lark import LarkError
+
+import backend.formula
+from backend.formula import Formula
+
+# Formulas in disjunctive normal form, as written in answers to DNF questions: terms separated by "<", each term a
+# literal or a right nested conjunction of literals such as (p ^ (-q ^ r)), exactly the language of the logic engine's
+# "dnf" grammar. A DNF is held as a list of terms, each term a pair of bitmasks over the DNF's sorted letters: the
+# letters that appear plain and the letters that appear negated. That is all it takes to evaluate or compare one.
+
+WHITESPACE: typing.FrozenSet[str] = frozenset(" \t\f\r\n")
+LETTERS: typing.FrozenSet[str] = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+Term = typing.Tuple[int, int]   # (positive letters, negated letters), bit i standing for the DNF's i-th letter
+
+
+class DnfSyntaxError(LarkError):
+    def __init__(self, text: str, position: int, expected: str):
+        found: str = repr(text[position]) if position < len(text) else "end of input"
+        super().__init__(f"Expected {expected} at position {position}, found {found}")
+        self.position: int = position
+
+
+class Dnf:
+    __slots__ = ("letters", "terms")
+
+    def __init__(self, letters: typing.Sequence[str], terms: typing.List[Term]):
+        self.letters: typing.Tuple[str, ...] = tuple(letters)
+        self.terms: typing.List[Term] = terms
+
+    def __repr__(self) -> str:
+        return "Dnf(" + repr(self.render()) + ")"
+
+    # The truth table over the given letters, which must include all of the DNF's letters, as a bitmask like
+    # Formula.truth_table's: the union of the rows covered by each term
+    def truth_table(self, letters: typing.Sequence[str]) -> int:
+        true: int = (1 << (1 << len(letters))) - 1
+        positions: typing.Dict[str, int] = {name: position for position, name in enumerate(letters)}
+        columns: typing.List[int] = [backend.formula.letter_column(len(letters), positions[name])
+                                     for name in self.letters]
+        table: int = 0
+        for positive, negative in self.terms:
+            covered: int = true
+            for i, column in enumerate(columns):
+                if positive >> i & 1:
+                    covered &= column
+                if negative >> i & 1:
+                    covered &= true ^ column
+            table |= covered
+        return table
+
+    @property
+    def signature(self) -> typing.Optional[int]:
+        if len(self.letters) > backend.formula.SIGNATURE_MAX_LETTERS:
+            return None
+        return self.truth_table(self.letters)
+
+    # Text in the "dnf" grammar, which the "prop" grammar also parses to an equivalent formula
+    def render(self) -> str:
+        terms: typing.List[str] = []
+        for literals in self.__term_literals():
+            term: str = literals[-1]
+            for literal in reversed(literals[:-1]):
+                term = "(" + literal + " ^ " + term + ")"
+            terms.append(term)
+        return " < ".join(terms)
+
+    # The formula the "dnf" grammar's parser would build for the rendered text, e.g. for prohibited formula checks
+    def to_formula(self) -> Formula:
+        disjunction: typing.Optional[Formula] = None
+        for literals in reversed(self.__term_literals()):
+            conjunction: Formula = backend.formula.brackets(_literal(literals[-1]))
+            for literal in reversed(literals[:-1]):
+                conjunction = Formula("_and", (_literal(literal), conjunction))
+            if disjunction is None:
+                disjunction = backend.formula.brackets(conjunction)
+            else:
+                disjunction = Formula("_or", (conjunction, disjunction))
+        return disjunction
+
+    def __term_literals(self) -> typing.List[typing.List[str]]:
+        terms: typing.List[typing.List[str]] = []
+        for positive, negative in self.terms:
+            literals: typing.List[str] = []
+            for i, name in enumerate(self.letters):
+                if positive >> i & 1:
+                    literals.append(name)
+                if negative >> i & 1:
+                    literals.append("-" + name)
+            terms.append(literals)
+        return terms
+
+
+def _literal(literal: str) -> Formula:
+    if literal[0] == "-":
+        return backend.formula.not_letter(literal[1:])
+    return backend.formula.letter(literal)
+
+
+# Recognizes the "dnf" grammar in a single pass over the text, without building a parse tree. A term is some number of
+# "(" literal "^" prefixes, a last literal, then as many ")"s, so the parser only needs to count open brackets.
+def parse_dnf(text: str) -> Dnf:
+    position: int = 0
+    length: int = len(text)
+    raw_terms: typing.List[typing.Tuple[typing.List[str], typing.List[str]]] = []
+
+    def skip_whitespace() -> int:
+        nonlocal position
+        while position < length and text[position] in WHITESPACE:
+            position += 1
+        return position
+
+    def expect(character: str) -> typing.NoReturn:
+        nonlocal position
+        if skip_whitespace() >= length or text[position] != character:
+            raise DnfSyntaxError(text, position, repr(character))
+        position += 1
+
+    def literal(positive: typing.List[str], negative: typing.List[str]) -> typing.NoReturn:
+        nonlocal position
+        literals: typing.List[str] = positive
+        if skip_whitespace() < length and text[position] == "-":
+            literals = negative
+            position += 1
+            skip_whitespace()
+        if position >= length or text[position] not in LETTERS:
+            raise DnfSyntaxError(text, position, "a letter")
+        literals.append(text[position])
+        position += 1
+
+    while True:
+        positive: typing.List[str] = []
+        negative: typing.List[str] = []
+        depth: int = 0
+        while skip_whitespace() < length and text[position] == "(":
+            position += 1
+            literal(positive, negative)
+            expect("^")
+            depth += 1
+        literal(positive, negative)
+        for _ in range(depth):
+            expect(")")
+        raw_terms.append((positive, negative))
+
+        if skip_whitespace() >= length:
+            break
+        expect("<")
+
+    letters: typing.List[str] = sorted({name for positive, negative in raw_terms for name in positive + negative})
+    bits: typing.Dict[str, int] = {name: 1 << i for i, name in enumerate(letters)}
+    return Dnf(letters, [(sum({bits[name] for name in positive}), sum({bits[name] for name in negative}))
+                         for positive, negative in raw_terms])
+
+
+# minimal DNFs are found by exhaustive search over the prime implicants left after the essential ones, up to this many
+EXACT_COVER_MAX_PRIMES: int = 16
+
+Implicant = typing.Tuple[int, int]  # (values of the fixed letters, letters that are free), over row numbers
+
+
+# The prime implicants of the function true on the given rows, by Quine-McCluskey: implicants are merged a free letter
+# at a time, and the ones that can't be merged any further are prime
+def prime_implicants(minterms: typing.Iterable[int], letter_count: int) -> typing.List[Implicant]:
+    implicants: typing.Set[Implicant] = {(minterm, 0) for minterm in minterms}
+    primes: typing.List[Implicant] = []
+    while implicants:
+        merged: typing.Set[Implicant] = set()
+        used: typing.Set[Implicant] = set()
+        for value, free in implicants:
+            for i in range(letter_count):
+                bit: int = 1 << i
+                if not (value | free) & bit and (value | bit, free) in implicants:
+                    merged.add((value, free | bit))
+                    used.add((value, free))
+                    used.add((value | bit, free))
+        primes.extend(sorted(implicants - used))
+        implicants = merged
+    return primes
+
+
+def _covers(implicant: Implicant, minterm: int) -> bool:
+    return minterm & ~implicant[1] == implicant[0]
+
+
+def _literal_count(implicant: Implicant, letter_count: int) -> int:
+    return letter_count - bin(implicant[1]).count("1")
+
+
+# Chooses as few prime implicants as possible, then as few literals as possible, that together cover every minterm.
+# Essential primes are always chosen. Whatever they leave uncovered is searched exhaustively when few primes remain,
+# and greedily otherwise.
+def minimal_cover(primes: typing.List[Implicant], minterms: typing.Iterable[int],
+                  letter_count: int) -> typing.List[Implicant]:
+    remaining: typing.Set[int] = set(minterms)
+    chosen: typing.List[Implicant] = []
+    for minterm in sorted(remaining):
+        covering: typing.List[Implicant] = [prime for prime in primes if _covers(prime, minterm)]
+        if len(covering) == 1 and covering[0] not in chosen:
+            chosen.append(covering[0])
+    remaining = {minterm for minterm in remaining if not any(_covers(prime, minterm) for prime in chosen)}
+    candidates: typing.List[Implicant] = [prime for prime in primes
+                                          if prime not in chosen and any(_covers(prime, m) for m in remaining)]
+
+    def cost(implicants: typing.Sequence[Implicant]) -> typing.Tuple[int, int]:
+        return len(implicants), sum(_literal_count(implicant, letter_count) for implicant in implicants)
+
+    if remaining and len(candidates) <= EXACT_COVER_MAX_PRIMES:
+        for size in range(1, len(candidates) + 1):
+            covers: typing.List[typing.Tuple[Implicant, ...]] = [
+                combination for combination in itertools.combinations(candidates, size)
+                if all(any(_covers(prime, minterm) for prime in combination) for minterm in remaining)]
+            if covers:
+                return chosen + list(min(covers, key=cost))
+    while remaining:
+        best: Implicant = max(candidates, key=lambda prime: (sum(_covers(prime, m) for m in remaining),
+                                                             -_literal_count(prime, letter_count)))
+        chosen.append(best)
+        remaining = {minterm for minterm in remaining if not _covers(best, minterm)}
+    return chosen
+
+
+# A minimal DNF of the function with the given truth table bitmask over letters (bit i is row i, the first letter the
+# most significant bit of the row number), or None for constant functions, which the "dnf" grammar can't express
+def minimal_dnf(signature: int, letters: typing.Sequence[str]) -> typing.Optional[Dnf]:
+    letter_count: int = len(letters)
+    minterms: typing.List[int] = [row for row in range(1 << letter_count) if signature >> row & 1]
+    if not minterms or len(minterms) == 1 << letter_count:
+        return None
+
+    terms: typing.List[Term] = []
+    for value, free in minimal_cover(prime_implicants(minterms, letter_count), minterms, letter_count):
+        positive: int = 0
+        negative: int = 0
+        for i in range(letter_count):
+            bit: int = 1 << (letter_count - 1 - i)     # the row bit of the i-th letter
+            if not free & bit:
+                if value & bit:
+                    positive |= 1 << i
+                else:
+                    negative |= 1 << i
+        terms.append((positive, negative))
+    return _without_unused_letters(Dnf(letters, terms))
+
+
+def _without_unused_letters(dnf: Dnf) -> Dnf:
+    used: int = 0
+    for positive, negative in dnf.terms:
+        used |= positive | negative
+    if used == (1 << len(dnf.letters)) - 1:
+        return dnf
+    kept: typing.List[int] = [i for i in range(len(dnf.letters)) if used >> i & 1]
+
+    def compact(mask: int) -> int:
+        return sum(1 << j for j, i in enumerate(kept) if mask >> i & 1)
+
+    return Dnf([dnf.letters[i] for i in kept], [(compact(positive), compact(negative)) for positive, negative in dnf.terms])
+
+
+# The full DNF with one term per true row, which mentions every letter, or None for contradictions
+def minterm_dnf(signature: int, letters: typing.Sequence[str]) -> typing.Optional[Dnf]:
+    letter_count: int = len(letters)
+    everything: int = (1 << letter_count) - 1
+    terms: typing.List[Term] = []
+    for row in range(1 << letter_count):
+        if signature >> row & 1:
+            positive: int = sum(1 << i for i in range(letter_count) if row >> (letter_count - 1 - i) & 1)
+            terms.append((positive, everything ^ positive))
+    if not terms:
+        return None
+    return Dnf(letters, terms)
@@ -4,12 +4,22 @@ import random
 import os
 import re
 
+from lark import LarkError
+
+import backend.artifacts
 import backend.logic_engine
+import backend.metrics
+from backend.artifacts import QuestionArtifact
+from backend.cache import LRUCache
 
 
 class Question:
+    __slots__ = ('__id', '__source', '__prompt', '__input_method', '__correct_grammar', '__correct_formula',
+                 '__prohibited_formula', '__artifact')
+
     def __init__(self, identifier: str, source: str, prompt: str, input_method: str, correct_grammar: str,
-                 correct_formula: str, prohibited_formula: str) -> typing.NoReturn:
+                 correct_formula: str, prohibited_formula: str,
+                 artifact: typing.Optional[QuestionArtifact] = None) -> typing.NoReturn:
         # User created/generated etc.
         self.__id = identifier
         self.__source: str = source
@@ -20,16 +30,20 @@ class Question:
         # The answer
         self.__correct_formula: str = correct_formula
         self.__prohibited_formula: str = prohibited_formula
+        # What marking needs from the formulas above, compiled when the question is stored
+        self.__artifact: typing.Optional[QuestionArtifact] = artifact
 
     @property
     def to_dict(self) -> dict:
-        dictionary: typing.Dict[str, str] = {'id': self.__id,
-                                             'source': self.source,
-                                             'prompt': self.prompt,
-                                             'input_method': self.input_method,
-                                             'correct_grammar': self.correct_grammar,
-                                             'correct_formula': self.correct_formula,
-                                             'prohibited_formula': self.prohibited_formula}
+        dictionary: typing.Dict[str, typing.Any] = {'id': self.__id,
+                                                    'source': self.source,
+                                                    'prompt': self.prompt,
+                                                    'input_method': self.input_method,
+                                                    'correct_grammar': self.correct_grammar,
+                                                    'correct_formula': self.correct_formula,
+                                                    'prohibited_formula': self.prohibited_formula}
+        if self.__artifact is not None:
+            dictionary['compiled'] = self.__artifact.to_dict
         return dictionary
 
     @property
@@ -64,14 +78,33 @@ class Question:
     def prohibited_formula(self) -> str:
         return self.__prohibited_formula
 
+    @property
+    def artifact(self) -> typing.Optional[QuestionArtifact]:
+        return self.__artifact
+
+    # Checks the question's formulas parse with its grammar, returning a copy of it with their artifact
+    def compiled(self) -> 'Question':
+        try:
+            artifact: QuestionArtifact = backend.logic_engine.compile_question(self.correct_formula,
+                                                                               self.prohibited_formula,
+                                                                               self.correct_grammar)
+        except (LarkError, ValueError) as error:
+            raise InvalidQuestionFormulaError(f'Question {self.id} has an invalid formula: {error}')
+        return Question(self.id, self.source, self.prompt, self.input_method, self.correct_grammar,
+                        self.correct_formula, self.prohibited_formula, artifact)
+
 
 class QuestionSet:
+    __slots__ = ('__id', '__name', '__questions', '__questions_by_id')
+
     def __init__(self, identifier: str, name: str, questions: typing.List[Question] = None) -> typing.NoReturn:
         if questions is None:
             questions = []
         self.__id: str = identifier
         self.__name: str = name
         self.__questions: typing.List[Question] = []
+        # Index of the same questions by id, for constant time lookups and duplicate checks
+        self.__questions_by_id: typing.Dict[str, Question] = {}
         for question in questions:
             self.add_question(question)
 
@@ -79,6 +112,7 @@ class QuestionSet:
         if not self.__check_question_id_unique(question.id):
             raise NonUniqueQuestionIdError
         self.__questions.append(question)
+        self.__questions_by_id[question.id] = question
 
     @property
     def id(self) -> str:
@@ -107,16 +141,10 @@ class QuestionSet:
         self.__id = identifier
 
     def __check_question_id_unique(self, identifier: str) -> bool:
-        for question in self.questions:
-            if question.id == identifier:
-                return False
-        return True
+        return identifier not in self.__questions_by_id
 
     def get_question_by_id(self, identifier: str) -> typing.Optional[Question]:
-        for question in self.questions:
-            if question.id == identifier:
-                return question
-        return None
+        return self.__questions_by_id.get(identifier)
 
 
 class NonUniqueQuestionIdError(Exception):
@@ -124,29 +152,107 @@ class NonUniqueQuestionIdError(Exception):
 
 
 class FileManager:
-    def __init__(self, data_dir):
+    # Question sets are kept in memory after their first read or write, so requests for the same few sets are served
+    # without touching the disk. Writes go through to disk before being cached. Retrieved sets are shared between
+    # callers, so they must not be modified.
+    def __init__(self, data_dir, cache_size: int = 256):
         self.data_dir = data_dir
+        self.__cache: LRUCache[str, QuestionSet] = LRUCache(cache_size)
 
+    # Storage operations are timed for /metrics, tagged with the store class and whether the cache had the set
     def retrieve_from_file(self, identifier: str, hide_answer: bool) -> QuestionSet:
-        with open(f'{self.data_dir}/{identifier}.json', 'r') as file:
-            question_contents: dict = json.load(file)
-        question: dict
+        with backend.metrics.stage('retrieve_from_file', store=type(self).__name__, cache='hit') as timer:
+            question_set: typing.Optional[QuestionSet] = self.__cache.get(identifier)
+            if question_set is None:
+                timer.labels['cache'] = 'miss'
+                question_set = self._read_set(identifier)
+                self.__cache.put(identifier, question_set)
         if hide_answer:
-            for question in question_contents['questions']:
-                if question['input_method'] == 'Text':
-                    question['correct_formula'] = ""
-                elif question['input_method'] == 'Blocks':
-                    question['correct_formula'] = self.__shuffle_answer(question['correct_formula'])
-        return dict_to_question_set(question_contents)
+            return self.hide_answers(question_set)
+        return question_set
+
+    def retrieve_question(self, set_id: str, question_id: str) -> typing.Optional[Question]:
+        return self.retrieve_from_file(set_id, hide_answer=False).get_question_by_id(question_id)
 
     # Returns id of generated question
+    # Every question is compiled first (see Question.compiled), so sets with unparsable formulas are rejected before
+    # anything is written, and the stored questions carry their artifacts
     def write_to_file(self, question_set: QuestionSet) -> str:
+        with backend.metrics.stage('write_to_file', store=type(self).__name__):
+            compiled: QuestionSet = compile_question_set(question_set)
+            identifier: str = self._write_set(compiled)
+        question_set.set_id(identifier)
+        self.__cache.put(identifier, compiled)
+        return identifier
+
+    # Storage hooks overridden by other backends, see backend.sqlite_store
+    def _read_set(self, identifier: str) -> QuestionSet:
+        with open(f'{self.data_dir}/{identifier}.json', 'r') as file:
+            question_contents: dict = json.load(file)
+        return dict_to_question_set(question_contents)
+
+    # Assigns the set a new id and stores it
+    def _write_set(self, question_set: QuestionSet) -> str:
         identifier: str = self.__generate_unique_set_id()
         question_set.set_id(identifier)
+        self._replace_set(question_set)
+        return identifier
+
+    # Stores the set under its own id, replacing any set already stored with that id
+    def _replace_set(self, question_set: QuestionSet) -> typing.NoReturn:
         file: typing.TextIO
-        with open(f'{self.data_dir}/{identifier}.json', 'w') as file:
+        with open(f'{self.data_dir}/{question_set.id}.json', 'w') as file:
             json.dump(question_set.to_dict, file, indent=1)
-        return identifier
+
+    def _set_ids(self) -> typing.Iterator[str]:
+        entry: os.DirEntry
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    yield entry.name[:-len('.json')]
+
+    # Stores a batch of already compiled sets (see compile_question_set) under new ids, or under their own ids if
+    # keep_ids is set, and returns their ids. The sets aren't cached, so a bulk import doesn't evict the sets in use.
+    def write_compiled_sets(self, question_sets: typing.List[QuestionSet], keep_ids: bool = False) -> typing.List[str]:
+        question_set: QuestionSet
+        for question_set in question_sets:
+            if keep_ids:
+                self._replace_set(question_set)
+            else:
+                self._write_set(question_set)
+            self.invalidate(question_set.id)
+        return [question_set.id for question_set in question_sets]
+
+    # Reads every stored set, one at a time and bypassing the cache, e.g. for a bulk export
+    def iter_sets(self) -> typing.Iterator[QuestionSet]:
+        identifier: str
+        for identifier in self._set_ids():
+            try:
+                yield self._read_set(identifier)
+            except FileNotFoundError:   # deleted since its id was listed
+                continue
+
+    # Drops a set from memory, e.g. after it was changed outside of this FileManager
+    def invalidate(self, identifier: str) -> typing.NoReturn:
+        self.__cache.invalidate(identifier)
+
+    @property
+    def cache_stats(self) -> typing.Dict[str, int]:
+        return self.__cache.stats
+
+    # Returns a copy of the set with text answers removed and block answers shuffled
+    def hide_answers(self, question_set: QuestionSet) -> QuestionSet:
+        questions: typing.List[Question] = []
+        question: Question
+        for question in question_set.questions:
+            correct_formula: str = question.correct_formula
+            if question.input_method == 'Text':
+                correct_formula = ""
+            elif question.input_method == 'Blocks':
+                correct_formula = self.__shuffle_answer(correct_formula)
+            questions.append(Question(question.id, question.source, question.prompt, question.input_method,
+                                      question.correct_grammar, correct_formula, question.prohibited_formula))
+        return QuestionSet(question_set.id, question_set.name, questions)
 
     def __generate_unique_set_id(self) -> str:
         while True:
@@ -175,6 +281,10 @@ class InvalidJsonFormatError(Exception):
     pass
 
 
+class InvalidQuestionFormulaError(InvalidJsonFormatError):
+    pass
+
+
 def json_to_question_set(json_string: str) -> QuestionSet:
     question_contents: dict = json.loads(json_string)
     for i in range(len(question_contents['questions'])):
@@ -192,17 +302,24 @@ def dict_to_question_set(question_set: dict) -> QuestionSet:
                                      question['input_method'],
                                      question['correct_grammar'],
                                      question['correct_formula'],
-                                     question['prohibited_formula'])
+                                     question['prohibited_formula'],
+                                     backend.artifacts.artifact_from_dict(question.get('compiled')))
                             for question in question_set['questions']])
     except KeyError:
         raise InvalidJsonFormatError("JSON formatting incorrect")
 
 
-def generate_random_questions(count: int) -> QuestionSet:
+def compile_question_set(question_set: QuestionSet) -> QuestionSet:
+    return QuestionSet(question_set.id, question_set.name, [question.compiled() for question in question_set.questions])
+
+
+# generate_question can be replaced, e.g. by QuestionPool.take to draw pre-generated questions
+def generate_random_questions(count: int, generate_question: typing.Callable[[], typing.Tuple[str, str, str, str, str]]
+                              = backend.logic_engine.generate_question) -> QuestionSet:
     questions: QuestionSet = QuestionSet("temp", "Random Question Set")
     i: int
     for i in range(count):
-        questions_tuple: typing.Tuple[str, str, str, str, str] = backend.logic_engine.generate_question()
+        questions_tuple: typing.Tuple[str, str, str, str, str] = generate_question()
         questions.add_question(
             Question(str(i), "randomly generated", questions_tuple[3], questions_tuple[4], questions_tuple[0],
                      questions_tuple[1], questions_tuple[2]))
@@ -211,16 +328,16 @@ def generate_random_questions(count: int) -> QuestionSet:
 
 def test() -> typing.NoReturn:
     file_manager: FileManager = FileManager('../data')
-    question: Question = Question('1', 'b', 'c', 'd', 'e', 'f', 'g')
-    question2: Question = Question('2', 'b', 'c', 'd', 'e', 'f', 'g')
+    question: Question = Question('1', 'example', 'Write p -> q without ->', 'Text', 'prop', '-p < q', 'p -> q')
+    question2: Question = Question('2', 'example', 'Simplify a . (a + b)', 'Blocks', 'bool', 'a', '')
     questionset: QuestionSet = QuestionSet('a', 'b', [question, question2])
     print(questionset.id, questionset.name)
     for q in questionset.questions:
         print(q.prompt)
     print(questionset.to_dict)
     print(questionset.to_json_string)
-    file_manager.write_to_file(questionset)
-    print(file_manager.retrieve_from_file('362684').questions.pop().to_dict)
+    identifier: str = file_manager.write_to_file(questionset)
+    print(file_manager.retrieve_from_file(identifier, hide_answer=False).questions[-1].to_dict)
     print(generate_random_questions(10).to_dict)
 
 
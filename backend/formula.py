@@ -0,0 +1,270 @@
+import functools
+import random
+import threading
+import typing
+import weakref
+
+from lark import Tree, Token
+
+# Formulas as a typed tree, mirroring the parse trees built by the logic engine's grammars: the operations have the
+# same names as the parse tree rules, so a Formula converts to the parse tree of its rendered text without parsing.
+
+LEAF_OPERATIONS: typing.Tuple[str, ...] = ("letter", "not_letter")
+UNARY_OPERATIONS: typing.Tuple[str, ...] = ("not_formula", "brackets")
+BINARY_OPERATIONS: typing.Tuple[str, ...] = ("_and", "_or", "implies", "equivalent")
+
+# binding strength of the binary operators, loosest first, as encoded by the LALR grammars
+PRECEDENCE: typing.Dict[str, int] = {"equivalent": 0, "implies": 1, "_or": 2, "_and": 3}
+RIGHT_ASSOCIATIVE: typing.Tuple[str, ...] = ("implies",)
+
+SYMBOLS: typing.Dict[str, typing.Dict[str, str]] = {
+    "prop": {"_and": " ^ ", "_or": " < ", "implies": " -> ", "equivalent": " <-> ", "not": "-"},
+    "bool": {"_and": " . ", "_or": " + ", "not": "-"},
+}
+
+LATEX_SYMBOLS: typing.Dict[str, typing.Dict[str, str]] = {
+    "prop": {"_and": " \\land ", "_or": " \\lor ", "implies": " \\rightarrow ", "equivalent": " \\longleftrightarrow ",
+             "not": "\\neg "},
+    "bool": {"_and": " \\cdot ", "_or": " + ", "not": "-"},
+}
+
+T = typing.TypeVar('T')
+
+# formulas with more letters than this have no truth table bitmask, as it would have more than 65536 bits
+SIGNATURE_MAX_LETTERS: int = 16
+
+
+# Formulas are immutable and hash-consed: constructing a formula equal to one that already exists returns the existing
+# node, so identical subformulas of a question set, or of many students' answers, are stored once and can be compared
+# by identity. The intern table only holds weak references, so nodes are freed once nothing else refers to them.
+class Formula:
+    __slots__ = ("op", "children", "letter", "letter_set", "size", "__signature", "__weakref__")
+
+    __interned: 'weakref.WeakValueDictionary[typing.Tuple[typing.Any, ...], Formula]' = weakref.WeakValueDictionary()
+    __lock: threading.Lock = threading.Lock()
+
+    def __new__(cls, op: str, children: typing.Tuple['Formula', ...] = (), letter: typing.Optional[str] = None):
+        key: typing.Tuple[typing.Any, ...] = (op, letter, children)    # children are interned, so they compare by identity
+        node: typing.Optional[Formula] = cls.__interned.get(key)
+        if node is not None:
+            return node
+
+        node = object.__new__(cls)
+        object.__setattr__(node, "op", op)
+        object.__setattr__(node, "children", children)
+        object.__setattr__(node, "letter", letter)
+        object.__setattr__(node, "letter_set", _union_letters(children, letter))
+        object.__setattr__(node, "size", 1 + sum(child.size for child in children))
+        object.__setattr__(node, "_Formula__signature", None)
+        with cls.__lock:
+            return cls.__interned.setdefault(key, node)
+
+    def __setattr__(self, name: str, value: typing.Any) -> typing.NoReturn:
+        raise AttributeError("Formula is immutable")
+
+    def __reduce__(self):    # rebuild through the intern table when unpickled, e.g. in a process pool worker
+        return Formula, (self.op, self.children, self.letter)
+
+    def __repr__(self) -> str:
+        return "Formula(" + repr(self.render("prop")) + ")"
+
+    @classmethod
+    def interned_count(cls) -> int:
+        return len(cls.__interned)
+
+    # Computes a value for every node bottom-up without recursion, so deeply nested formulas are fine
+    def fold(self, leaf: typing.Callable[['Formula'], T], combine: typing.Callable[['Formula', typing.List[T]], T]) -> T:
+        values: typing.List[T] = []
+        stack: typing.List[typing.Tuple[Formula, bool]] = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node.op in LEAF_OPERATIONS:
+                values.append(leaf(node))
+            elif expanded:
+                arguments: typing.List[T] = values[len(values) - len(node.children):]
+                del values[len(values) - len(node.children):]
+                values.append(combine(node, arguments))
+            else:
+                stack.append((node, True))
+                for child in reversed(node.children):
+                    stack.append((child, False))
+        return values[0]
+
+    @property
+    def letters(self) -> typing.List[str]:
+        return sorted(self.letter_set)
+
+    # The truth table over the formula's own letters as an integer, bit i holding its value in row i, where rows count
+    # up in binary with the first letter as the most significant bit. Computed once per node, None if too many letters.
+    @property
+    def signature(self) -> typing.Optional[int]:
+        if self.__signature is None and len(self.letter_set) <= SIGNATURE_MAX_LETTERS:
+            object.__setattr__(self, "_Formula__signature", self.truth_table(self.letters))
+        return self.__signature
+
+    # The truth table over the given letters, which must include all of the formula's letters, as a bitmask like
+    # signature's. Every distinct node of the DAG is evaluated once, as one big integer operation over all the rows.
+    def truth_table(self, letters: typing.List[str]) -> int:
+        row_count: int = 1 << len(letters)
+        true: int = (1 << row_count) - 1
+        columns: typing.Dict[str, int] = {name: letter_column(len(letters), position)
+                                          for position, name in enumerate(letters)}
+        values: typing.Dict[int, int] = {}
+        stack: typing.List[Formula] = [self]
+        while stack:
+            node: Formula = stack[-1]
+            if id(node) in values:
+                stack.pop()
+            elif node.op == "letter":
+                values[id(stack.pop())] = columns[node.letter]
+            elif node.op == "not_letter":
+                values[id(stack.pop())] = true ^ columns[node.letter]
+            else:
+                pending: typing.List[Formula] = [child for child in node.children if id(child) not in values]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                arguments: typing.List[int] = [values[id(child)] for child in node.children]
+                values[id(node)] = _apply(node.op, true, arguments)
+        return values[id(self)]
+
+    def render(self, grammar: str) -> str:
+        return self.__render(SYMBOLS[grammar])
+    def render_latex(self, grammar: str) -> str:
+        return self.__render(LATEX_SYMBOLS[grammar])
+
+    def __render(self, symbols: typing.Dict[str, str]) -> str:
+        def leaf(node: Formula) -> str:
+            return node.letter if node.op == "letter" else symbols["not"] + node.letter
+
+        def combine(node: Formula, children: typing.List[str]) -> str:
+            if node.op == "brackets":
+                return "(" + children[0] + ")"
+            if node.op == "not_formula":
+                return symbols["not"] + "(" + children[0] + ")"
+            return children[0] + symbols[node.op] + children[1]
+
+        return self.fold(leaf, combine)
+
+    # The parse tree the logic engine's LALR parser builds for the rendered formula
+    def to_tree(self) -> Tree:
+        return self.fold(lambda node: Tree(node.op, [Token("LETTER", node.letter)]),
+                         lambda node, children: Tree(node.op, children))
+
+
+# a node's letters, sharing a child's set when it already holds all of them, as it does for most unary operations
+def _union_letters(children: typing.Tuple[Formula, ...], letter: typing.Optional[str]) -> typing.FrozenSet[str]:
+    if not children:
+        return frozenset((letter,))
+    letter_set: typing.FrozenSet[str] = children[0].letter_set
+    for child in children[1:]:
+        if not child.letter_set <= letter_set:
+            letter_set = child.letter_set if letter_set <= child.letter_set else letter_set | child.letter_set
+    return letter_set
+
+
+# the column of the truth table for the letter at "position" out of "count", as a bitmask over the rows
+@functools.lru_cache(maxsize=None)
+def letter_column(count: int, position: int) -> int:
+    half: int = 1 << (count - 1 - position)     # the letter alternates between runs of "half" false and true rows
+    period_count: int = (1 << count) // (2 * half)
+    repeat: int = ((1 << (2 * half * period_count)) - 1) // ((1 << (2 * half)) - 1)   # a 1 at the start of each period
+    return (((1 << half) - 1) << half) * repeat
+
+
+def _apply(op: str, true: int, arguments: typing.List[int]) -> int:
+    if op == "brackets":
+        return arguments[0]
+    if op == "not_formula":
+        return true ^ arguments[0]
+    if op == "_and":
+        return arguments[0] & arguments[1]
+    if op == "_or":
+        return arguments[0] | arguments[1]
+    if op == "implies":
+        return (true ^ arguments[0]) | arguments[1]
+    if op == "equivalent":
+        return true ^ (arguments[0] ^ arguments[1])
+    raise ValueError("Unknown operation " + op)
+
+
+# Converts a parse tree of any of the logic engine's grammars to a formula without recursion, the inverse of to_tree
+def from_tree(tree: Tree) -> Formula:
+    values: typing.List[Formula] = []
+    stack: typing.List[typing.Tuple[Tree, bool]] = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if node.data in LEAF_OPERATIONS:
+            values.append(Formula(node.data, letter=node.children[0].value))
+        elif expanded:
+            children: typing.Tuple[Formula, ...] = tuple(values[len(values) - len(node.children):])
+            del values[len(values) - len(node.children):]
+            values.append(Formula(node.data, children))
+        else:
+            stack.append((node, True))
+            for child in reversed(node.children):
+                stack.append((child, False))
+    return values[0]
+
+
+def letter(name: str) -> Formula:
+    return Formula("letter", letter=name)
+
+
+def not_letter(name: str) -> Formula:
+    return Formula("not_letter", letter=name)
+
+
+def not_formula(formula: Formula) -> Formula:
+    return Formula("not_formula", (formula,))
+
+
+def brackets(formula: Formula) -> Formula:
+    return Formula("brackets", (formula,))
+
+
+# Builds a binary operation, bracketing operands where the grammar's precedence and associativity require it
+def binary(op: str, left: Formula, right: Formula) -> Formula:
+    level: int = PRECEDENCE[op]
+    if left.op in PRECEDENCE and (PRECEDENCE[left.op] < level or
+                                  (PRECEDENCE[left.op] == level and op in RIGHT_ASSOCIATIVE)):
+        left = brackets(left)
+    if right.op in PRECEDENCE and (PRECEDENCE[right.op] < level or
+                                   (PRECEDENCE[right.op] == level and op not in RIGHT_ASSOCIATIVE)):
+        right = brackets(right)
+    return Formula(op, (left, right))
+
+
+DEFAULT_WEIGHTS: typing.Dict[str, typing.Dict[str, int]] = {
+    "prop": {"not_letter": 1, "_and": 3, "_or": 3, "implies": 3, "equivalent": 3},
+    "bool": {"not_letter": 1, "_and": 3, "_or": 3},
+}
+
+
+# Generates a random formula of at most the given depth. Every binary operation is left bare, bracketed or negated
+# with equal probability, and leaves use the first 1 to len(letters) letters, chosen at random per formula.
+def generate_formula(grammar: str, depth: int, letters: typing.List[str],
+                     weights: typing.Optional[typing.Dict[str, int]] = None,
+                     rng: typing.Optional[random.Random] = None) -> Formula:
+    rng = rng or random
+    weights = weights or DEFAULT_WEIGHTS[grammar]
+    operations: typing.List[str] = list(weights)
+    operation_weights: typing.List[int] = [weights[op] for op in operations]
+    used_letters: typing.List[str] = letters[:rng.randint(1, len(letters))]
+
+    def generate(remaining: int) -> Formula:
+        if remaining <= 0:
+            return letter(rng.choice(used_letters))
+        op: str = rng.choices(operations, operation_weights)[0]
+        if op == "not_letter":
+            return not_letter(rng.choice(used_letters))
+        formula: Formula = binary(op, generate(remaining - 1), generate(remaining - 1))
+        form: int = rng.randint(0, 2)
+        if form == 1:
+            formula = brackets(formula)
+        elif form == 2:
+            formula = not_formula(formula)
+        return formula
+
+    return generate(depth)
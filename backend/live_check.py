@@ -0,0 +1,318 @@
+import threading
+import time
+import typing
+
+from lark import Lark, Token, LarkError
+from lark.parsers.lalr_interactive_parser import InteractiveParser
+
+import backend.file_manager
+import backend.logic_engine
+import backend.metrics
+from backend.cache import LRUCache
+
+# Checks answers as they are typed, for live feedback: whether the text so far is a complete formula, a formula that
+# could still be completed, or can't become one, which letters it uses, and whether it is the prohibited formula.
+# Answers aren't marked, as checking equivalence on every keystroke would cost far more than the edit.
+#
+# Each session keeps the parser state after every few tokens of its last text. A new text is only lexed and parsed
+# from the last such checkpoint that the edit can't have changed, so typing at the end of an answer costs a few tokens.
+# Clients send every edit, and the server debounces them: a check arriving soon after the previous one in its session
+# waits, and is answered with {"superseded": true} without any work if another arrives in the meantime.
+
+MAX_ANSWER_LENGTH: int = 1024
+MAX_SESSIONS: int = 4096
+# parser stack entries kept in checkpoints by all sessions together, shared out evenly between sessions
+MAX_CHECKPOINT_ENTRIES: int = 1 << 22
+CHECKPOINT_INTERVAL: int = 16
+
+SUPERSEDED: typing.Dict[str, bool] = {'superseded': True}
+
+
+class RateLimitedError(Exception):
+    pass
+
+
+class AnswerTooLongError(Exception):
+    pass
+
+
+# Allows rate checks per second on average, and bursts of up to burst checks
+class _TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: int) -> typing.NoReturn:
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+
+    # whether a check is allowed now, without taking it
+    def ready(self) -> bool:
+        now: float = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+    def take(self) -> typing.NoReturn:
+        self.tokens -= 1
+
+
+class _Checkpoint:
+    __slots__ = ('start', 'end', 'state', 'letters')
+
+    def __init__(self, start: int, end: int, state: InteractiveParser,
+                 letters: typing.FrozenSet[str]) -> typing.NoReturn:
+        self.start: int = start       # where the checkpoint's last token starts in the text
+        self.end: int = end           # and where it ends
+        # the parser state after the token, never fed anything itself. states share the subtrees on their value
+        # stacks, which is safe as parse trees are never changed once built
+        self.state: InteractiveParser = state
+        self.letters: typing.FrozenSet[str] = letters     # the letters used up to the token
+
+    @property
+    def entries(self) -> int:
+        return len(self.state.parser_state.state_stack)
+
+
+# The parse of a session's last text, as a checkpoint after every CHECKPOINT_INTERVAL tokens that parsed. Checkpoints
+# are copies of the parser's stacks, so older ones are thinned out to keep at most max_entries stack entries in all,
+# and a text that nests deeply just re-parses more of itself instead.
+class ParseState:
+    def __init__(self, parser: Lark, max_entries: int = MAX_CHECKPOINT_ENTRIES // MAX_SESSIONS) -> typing.NoReturn:
+        self.parser: Lark = parser
+        self.max_entries: int = max_entries
+        self.text: str = ''
+        self.checkpoints: typing.List[_Checkpoint] = []
+        self.entries: int = 0     # in the stacks of the checkpoints
+        self.__letters: typing.FrozenSet[str] = frozenset()
+        self.__last: typing.Optional[InteractiveParser] = None     # the state after the last token that parsed
+        self.__last_tokens: typing.List[Token] = []     # the tokens fed since the last checkpoint, to rebuild it
+        # lexing a token looks at most this many characters from its start, so tokens starting at least this far
+        # before an edit are lexed the same way after it
+        self.lookahead: int = max(terminal.pattern.max_width for terminal in parser.terminals
+                                  if terminal.name not in parser.lexer_conf.ignore)
+        self.terminals: typing.Dict[str, typing.Any] = {terminal.name: terminal for terminal in parser.terminals}
+        self.names: typing.Dict[str, str] = {terminal.name: terminal.pattern.value if terminal.pattern.type == 'str'
+                                             else terminal.name.lower() for terminal in parser.terminals}
+        self.names['$END'] = 'end'
+
+    # Returns the tree of the text if it is a complete formula, and the offset of its first bad character or token
+    # if it can't be completed, or neither if it can still be completed
+    def update(self, text: str) -> typing.Tuple[typing.Optional[typing.Any], typing.Optional[int]]:
+        unchanged: int = 0
+        for old, new in zip(self.text, text):
+            if old != new:
+                break
+            unchanged += 1
+        while self.checkpoints and self.checkpoints[-1].start + self.lookahead > unchanged:
+            self.entries -= self.checkpoints.pop().entries
+        self.text = text
+
+        position: int = self.checkpoints[-1].end if self.checkpoints else 0
+        state: InteractiveParser = self.__checkpoint_state().copy(deepcopy_values=False)
+        letters: typing.Set[str] = set(self.checkpoints[-1].letters) if self.checkpoints else set()
+        self.__last, self.__last_tokens = None, []
+        try:
+            for token in self.parser.lex(text[position:]):
+                try:
+                    state.feed_token(token)
+                except LarkError:   # the state may be part way through reducing, so the last state is rebuilt
+                    self.__letters = frozenset(letters)
+                    return None, self.__error_position(text, position + token.start_pos)
+                if token.type == 'LETTER':
+                    letters.add(token.value)
+                self.__last_tokens.append(token)
+                if len(self.__last_tokens) == CHECKPOINT_INTERVAL:
+                    self.__add_checkpoint(position + token.start_pos, position + token.end_pos, state, letters)
+        except LarkError as error:     # a character no token starts with
+            self.__letters, self.__last = frozenset(letters), state
+            return None, self.__error_position(text, position + getattr(error, 'pos_in_stream', 0))
+        self.__letters = frozenset(letters)
+        self.__last = state.copy(deepcopy_values=False)
+        try:
+            return state.feed_eof(), None
+        except LarkError:
+            return None, None
+
+    def __add_checkpoint(self, start: int, end: int, state: InteractiveParser,
+                         letters: typing.Set[str]) -> typing.NoReturn:
+        checkpoint: _Checkpoint = _Checkpoint(start, end, state.copy(deepcopy_values=False), frozenset(letters))
+        if checkpoint.entries > self.max_entries:
+            return
+        # thin out older checkpoints to make room, so the latest ones, which the next edit most likely resumes from,
+        # are kept
+        while self.entries + checkpoint.entries > self.max_entries:
+            del self.checkpoints[::2]
+            self.entries = sum(kept.entries for kept in self.checkpoints)
+        self.checkpoints.append(checkpoint)
+        self.entries += checkpoint.entries
+        self.__last_tokens = []
+
+    # None if the text from the error on is the start of a token that could come next and is still being typed,
+    # e.g. the "-" of "->"
+    def __error_position(self, text: str, position: int) -> typing.Optional[int]:
+        rest: str = text[position:]
+        if len(rest) < self.lookahead and any(literal.startswith(rest) for literal in self.__expected_literals()):
+            return None
+        return position
+
+    def __expected_literals(self) -> typing.Iterator[str]:
+        for name in self.__last_state().accepts():
+            terminal = self.terminals.get(name)
+            if terminal is not None and terminal.pattern.type == 'str':
+                yield terminal.pattern.value
+
+    def __checkpoint_state(self) -> InteractiveParser:
+        if self.checkpoints:
+            return self.checkpoints[-1].state
+        return self.parser.parse_interactive('')
+
+    def __last_state(self) -> InteractiveParser:
+        if self.__last is None:
+            self.__last = self.__checkpoint_state().copy(deepcopy_values=False)
+            for token in self.__last_tokens:
+                self.__last.feed_token(token)
+        return self.__last
+
+    # Drops the state after the last token, which isn't counted in max_entries, once the check of the text is done
+    def finish(self) -> typing.NoReturn:
+        self.__last = None
+        self.__last_tokens = []
+
+    # What could follow the tokens that parsed, for incomplete or invalid texts
+    @property
+    def expected(self) -> typing.List[str]:
+        return sorted(self.names.get(name, name) for name in self.__last_state().accepts())
+
+    @property
+    def letters(self) -> typing.List[str]:
+        return sorted(self.__letters)
+
+
+class _Session:
+    def __init__(self, parser: Lark, max_entries: int) -> typing.NoReturn:
+        self.lock: threading.Lock = threading.Lock()
+        self.parse_state: ParseState = ParseState(parser, max_entries)
+        self.arrivals: int = 0
+        self.last_arrival: float = 0.0
+
+
+# A check admitted by LiveChecker.admit, to be run with LiveChecker.check after waiting delay seconds
+class PendingCheck:
+    __slots__ = ('session', 'arrival', 'delay', 'question', 'answer')
+
+    def __init__(self, session: _Session, arrival: int, delay: float, question: backend.file_manager.Question,
+                 answer: str) -> typing.NoReturn:
+        self.session: _Session = session
+        self.arrival: int = arrival
+        self.delay: float = delay
+        self.question: backend.file_manager.Question = question
+        self.answer: str = answer
+
+
+class LiveChecker:
+    # rate and burst limit each session, and address_rate and address_burst all sessions from one client address,
+    # which are set higher as a classroom behind one NAT or proxy shares an address
+    def __init__(self, debounce: float = 0.15, rate: float = 10.0, burst: int = 20, address_rate: float = 200.0,
+                 address_burst: int = 400, max_sessions: int = MAX_SESSIONS,
+                 max_checkpoint_entries: int = MAX_CHECKPOINT_ENTRIES) -> typing.NoReturn:
+        self.debounce: float = debounce
+        self.rate: float = rate
+        self.burst: int = burst
+        self.address_rate: float = address_rate
+        self.address_burst: int = address_burst
+        # each session may keep its share of the checkpoint entries, so all of them together keep at most
+        # max_checkpoint_entries however long their answers
+        self.session_checkpoint_entries: int = max_checkpoint_entries // max_sessions
+        # sessions are kept per question, as each question has its own answer
+        self.__sessions: LRUCache[typing.Tuple[str, str, str], _Session] = LRUCache(max_sessions)
+        self.__buckets: LRUCache[typing.Tuple[str, str], _TokenBucket] = LRUCache(max_sessions)
+        self.__address_buckets: LRUCache[str, _TokenBucket] = LRUCache(max_sessions)
+        self.__lock: threading.Lock = threading.Lock()
+        self.__checked: int = 0
+        self.__superseded: int = 0
+        self.__rate_limited: int = 0
+
+    # Rate limits and debounces a check of a session's answer to a question of a set, raising RateLimitedError if the
+    # session or its client address is sending checks too quickly and AnswerTooLongError if the answer is too long to
+    # check. Clients choose their own session ids, so the address limit stops a client getting a fresh burst of checks
+    # with every new session id.
+    def admit(self, client: str, session_id: str, set_id: str, question: backend.file_manager.Question,
+              answer: str) -> PendingCheck:
+        if len(answer) > MAX_ANSWER_LENGTH:
+            raise AnswerTooLongError(f'Answers can be at most {MAX_ANSWER_LENGTH} characters long')
+        key: typing.Tuple[str, str, str] = (session_id, set_id, question.id)
+        with self.__lock:
+            bucket: _TokenBucket = self.__bucket(self.__buckets, (client, session_id), self.rate, self.burst)
+            address_bucket: _TokenBucket = self.__bucket(self.__address_buckets, client, self.address_rate,
+                                                         self.address_burst)
+            if not bucket.ready():
+                self.__rate_limited += 1
+                raise RateLimitedError(f'More than {self.rate:g} live checks per second')
+            if not address_bucket.ready():
+                self.__rate_limited += 1
+                raise RateLimitedError(f'More than {self.address_rate:g} live checks per second from this address')
+            bucket.take()
+            address_bucket.take()
+            session: typing.Optional[_Session] = self.__sessions.get(key)
+            if session is None:
+                session = _Session(backend.logic_engine.get_parser(question.correct_grammar),
+                                   self.session_checkpoint_entries)
+                self.__sessions.put(key, session)
+            now: float = time.monotonic()
+            session.arrivals += 1
+            delay: float = max(0.0, session.last_arrival + self.debounce - now)
+            session.last_arrival = now
+            return PendingCheck(session, session.arrivals, delay, question, answer)
+
+    @staticmethod
+    def __bucket(buckets: LRUCache, key: typing.Any, rate: float, burst: int) -> _TokenBucket:
+        bucket: typing.Optional[_TokenBucket] = buckets.get(key)
+        if bucket is None:
+            bucket = _TokenBucket(rate, burst)
+            buckets.put(key, bucket)
+        return bucket
+
+    # Checks the answer once the pending check's delay has passed, unless a later check of the session has arrived.
+    # The prohibited formula is compared using the question's artifact, so the reference formulas aren't parsed again.
+    def check(self, pending: PendingCheck) -> typing.Dict[str, typing.Any]:
+        session: _Session = pending.session
+        with session.lock:
+            if pending.arrival != session.arrivals:
+                with self.__lock:
+                    self.__superseded += 1
+                return SUPERSEDED
+            with backend.metrics.stage('live_check', grammar=pending.question.correct_grammar) as timer:
+                tree, error_position = session.parse_state.update(pending.answer)
+                if tree is not None:
+                    status: str = 'complete'
+                elif error_position is None:
+                    status = 'incomplete'
+                else:
+                    status = 'invalid'
+                timer.labels['status'] = status
+                result: typing.Dict[str, typing.Any] = {
+                    'status': status, 'error_position': error_position, 'letters': session.parse_state.letters,
+                    'expected': [] if tree is not None else session.parse_state.expected,
+                    'prohibited': None if tree is None else self.__is_prohibited(tree, pending.question)}
+                session.parse_state.finish()
+        with self.__lock:
+            self.__checked += 1
+        return result
+
+    @staticmethod
+    def __is_prohibited(tree: typing.Any, question: backend.file_manager.Question) -> bool:
+        if question.prohibited_formula == '':
+            return False
+        grammar: str = question.correct_grammar
+        return backend.logic_engine.is_prohibited_form(
+            backend.logic_engine.to_formula(tree),
+            lambda: backend.logic_engine.reference_prohibited_form(question.prohibited_formula, grammar,
+                                                                   question.artifact))
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        with self.__lock:
+            return {'sessions': len(self.__sessions), 'checked': self.__checked, 'superseded': self.__superseded,
+                    'rate_limited': self.__rate_limited}
+
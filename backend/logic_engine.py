@@ -1,8 +1,92 @@
-from lark import Lark, Tree, Token, Transformer, Visitor, LarkError
-from typing import Dict, Callable, List, Tuple
+from lark import Lark, Tree, Token, Transformer, LarkError
+from typing import Dict, Callable, List, Tuple, Iterator, Optional
+import numpy as np
+import hashlib
+import lark
 import random
+import os
+import re
+import io
+import sys
+import tempfile
+import threading
+
+import backend.artifacts
+import backend.canonical
+import backend.dnf
+import backend.formula
+import backend.metrics
+import backend.sat_solver
+import backend.truth_table
+from backend.cache import LRUCache
+from backend.artifacts import QuestionArtifact
+from backend.canonical import CanonicalId
+from backend.formula import Formula
+
+# the grammars below are unambiguous and encode operator precedence, so they can be parsed in linear time by LALR(1)
+# precedence from loosest to tightest: "<->", "->", "<", "^" (and "+", "." for boolean algebra), then negation
+# "->" is right associative, every other binary operator is left associative
+LALR_GRAMMARS: Dict[str, str] = {
+    "prop": r"""
+    ?formula : formula "<->" implication -> equivalent
+             | implication
+
+    ?implication : disjunction "->" implication -> implies
+                 | disjunction
+
+    ?disjunction : disjunction "<" conjunction -> _or
+                 | conjunction
+
+    ?conjunction : conjunction "^" atom -> _and
+                 | atom
+
+    ?atom : "-(" formula ")" -> not_formula
+          | "(" formula ")" -> brackets
+          | LETTER -> letter
+          | "-" LETTER -> not_letter
 
-prop_parser = Lark(r"""
+    LETTER : /[a-zA-Z]/
+
+    %import common.WS
+    %ignore WS
+""",
+    "bool": r"""
+    ?formula : formula "+" conjunction -> _or
+             | conjunction
+
+    ?conjunction : conjunction "." atom -> _and
+                 | atom
+
+    ?atom : "-(" formula ")" -> not_formula
+          | "(" formula ")" -> brackets
+          | LETTER -> letter
+          | "-" LETTER -> not_letter
+
+    LETTER : /[a-zA-Z]/
+
+    %import common.WS
+    %ignore WS
+""",
+    "dnf": r"""
+    disjunction : conjunction "<" disjunction -> _or
+                | conjunction -> brackets
+
+    conjunction : "(" literal "^" conjunction ")" -> _and
+                | literal -> brackets
+
+    literal : LETTER -> letter
+            | "-" LETTER -> not_letter
+
+    LETTER : /[a-zA-Z]/
+
+    %import common.WS
+    %ignore WS
+""",
+}
+
+# the original ambiguous grammars, kept so that the old Earley behaviour can be restored with LOGIC_ENGINE_PARSER=earley
+EARLEY_GRAMMARS: Dict[str, str] = {
+    "prop": r"""
     formula : formula"<->"formula -> equivalent
             | formula"->"formula -> implies
             | formula"<"formula -> _or
@@ -16,9 +100,8 @@ prop_parser = Lark(r"""
 
     %import common.WS
     %ignore WS
-""", start='formula')
-
-bool_parser = Lark(r"""
+""",
+    "bool": r"""
     formula : formula"+"formula -> _or
             | formula"."formula -> _and
             | "-("formula")" -> not_formula
@@ -30,224 +113,559 @@ bool_parser = Lark(r"""
 
     %import common.WS
     %ignore WS
-""", start='formula')
-
-dnf_parser = Lark(r"""
-    disjunction : conjunction"<"disjunction -> _or
-                | conjunction -> brackets
-
-    conjunction : "("literal"^"conjunction")" -> _and
-                | literal -> brackets
-
-    literal : LETTER -> letter
-            | "-"LETTER -> not_letter
-
-    LETTER : /[a-zA-Z]/
-
-    %import common.WS
-    %ignore WS
-""", start='disjunction')
-
-# evaluate tree bottom-up with logical operators based on valuation
-def evaluate_tree(tree: Tree, valuation: Dict[str, bool]) -> bool:
-    class Evaluator(Transformer):
-        def letter(self, tok: Token) -> bool:
-            return valuation[tok[0].value]
-        def brackets(self, tree: Tree) -> bool:
-            return tree[0]
-        def not_letter(self, tok: Token) -> bool:
-            return not valuation[tok[0].value]
-        def not_formula(self, tree: Tree) -> bool:
-            return not tree[0]
-        def _and(self, tree: Tree) -> bool:
-            return tree[0] and tree[1]
-        def _or(self, tree: Tree) -> bool:
-            return tree[0] or tree[1]
-        def implies(self, tree: Tree) -> bool:
-            return (not tree[0]) or tree[1]
-        def equivalent(self, tree: Tree) -> bool:
-            return ((not tree[0]) or tree[1]) and ((not tree[1]) or tree[0])
-
-    return Evaluator().transform(tree)
-
-# here we check that the user's answer is not the same as the prohibited formula
-# we take into account that the user may have simply changed the operand order of the commutative "and", "or" operators
-# and/or padded the prohibited formula with preceeding "not" operators that all cancel out
-# and/or repeated the prohibited formula with "and"s/"or"s inbetween
-def is_prohibited(user_tree: Tree, prohibited_tree: Tree) -> bool:
-    class CheckProhibited(Transformer):
-        def letter(self, tok: Token) -> str:
-            return tok[0].value
-        def brackets(self, tree: Tree) -> str:
-            return tree[0]
-        def not_letter(self, tok: Token) -> str:
-            return "NOT" + tok[0].value
-        def not_formula(self, tree: Tree) -> str:
-            return "NOT" + tree[0]
-        def _and(self, tree: Tree) -> str:
-            if tree[0] < tree[1]:   # sort operand order based on alphabetical order, so user cannot simply swap operands
-                return "AND(" + tree[0] + "," + tree[1] + ")"
-            else:
-                return "AND(" + tree[1] + "," + tree[0] + ")"
-        def _or(self, tree: Tree) -> str:
-            if tree[0] < tree[1]:
-                return "OR(" + tree[0] + "," + tree[1] + ")"
-            else:
-                return "OR(" + tree[1] + "," + tree[0] + ")"
-        def implies(self, tree: Tree) -> str:
-            return "IMPLIES(" + tree[0] + "," + tree[1] + ")"
-        def equivalent(self, tree: Tree) -> str:
-            return "EQUIVALENT(" + tree[0] + "," + tree[1] + ")"
-    
-    prohibited_check = CheckProhibited().transform(prohibited_tree)
-
-    class CheckProhibitedUser(CheckProhibited):
-        def not_letter(self, tok: Token) -> str:
-            t = tok[0].value
-            if t[:3] == "NOT":  # cancel out "not"s to prevent user from padding prohibited formula with these
-                return t[3:]
-            return "NOT" + t
-        def not_formula(self, tree: Tree) -> str:
-            t = tree[0]
-            if t[:3] == "NOT":
-                return t[3:]
-            return "NOT" + t
-        def _and(self, tree: Tree) -> str:
-            if tree[0] == prohibited_check and tree[1] == prohibited_check:  # prevent user from repeating prohibited formula with "and" inbetween
-                return tree[0]
-            if tree[0] < tree[1]:   # sort operand order based on alphabetical order, so user cannot simply swap operands
-                return "AND(" + tree[0] + "," + tree[1] + ")"
+""",
+    "dnf": LALR_GRAMMARS["dnf"],    # the DNF grammar was already unambiguous
+}
+
+START_RULES: Dict[str, str] = {"prop": "formula", "bool": "formula", "dnf": "disjunction"}
+
+PARSER_ALGORITHM: str = os.environ.get("LOGIC_ENGINE_PARSER", "lalr")
+
+# building a grammar's LALR tables takes tens of milliseconds per grammar, so parsers are built on first use rather
+# than on import, and the built tables are saved in PARSER_CACHE_DIR for other processes to load instead of rebuilding
+# cache files are named by a hash of everything the tables are built from, so an edited grammar or another Lark or
+# Python version never loads stale tables. they are unpickled when loaded, so the directory must only be writable by
+# the server. set LOGIC_LEARNER_PARSER_CACHE to "" to always build the parsers
+PARSER_CACHE_DIR: str = os.environ.get("LOGIC_LEARNER_PARSER_CACHE",
+                                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "parsers"))
+
+def build_parser(grammar: str, algorithm: str = PARSER_ALGORITHM) -> Lark:
+    if algorithm == "lalr":
+        if PARSER_CACHE_DIR == "":
+            return Lark(LALR_GRAMMARS[grammar], start=START_RULES[grammar], parser="lalr")
+        path = parser_cache_path(grammar)
+        parser = load_cached_parser(path)
+        if parser is None:
+            parser = Lark(LALR_GRAMMARS[grammar], start=START_RULES[grammar], parser="lalr")
+            save_cached_parser(parser, path)
+        return parser
+    elif algorithm == "earley":     # Lark can only save LALR tables
+        return Lark(EARLEY_GRAMMARS[grammar], start=START_RULES[grammar], parser="earley")
+    raise ValueError("Unknown parser algorithm " + algorithm)
+
+def parser_cache_path(grammar: str) -> str:
+    key = "\0".join([LALR_GRAMMARS[grammar], START_RULES[grammar], lark.__version__, sys.version])
+    return os.path.join(PARSER_CACHE_DIR, grammar + "-" + hashlib.sha256(key.encode()).hexdigest()[:16] + ".lark")
+
+def load_cached_parser(path: str) -> Optional[Lark]:
+    try:
+        with open(path, "rb") as file:
+            return Lark.load(file)
+    except Exception:   # a missing, unreadable or corrupt cache file is rebuilt and replaced
+        return None
+
+# written to a temporary file and renamed into place, so processes starting at the same time never load half a file
+# the cache is only an optimisation, so failing to write it (e.g. a read-only install) isn't an error
+def save_cached_parser(parser: Lark, path: str):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                parser.save(file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+    except OSError:
+        pass
+
+parsers: Dict[str, Lark] = {}
+parsers_lock = threading.Lock()
+
+# any grammar other than "prop" and "dnf" is read as Boolean algebra
+def get_parser(grammar: str) -> Lark:
+    if grammar not in ("prop", "dnf"):
+        grammar = "bool"
+    parser = parsers.get(grammar)
+    if parser is None:
+        with parsers_lock:
+            parser = parsers.get(grammar)
+            if parser is None:
+                parser = parsers[grammar] = build_parser(grammar)
+    return parser
+
+# prop_parser, bool_parser and dnf_parser are still module attributes, built when they are first read
+PARSER_ATTRIBUTES: Dict[str, str] = {"prop_parser": "prop", "bool_parser": "bool", "dnf_parser": "dnf"}
+
+def __getattr__(name: str):
+    if name in PARSER_ATTRIBUTES:
+        return get_parser(PARSER_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# compiled formulas are built from a postfix program over the parse tree, each instruction being (operation, argument)
+# the operations only use bitwise operators, with "true" passed in as the all-ones value, so the same compiled formula
+# can evaluate a single valuation of bools, or many valuations at once given integers or arrays of truth values
+_OPERATIONS: Dict[str, str] = {
+    "not_formula": "(true ^ {0})",
+    "_and": "({0} & {1})",
+    "_or": "({0} | {1})",
+    "implies": "((true ^ {0}) | {1})",
+    "equivalent": "(true ^ ({0} ^ {1}))",
+}
+
+def _postfix_program(formula: Formula) -> List[Tuple[str, str]]:
+    program = []
+    stack = [(formula, False)]
+    while stack:    # iterative post-order walk, so deeply nested formulas can't hit the recursion limit
+        node, expanded = stack.pop()
+        if node.op == "letter":
+            program.append(("letter", node.letter))
+        elif node.op == "not_letter":
+            program.append(("letter", node.letter))
+            program.append(("not_formula", None))
+        elif node.op == "brackets":
+            stack.append((node.children[0], False))
+        elif expanded:
+            program.append((node.op, None))
+        else:
+            stack.append((node, True))
+            for child in reversed(node.children):
+                stack.append((child, False))
+    return program
+
+# turns a formula into a reusable function of its letters, so evaluating it doesn't walk the formula every time
+class CompiledFormula:
+    __slots__ = ("letters", "program", "function")
+
+    def __init__(self, formula: Formula):
+        program = _postfix_program(formula)
+        self.letters: Tuple[str, ...] = tuple(formula.letters)
+        indices = {l: i for i, l in enumerate(self.letters)}
+        self.program: List[Tuple[str, int]] = [(op, indices[arg] if op == "letter" else None) for op, arg in program]
+
+        try:
+            self.function: Callable[..., bool] = eval(self.__source())
+        except (SyntaxError, RecursionError, MemoryError):  # too deeply nested for the Python compiler, so interpret the program instead
+            self.function = self.__run_program
+
+    def __source(self) -> str:
+        stack = []
+        for op, arg in self.program:
+            if op == "letter":
+                stack.append("_" + self.letters[arg])
+            elif op == "not_formula":
+                stack.append(_OPERATIONS[op].format(stack.pop()))
             else:
-                return "AND(" + tree[1] + "," + tree[0] + ")"
-        def _or(self, tree: Tree) -> str:
-            if tree[0] == prohibited_check and tree[1] == prohibited_check:  # prevent user from repeating prohibited formula with "or" inbetween
-                return tree[0]
-            if tree[0] < tree[1]:
-                return "OR(" + tree[0] + "," + tree[1] + ")"
+                right = stack.pop()
+                stack.append(_OPERATIONS[op].format(stack.pop(), right))
+        return "lambda " + ", ".join(["true"] + ["_" + l for l in self.letters]) + ": " + stack[0]
+
+    def __run_program(self, true, *columns):
+        stack = []
+        for op, arg in self.program:
+            if op == "letter":
+                stack.append(columns[arg])
+            elif op == "not_formula":
+                stack.append(true ^ stack.pop())
             else:
-                return "OR(" + tree[1] + "," + tree[0] + ")"
+                right = stack.pop()
+                left = stack.pop()
+                if op == "_and":
+                    stack.append(left & right)
+                elif op == "_or":
+                    stack.append(left | right)
+                elif op == "implies":
+                    stack.append((true ^ left) | right)
+                else:
+                    stack.append(true ^ (left ^ right))
+        return stack[0]
+
+    # "columns" holds one value per letter, in the order of self.letters
+    def evaluate(self, true, columns):
+        return self.function(true, *columns)
+
+    def __call__(self, valuation: Dict[str, bool]) -> bool:
+        return bool(self.function(True, *[valuation[l] for l in self.letters]))
+
+# parse trees are converted to hash-consed formulas once, and every other step works on those
+def to_formula(tree: Tree) -> Formula:
+    return backend.formula.from_tree(tree)
+
+def compile_tree(tree: Tree) -> CompiledFormula:
+    return CompiledFormula(to_formula(tree))
+
+# evaluate tree with logical operators based on valuation
+def evaluate_tree(tree: Tree, valuation: Dict[str, bool]) -> bool:
+    return compile_tree(tree)(valuation)
+
+# truth tables are evaluated a chunk of rows at a time, with one boolean array per letter, so each operator in a
+# compiled formula becomes a single array operation over the whole chunk while memory stays bounded for many letters
+TRUTH_TABLE_CHUNK_ROWS: int = 1 << 16
+
+# rows are numbered in binary order with the first letter as the most significant bit, so row 0 is all false
+def valuation_columns(letters: List[str], start: int, stop: int) -> Dict[str, np.ndarray]:
+    return row_columns(letters, np.arange(start, stop, dtype=np.uint64))
+
+# the columns for any given row numbers
+def row_columns(letters: List[str], rows: np.ndarray) -> Dict[str, np.ndarray]:
+    shift = len(letters)-1
+    return {l: ((rows >> np.uint64(shift-i)) & np.uint64(1)).astype(bool) for i, l in enumerate(letters)}
+
+def iter_valuation_columns(letters: List[str], chunk_rows: int = TRUTH_TABLE_CHUNK_ROWS) -> Iterator[Dict[str, np.ndarray]]:
+    row_count = 1 << len(letters)
+    for start in range(0, row_count, chunk_rows):
+        yield valuation_columns(letters, start, min(start+chunk_rows, row_count))
+
+def evaluate_columns(compiled: CompiledFormula, columns: Dict[str, np.ndarray]) -> np.ndarray:
+    return compiled.evaluate(True, [columns[l] for l in compiled.letters])
+
+TRUTH_TABLE_ORDERS: List[str] = ["binary", "gray"]
+
+# yields the rows of a formula's truth table over letters lazily, a chunk at a time, as (valuation, value) pairs
+# "binary" order counts up with the first letter most significant, "gray" order changes one letter between rows
+# start and stop select a slice of rows by their position in that order, for pagination
+def iter_truth_table_rows(compiled: CompiledFormula, letters: List[str], order: str = "binary", start: int = 0,
+                          stop: Optional[int] = None) -> Iterator[Tuple[Tuple[bool, ...], bool]]:
+    if order not in TRUTH_TABLE_ORDERS:
+        raise ValueError("Unknown truth table order " + order)
+    row_count = 1 << len(letters)
+    stop = row_count if stop is None else min(stop, row_count)
+
+    for chunk_start in range(start, stop, TRUTH_TABLE_CHUNK_ROWS):
+        positions = np.arange(chunk_start, min(chunk_start+TRUTH_TABLE_CHUNK_ROWS, stop), dtype=np.uint64)
+        rows = positions ^ (positions >> np.uint64(1)) if order == "gray" else positions
+        columns = row_columns(letters, rows)
+        values = evaluate_columns(compiled, columns).tolist()
+        valuations = np.column_stack([columns[l] for l in letters]).tolist()
+        for valuation, value in zip(valuations, values):
+            yield tuple(valuation), value
+
+# the whole truth table of a formula over "letters" (which must include all of its letters), in binary row order
+def evaluate_truth_table(tree: Tree, letters: List[str]) -> np.ndarray:
+    compiled = compile_tree(tree)
+    return np.concatenate([evaluate_columns(compiled, columns) for columns in iter_valuation_columns(letters)])
+
+# here we check that the user's answer is not the same as the prohibited formula, by comparing canonical ids
+# we take into account that the user may have simply changed the operand order (or grouping) of the "and", "or" operators
+# and/or padded the prohibited formula with "not" operators that all cancel out
+# and/or repeated the prohibited formula with "and"s/"or"s inbetween
+# see backend.canonical for the full list
+def prohibited_form(prohibited: Formula) -> CanonicalId:
+    return backend.canonical.canonical_id(prohibited)
+
+# both ids have to come from the same generation of the canonical table, so we try again if it was cleared inbetween
+def is_prohibited_form(user: Formula, get_prohibited_check: Callable[[], CanonicalId]) -> bool:
+    while True:
+        user_check = backend.canonical.canonical_id(user)
+        prohibited_check = get_prohibited_check()
+        if user_check[0] == prohibited_check[0]:
+            return user_check == prohibited_check
 
-    if CheckProhibitedUser().transform(user_tree) == prohibited_check:
+def is_prohibited(user_tree: Tree, prohibited_tree: Tree) -> bool:
+    prohibited = to_formula(prohibited_tree)
+    return is_prohibited_form(to_formula(user_tree), lambda: prohibited_form(prohibited))
+
+# formulas with more letters than this are compared with the SAT solver, rather than by enumerating their truth tables
+TRUTH_TABLE_MAX_LETTERS: int = backend.formula.SIGNATURE_MAX_LETTERS
+
+# the SAT solver gives up on formulas that take more conflicts than this to decide, raising
+# backend.sat_solver.SolverBudgetExceeded, so marking them can't hold on to a request thread forever
+SAT_MAX_CONFLICTS: int = int(os.environ.get("LOGIC_ENGINE_SAT_MAX_CONFLICTS", "100000"))
+
+# finds a valuation of the letters of f1 and f2 under which they disagree, or returns None if they are equivalent
+def find_counterexample(f1_tree: Tree, f2_tree: Tree) -> Optional[Dict[str, bool]]:
+    return find_compiled_counterexample(compile_tree(f1_tree), compile_tree(f2_tree))
+
+def find_compiled_counterexample(f1: CompiledFormula, f2: CompiledFormula) -> Optional[Dict[str, bool]]:
+    letters = sorted(set(f1.letters) | set(f2.letters))
+
+    if len(letters) <= TRUTH_TABLE_MAX_LETTERS:
+        for columns in iter_valuation_columns(letters):
+            differences = np.flatnonzero(evaluate_columns(f1, columns) != evaluate_columns(f2, columns))
+            if len(differences) > 0:
+                return {l: bool(column[differences[0]]) for l, column in columns.items()}
+        return None
+
+    indices = {l: i for i, l in enumerate(letters)}
+    def shared_program(f: CompiledFormula) -> List[Tuple[str, int]]:    # renumber letters so both formulas share them
+        return [(op, indices[f.letters[arg]] if op == "letter" else None) for op, arg in f.program]
+
+    values = backend.sat_solver.find_difference(shared_program(f1), shared_program(f2), len(letters), SAT_MAX_CONFLICTS)
+    if values is None:
+        return None
+    return dict(zip(letters, values))
+
+def check_equivalent(f1_tree: Tree, f2_tree: Tree) -> bool:
+    return check_formulas_equivalent(to_formula(f1_tree), to_formula(f2_tree))
+
+# formulas with few letters are compared by their truth table bitmasks, which are cached on their nodes
+# formulas are compared over the union of their letters, so e.g. "p" and "p ^ (q < -q)" are equivalent, and their
+# bitmasks can only be compared when they have the same letters
+def check_formulas_equivalent(f1: Formula, f2: Formula) -> bool:
+    if f1 is f2:
         return True
-    return False
-
-def check_equivalent(f1_tree: str, f2_tree: str) -> bool:
-    class GetLetters(Visitor):
-        letters = set()
-        def letter(self, tree: Tree):
-            self.letters.add(tree.children[0].value)
-        def not_letter(self, tree: Tree):
-            self.letters.add(tree.children[0].value)
-
-    f1_visitor = GetLetters()
-    f2_visitor = GetLetters()
-    f1_visitor.visit(f1_tree)
-    f2_visitor.visit(f2_tree)
-
-    if f1_visitor.letters != f2_visitor.letters:    # if f1 and f2 don't contain the same variable letters, they cannot be equivalent
-        return False
-
-    def test_valuation(valuation: Dict[str, bool], letters: List[str], i: int) -> bool:
-        if evaluate_tree(f1_tree, valuation) != evaluate_tree(f2_tree, valuation):
-            return False
-        
-        valuation_copy = valuation.copy()
-        valuation_copy[letters[i]] = not valuation[letters[i]]   # negate truth value of letter i
-
-        if evaluate_tree(f1_tree, valuation_copy) != evaluate_tree(f2_tree, valuation_copy):  # test with this different valuation
-            return False
-
-        if i == 0:  # tested all possible valuations
-            return True
-
-        return test_valuation(valuation, letters, i-1) and test_valuation(valuation_copy, letters, i-1)     # recursively test all possible valuations
-
-    valuation = {}
-    for l in f1_visitor.letters:
-        valuation[l] = False
-    letters = list(valuation.keys())
-
-    return test_valuation(valuation, letters, len(valuation)-1)
-
-def validate_answer(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str) -> str:
-    answer_parser = None
-    correct_parser = None
-    answer_tree  = None
-    correct_tree = None
+    if f1.letter_set == f2.letter_set and len(f1.letter_set) <= TRUTH_TABLE_MAX_LETTERS:
+        return f1.signature == f2.signature
+    return find_compiled_counterexample(CompiledFormula(f1), CompiledFormula(f2)) is None
+
+def check_compiled_equivalent(f1: CompiledFormula, f2: CompiledFormula) -> bool:
+    return find_compiled_counterexample(f1, f2) is None
+
+# the truth table of a compiled formula over its own letters as an integer, with bit i holding the value in row i
+# formulas with too many letters have no signature and have to be compared with the SAT solver instead
+def truth_table_signature(compiled: CompiledFormula) -> Optional[int]:
+    if len(compiled.letters) > TRUTH_TABLE_MAX_LETTERS:
+        return None
+    values = np.concatenate([evaluate_columns(compiled, columns) for columns in iter_valuation_columns(list(compiled.letters))])
+    return int.from_bytes(np.packbits(values, bitorder="little").tobytes(), "little")
+
+# reference formulas (correct and prohibited answers) are fixed for a stored question, so everything derived from
+# them is cached, keyed by the grammar they are parsed with and their source text
+FORMULA_CACHE_SIZE: int = int(os.environ.get("LOGIC_ENGINE_CACHE_SIZE", "4096"))
+
+# formulas are cached as hash-consed nodes rather than parse trees, so questions sharing subformulas share their nodes,
+# and a formula's letters and truth table bitmask are computed once and kept on its node
+formula_cache: LRUCache[Tuple[str, str], Formula] = LRUCache(FORMULA_CACHE_SIZE)
+compile_cache: LRUCache[Tuple[str, str], CompiledFormula] = LRUCache(FORMULA_CACHE_SIZE)
+prohibited_cache: LRUCache[Tuple[str, str], CanonicalId] = LRUCache(FORMULA_CACHE_SIZE)
+
+def parse_formula(formula: str, grammar: str) -> Formula:
+    return formula_cache.get_or_compute((grammar, formula), lambda: to_formula(get_parser(grammar).parse(formula)))
+
+def compile_formula(formula: str, grammar: str) -> CompiledFormula:
+    return compile_cache.get_or_compute((grammar, formula), lambda: CompiledFormula(parse_formula(formula, grammar)))
+
+def formula_signature(formula: str, grammar: str) -> Optional[int]:
+    return parse_formula(formula, grammar).signature
+
+def formula_prohibited_form(formula: str, grammar: str) -> CanonicalId:
+    return _cached_prohibited_form((grammar, formula), lambda: prohibited_form(parse_formula(formula, grammar)))
+
+def _cached_prohibited_form(key: Tuple[str, str], compute: Callable[[], CanonicalId]) -> CanonicalId:
+    prohibited_check = prohibited_cache.get_or_compute(key, compute)
+    if prohibited_check[0] != backend.canonical.canonical_table.generation:    # the canonical table was cleared since
+        prohibited_check = compute()
+        prohibited_cache.put(key, prohibited_check)
+    return prohibited_check
+
+# questions are compiled once when they are stored, checking their formulas parse and keeping what marking needs to
+# know about them in an artifact (see backend.artifacts), so marking them never has to parse their reference formulas
+QUESTION_GRAMMARS: List[str] = ["prop", "bool", "dnf"]
+
+def compile_question(correct_formula: str, prohibited_formula: str, grammar: str) -> QuestionArtifact:
+    if grammar not in QUESTION_GRAMMARS:
+        raise ValueError("Unknown grammar " + grammar)
+    correct = parse_formula(correct_formula, "prop" if grammar == "dnf" else grammar)
+    prohibited = None
+    if prohibited_formula != "":
+        prohibited = backend.canonical.canonical_text(parse_formula(prohibited_formula, grammar))
+    return QuestionArtifact(correct.letters, correct.signature, prohibited)
+
+# the letters and truth table bitmask of a question's correct formula, from its artifact when it has one
+def reference_formula(correct_formula: str, grammar: str, artifact: Optional[QuestionArtifact] = None) -> Tuple[frozenset, Optional[int]]:
+    if artifact is not None:
+        return frozenset(artifact.letters), artifact.signature
+    correct = parse_formula(correct_formula, "prop" if grammar == "dnf" else grammar)
+    return correct.letter_set, correct.signature
+
+def reference_prohibited_form(prohibited_formula: str, grammar: str, artifact: Optional[QuestionArtifact] = None) -> CanonicalId:
+    if artifact is None or artifact.prohibited_form is None:
+        return formula_prohibited_form(prohibited_formula, grammar)
+    return _cached_prohibited_form(("canonical", artifact.prohibited_form),
+                                   lambda: backend.canonical.canonical_id_from_text(artifact.prohibited_form))
+
+# many students submit the same answer to the same question, so verdicts are memoized per question and answer
+# answers are normalized first by trimming and collapsing whitespace, which never changes how they parse
+VERDICT_CACHE_SIZE: int = int(os.environ.get("LOGIC_ENGINE_VERDICT_CACHE_SIZE", "65536"))
+
+# the verdict for answers whose marking was given up on, here or by backend.marking_executor
+MARKING_TIMED_OUT: str = "Marking timed out. Correct answer was "
+
+verdict_cache: LRUCache[Tuple[str, str, str, str], str] = LRUCache(VERDICT_CACHE_SIZE)
+
+# only the whitespace the grammars ignore (common.WS), as answers with any other whitespace must still fail to parse
+IGNORED_WHITESPACE: re.Pattern = re.compile(r"[ \t\f\r\n]+")
+
+def normalize_answer(answer_formula: str) -> str:
+    return IGNORED_WHITESPACE.sub(" ", answer_formula).strip(" ")
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"formula": formula_cache.stats, "compile": compile_cache.stats,
+            "prohibited": prohibited_cache.stats, "verdict": verdict_cache.stats,
+            "interned": {"size": Formula.interned_count()}}
+
+def verdict_key(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str) -> Tuple[str, str, str, str]:
+    return (grammar, correct_formula, prohibited_formula, normalize_answer(answer_formula))
+
+# a question's artifact, if given, must have been compiled from the same formulas
+def validate_answer(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+                    artifact: Optional[QuestionArtifact] = None) -> str:
+    answer_formula = normalize_answer(answer_formula)
+    with backend.metrics.stage("validate_answer", grammar=grammar):
+        key = verdict_key(answer_formula, correct_formula, prohibited_formula, grammar)
+        verdict = verdict_cache.get(key)
+        if verdict is None:
+            verdict = mark_answer(answer_formula, correct_formula, prohibited_formula, grammar, artifact)
+            if not verdict.startswith(MARKING_TIMED_OUT):   # a timeout may not happen next time, so don't cache it
+                verdict_cache.put(key, verdict)
+        return verdict
+
+# validates many answers to the same question, marking each distinct answer once
+def validate_answers(answer_formulas: List[str], correct_formula: str, prohibited_formula: str, grammar: str,
+                     artifact: Optional[QuestionArtifact] = None) -> List[str]:
+    verdicts = {}
+    for answer_formula in answer_formulas:
+        answer_formula = normalize_answer(answer_formula)
+        if answer_formula not in verdicts:
+            verdicts[answer_formula] = validate_answer(answer_formula, correct_formula, prohibited_formula, grammar, artifact)
+    return [verdicts[normalize_answer(answer_formula)] for answer_formula in answer_formulas]
+
+# validates an answer without consulting the verdict cache
+# each stage is timed for /metrics, tagged with the grammar and, once the correct formula is known, its letter count
+def mark_answer(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+                artifact: Optional[QuestionArtifact] = None) -> str:
+    if grammar == "dnf":
+        return mark_dnf_answer(answer_formula, correct_formula, prohibited_formula, artifact)
 
     has_prohibited = prohibited_formula != ""
-    prohibited_tree = None
 
-    if grammar == "prop":
-        answer_parser = correct_parser = prop_parser
-    elif grammar == "dnf":
-        answer_parser = dnf_parser
-        correct_parser = prop_parser
+    try:
+        with backend.metrics.stage("parse_answer", grammar=grammar):
+            answer = to_formula(get_parser(grammar).parse(answer_formula))
+        with backend.metrics.stage("reference_formulas", grammar=grammar):
+            correct_letters, correct_signature = reference_formula(correct_formula, grammar, artifact)
+            if has_prohibited:
+                reference_prohibited_form(prohibited_formula, grammar, artifact)
+    except LarkError:
+        return _verdict(grammar, "parse_error", "Parse error. Correct answer was " + correct_formula)
+
+    letters = len(correct_letters)
+    if has_prohibited:
+        with backend.metrics.stage("is_prohibited", grammar=grammar, letters=letters):
+            prohibited = is_prohibited_form(answer, lambda: reference_prohibited_form(prohibited_formula, grammar, artifact))
+        if prohibited:
+            return _verdict(grammar, "prohibited", "Prohibited formula. Correct answer was " + correct_formula)
+
+    with backend.metrics.stage("check_equivalent", grammar=grammar, letters=letters):
+        if answer.letter_set == correct_letters and correct_signature is not None:
+            equivalent = answer.signature == correct_signature
+        else:   # answers with other letters can still be equivalent, e.g. if they add a tautology
+            try:
+                equivalent = check_compiled_equivalent(CompiledFormula(answer), compile_formula(correct_formula, grammar))
+            except backend.sat_solver.SolverBudgetExceeded:
+                return _verdict(grammar, "timed_out", MARKING_TIMED_OUT + correct_formula)
+
+    if equivalent:
+        return _verdict(grammar, "correct", "Correct")
     else:
-        answer_parser = correct_parser = bool_parser
+        return _verdict(grammar, "incorrect", "Incorrect. Correct answer was " + correct_formula)
+
+# DNF answers are read by backend.dnf's single pass parser straight into bitmasks of literals, and compared with the
+# correct formula by the rows their terms cover, without building a parse tree unless there is a prohibited formula
+def mark_dnf_answer(answer_formula: str, correct_formula: str, prohibited_formula: str,
+                    artifact: Optional[QuestionArtifact] = None) -> str:
+    has_prohibited = prohibited_formula != ""
 
     try:
-        answer_tree  = answer_parser.parse(answer_formula)
-        correct_tree = correct_parser.parse(correct_formula)
-        if has_prohibited:
-            prohibited_tree = answer_parser.parse(prohibited_formula)
+        with backend.metrics.stage("parse_answer", grammar="dnf"):
+            answer = backend.dnf.parse_dnf(answer_formula)
+        with backend.metrics.stage("reference_formulas", grammar="dnf"):
+            correct_letters, correct_signature = reference_formula(correct_formula, "dnf", artifact)
+            if has_prohibited:
+                reference_prohibited_form(prohibited_formula, "dnf", artifact)
     except LarkError:
-        return "Parse error. Correct answer was " + correct_formula
-
-    if has_prohibited and is_prohibited(answer_tree, prohibited_tree):
-        return "Prohibited formula. Correct answer was " + correct_formula
+        return _verdict("dnf", "parse_error", "Parse error. Correct answer was " + correct_formula)
+
+    letters = len(correct_letters)
+    if has_prohibited:
+        with backend.metrics.stage("is_prohibited", grammar="dnf", letters=letters):
+            prohibited = is_prohibited_form(answer.to_formula(), lambda: reference_prohibited_form(prohibited_formula, "dnf", artifact))
+        if prohibited:
+            return _verdict("dnf", "prohibited", "Prohibited formula. Correct answer was " + correct_formula)
+
+    with backend.metrics.stage("check_equivalent", grammar="dnf", letters=letters):
+        if frozenset(answer.letters) == correct_letters and correct_signature is not None:
+            equivalent = answer.signature == correct_signature
+        else:
+            try:
+                equivalent = check_formulas_equivalent(answer.to_formula(), parse_formula(correct_formula, "prop"))
+            except backend.sat_solver.SolverBudgetExceeded:
+                return _verdict("dnf", "timed_out", MARKING_TIMED_OUT + correct_formula)
 
-    if check_equivalent(answer_tree, correct_tree):
-        return "Correct"
+    if equivalent:
+        return _verdict("dnf", "correct", "Correct")
     else:
-        return "Incorrect. Correct answer was " + correct_formula
+        return _verdict("dnf", "incorrect", "Incorrect. Correct answer was " + correct_formula)
+
+def _verdict(grammar: str, kind: str, verdict: str) -> str:
+    backend.metrics.registry.increment(backend.metrics.VERDICTS, {"grammar": grammar, "verdict": kind})
+    return verdict
+
+# a DNF of a formula to give as its correct answer: a minimal one if that mentions every letter of the formula, as
+# answers have to, otherwise the one with a term per true row; None if the formula is constant or has too many letters
+def reference_dnf(formula: Formula) -> Optional[str]:
+    if formula.signature is None:
+        return None
+    dnf = backend.dnf.minimal_dnf(formula.signature, formula.letters)
+    if dnf is None:
+        return None
+    if len(dnf.letters) != len(formula.letter_set):
+        dnf = backend.dnf.minterm_dnf(formula.signature, formula.letters)
+    return dnf.render()
 
 def gen_truth_table(f: str, letters: List[str], grammar: str):
     tree = None
     if grammar == "prop":
-        tree = prop_parser.parse(f)
+        tree = get_parser("prop").parse(f)
     else:
-        tree = bool_parser.parse(f)
-    
-    truth_table = set()
-    def evaluate(valuation: Dict[str, bool], i: int):
-        truth_table.add((tuple(valuation.values()), evaluate_tree(tree, valuation)))
-
-        valuation_copy = valuation.copy()
-        valuation_copy[letters[i]] = not valuation[letters[i]]
-
-        truth_table.add((tuple(valuation_copy.values()), evaluate_tree(tree, valuation_copy)))
-
-        if i == 0:
-            return
-
-        evaluate(valuation, i-1)
-        evaluate(valuation_copy, i-1)
-
-    valuation = {}
-    for l in letters:
-        valuation[l] = False
-    evaluate(valuation, len(letters)-1)
-
-    table_str = "<table class ='table'><thead><tr>"
-    for l in letters:
-        table_str += "<th scope='col'>\\(" + l + "\\)</th>"
-    table_str += "<th scope='col'>\\(?\\)</th></tr></thead><tbody>"
-    for v in truth_table:
-        table_str += "<tr>"
-        for t in v[0]:
-            table_str += "<td>" + ("\\(0\\)" if not t else "\\(1\\)") + "</td>"
-        table_str += "<td>" + ("\\(0\\)" if not v[1] else "\\(1\\)") + "</td>"
-        table_str += "</tr>"
+        tree = get_parser("bool").parse(f)
+    return gen_truth_table_tree(tree, letters)
+
+def gen_truth_table_tree(tree: Tree, letters: List[str]) -> str:
+    return gen_truth_table_formula(to_formula(tree), letters)
+
+def gen_truth_table_formula(formula: Formula, letters: List[str]) -> str:
+    table = io.StringIO()
+    backend.truth_table.write_html(iter_truth_table_rows(CompiledFormula(formula), letters), letters, table)
+    return table.getvalue()
+
+TRUTH_TABLE_MAX_PAGE_SIZE: int = 4096
+
+# raised for truth table requests that can't be answered, e.g. a missing or unparsable formula or a negative page
+class InvalidTruthTableRequestError(ValueError):
+    pass
+
+# renders one page of a formula's truth table over its own letters, as "html", "json" or "bits"
+# json pages also say where they are in the table, so clients know when they have fetched every page
+def render_truth_table_page(formula: str, grammar: str, output_format: str = "json", order: str = "binary",
+                            page: int = 0, page_size: int = 256) -> str:
+    if formula is None:
+        raise InvalidTruthTableRequestError("A formula is required")
+    if order not in TRUTH_TABLE_ORDERS:
+        raise InvalidTruthTableRequestError("Unknown truth table order " + order)
+    if page < 0:
+        raise InvalidTruthTableRequestError("Truth table pages start at 0")
+    page_size = max(1, min(page_size, TRUTH_TABLE_MAX_PAGE_SIZE))
+    try:
+        compiled = compile_formula(formula, grammar)
+    except LarkError as error:
+        raise InvalidTruthTableRequestError("Invalid formula: " + str(error))
+    letters = list(compiled.letters)
+    rows = iter_truth_table_rows(compiled, letters, order, page*page_size, (page+1)*page_size)
+
+    output = io.StringIO()
+    if output_format == "json":
+        backend.truth_table.write_json(rows, letters, output, {"order": order, "page": page, "page_size": page_size,
+                                                               "total_rows": 1 << len(letters)})
+    else:
+        backend.truth_table.WRITERS[output_format](rows, letters, output)
+    return output.getvalue()
 
-    table_str += "</tbody></table>"
-    return table_str
+def translate_formula(formula: str, letters: List[str], grammar: str, rng: Optional[random.Random] = None) -> str:
+    tree = None
+    if grammar == "prop":
+        tree = get_parser("prop").parse(formula)
+    else:
+        tree = get_parser("bool").parse(formula)
+    return translate_tree(tree, letters, rng)
 
-def translate_formula(formula: str, letters: List[str], grammar: str) -> str:
+def translate_tree(tree: Tree, letters: List[str], rng: Optional[random.Random] = None) -> str:
+    rng = rng or random
     phrases = [("it is dark", "it is night"), ("it is snowing", "it is cold"), ("it is late", "I am tired")]
     phrases_negative = [("it is not dark", "it is not night"), ("it is not snowing", "it is not cold"), ("it is not late", "I am not tired")]
 
-    p = random.randint(0, len(phrases)-1)
+    p = rng.randint(0, len(phrases)-1)
     
     class Translator(Transformer):
         def letter(self, tok: Token) -> str:
@@ -269,12 +687,6 @@ def translate_formula(formula: str, letters: List[str], grammar: str) -> str:
         def equivalent(self, tree: Tree) -> str:
             return "(" + tree[0] + ") if and only if (" + tree[1] + ")"
 
-    tree = None
-    if grammar == "prop":
-        tree = prop_parser.parse(formula)
-    else:
-        tree = bool_parser.parse(formula)
-
     sentence = Translator().transform(tree)
     
     meanings = [(l, phrases[p][letters.index(l)]) for l in letters]
@@ -286,43 +698,17 @@ def translate_formula(formula: str, letters: List[str], grammar: str) -> str:
     
     return "Let " + meanings_str + ". " + sentence
 
-def generate_question() -> Tuple[str, str, str, str, str]:
-    prop_letters = ["p", "q", "r", "s", "t"]
-    bool_letters = ["a", "b", "c", "d", "e"]
-
-    def gen_prop(formula: str, length: int) -> Tuple[str, List[str]]:    # here "length" is the number of derivations we have performed so far
-        if length <= 0:
-            formula = formula.replace("F", "L")     # we will now replace all non-terminals with letters
-            max_letters = random.randint(1, len(prop_letters))
-            letters = set()
-            while "L" in formula:
-                l = prop_letters[random.randint(0, max_letters-1)]
-                formula = formula.replace("L", l, 1)
-                letters.add(l)
-            return (formula, list(letters))
-
-        derivations = ["-L", "F ^ F", "F < F", "F -> F", "F <-> F", "(F ^ F)", "(F < F)", "(F -> F)", "(F <-> F)", "-(F ^ F)", "-(F < F)", "-(F -> F)", "-(F <-> F)"]
-        d = random.sample(derivations, 1)
-        formula = formula.replace("F", d[0], 1)
-
-        return gen_prop(formula, length-1)
-    
-    def gen_bool(formula: str, length: int) -> Tuple[str, List[str]]:
-        if length <= 0:
-            formula = formula.replace("F", "L")     # we will now replace all non-terminals with letters
-            max_letters = random.randint(1, len(bool_letters))
-            letters = set()
-            while "L" in formula:
-                l = bool_letters[random.randint(0, max_letters-1)]
-                formula = formula.replace("L", l, 1)
-                letters.add(l)
-            return (formula, list(letters))
-
-        derivations = ["-L", "F . F", "F + F", "(F . F)", "(F + F)", "-(F . F)", "-(F + F)"]
-        d = random.sample(derivations, 1)
-        formula = formula.replace("F", d[0], 1)
-
-        return gen_bool(formula, length-1)
+# question types are 0: prop translation/equivalence, 1: bool translation/equivalence, 2: prop truth table,
+# 3: bool truth table, 4: DNF conversion
+QUESTION_TYPES: List[int] = [0, 1, 2, 3, 4]
+
+PROP_LETTERS: List[str] = ["p", "q", "r", "s", "t"]
+BOOL_LETTERS: List[str] = ["a", "b", "c", "d", "e"]
+
+# "depth" bounds the nesting of generated formulas, so harder questions can ask for deeper ones
+# random choices are drawn from rng if one is given, otherwise from the global random module
+def generate_question(question_type: Optional[int] = None, rng: Optional[random.Random] = None, depth: int = 2) -> Tuple[str, str, str, str, str]:
+    rng = rng or random
 
     grammar = ""
     formula = ""
@@ -330,55 +716,61 @@ def generate_question() -> Tuple[str, str, str, str, str]:
     prompt = ""
     input_method = ""
 
-    question_type = random.randint(0, 4)
+    if question_type is None:
+        question_type = rng.choice(QUESTION_TYPES)
     if question_type == 0:
         grammar = "prop"
-        gen = gen_prop("F", 2)
-        formula = gen[0]
-        letters = gen[1]
+        gen = backend.formula.generate_formula(grammar, depth, PROP_LETTERS, rng=rng)
+        formula = gen.render(grammar)
+        letters = gen.letters
         
         if len(letters) == 2:
-            prompt = "Translate the following sentence into a propositional logic formula: " + translate_formula(formula, letters, grammar)
+            prompt = "Translate the following sentence into a propositional logic formula: " + translate_tree(gen.to_tree(), letters, rng)
         else:
             prohibited_formula = formula
-            prompt = "Give an equivalent propositional logic formula to \\(" + formula.replace("<->", "\\longleftrightarrow").replace("->", "\\rightarrow").replace("^", "\\land").replace("-", "\\neg ").replace("<", "\\lor") + "\\)"
+            prompt = "Give an equivalent propositional logic formula to \\(" + gen.render_latex(grammar) + "\\)"
             input_method = "Text"   # can't be blocks, since blocks would form prohibited formula
 
     elif question_type == 1:
         grammar = "bool"
-        gen = gen_bool("F", 2)
-        formula = gen[0]
-        letters = gen[1]
+        gen = backend.formula.generate_formula(grammar, depth, BOOL_LETTERS, rng=rng)
+        formula = gen.render(grammar)
+        letters = gen.letters
         
         if len(letters) == 2:
-            prompt = "Translate the following sentence into a boolean algebra formula: " + translate_formula(formula, letters, grammar)
+            prompt = "Translate the following sentence into a boolean algebra formula: " + translate_tree(gen.to_tree(), letters, rng)
         else:
             prohibited_formula = formula
-            prompt = "Give an equivalent boolean algebra formula to \\(" + formula.replace(".", "\\cdot") + "\\)"
+            prompt = "Give an equivalent boolean algebra formula to \\(" + gen.render_latex(grammar) + "\\)"
             input_method = "Text"
 
     elif question_type == 2:
         grammar = "prop"
-        gen = gen_prop("F", 2)
-        formula = gen[0]
-        table = gen_truth_table(formula, gen[1], grammar)
+        gen = backend.formula.generate_formula(grammar, depth, PROP_LETTERS, rng=rng)
+        formula = gen.render(grammar)
+        table = gen_truth_table_formula(gen, gen.letters)
         prompt = "Give a propositional logic formula for the following truth table:\n" + table
 
     elif question_type == 3:
         grammar = "bool"
-        gen = gen_bool("F", 2)
-        formula = gen[0]
-        table = gen_truth_table(formula, gen[1], grammar)
+        gen = backend.formula.generate_formula(grammar, depth, BOOL_LETTERS, rng=rng)
+        formula = gen.render(grammar)
+        table = gen_truth_table_formula(gen, gen.letters)
         prompt = "Give a boolean algebra formula for the following truth table:\n" + table
         
     elif question_type == 4:
         grammar = "dnf"
-        formula = gen_prop("F", 2)[0]
-        prompt = "Give the following propositional logic formula in DNF: \\(" + formula.replace("<->", "\\longleftrightarrow").replace("->", "\\rightarrow").replace("^", "\\land").replace("-", "\\neg ").replace("<", "\\lor") + "\\)"
+        # constant formulas have no DNF the dnf grammar accepts, so draw again until the formula has one
+        while True:
+            gen = backend.formula.generate_formula("prop", depth, PROP_LETTERS, rng=rng)
+            formula = reference_dnf(gen)
+            if formula is not None:
+                break
+        prompt = "Give the following propositional logic formula in DNF: \\(" + gen.render_latex("prop") + "\\)"
         input_method = "Text"
 
     if input_method == "":
-        if random.randint(0, 1) == 0:
+        if rng.randint(0, 1) == 0:
             input_method = "Text"
         else:
             input_method = "Blocks"
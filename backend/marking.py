@@ -0,0 +1,110 @@
+import typing
+
+import backend.async_store
+import backend.file_manager
+import backend.logic_engine
+import backend.marking_executor
+
+QUESTION_NOT_FOUND: str = "Question not found"
+MAX_SUBMISSIONS: int = 200
+
+
+class InvalidSubmissionsError(Exception):
+    pass
+
+
+# A submission is a dict with 'set_id', 'question_id' and 'user_answer' keys, or a list of those three values.
+# Ids may be strings or integers, and the answer must be a string.
+def submission_fields(submission: typing.Union[dict, list]) -> typing.Tuple[str, str, str]:
+    if isinstance(submission, dict):
+        fields: tuple = (submission.get('set_id'), submission.get('question_id'), submission.get('user_answer'))
+    elif isinstance(submission, list) and len(submission) == 3:
+        fields = tuple(submission)
+    else:
+        raise InvalidSubmissionsError('A submission must be an object or a list of set_id, question_id and user_answer')
+    set_id, question_id, user_answer = fields
+    for identifier in (set_id, question_id):
+        if isinstance(identifier, bool) or not isinstance(identifier, (str, int)):
+            raise InvalidSubmissionsError('set_id and question_id must be strings or integers')
+    if not isinstance(user_answer, str):
+        raise InvalidSubmissionsError('user_answer must be a string')
+    return str(set_id), str(question_id), user_answer
+
+
+# Groups submissions by question, returning the indices of each question's submissions, and every answer. Raises
+# InvalidSubmissionsError if the submissions aren't a list of at most MAX_SUBMISSIONS valid submissions.
+def group_submissions(submissions: typing.List[typing.Union[dict, list]]) -> typing.Tuple[
+        typing.Dict[typing.Tuple[str, str], typing.List[int]], typing.List[str]]:
+    if not isinstance(submissions, list):
+        raise InvalidSubmissionsError('Expected a JSON list of submissions')
+    if len(submissions) > MAX_SUBMISSIONS:
+        raise InvalidSubmissionsError(f'At most {MAX_SUBMISSIONS} submissions can be marked at once')
+    grouped: typing.Dict[typing.Tuple[str, str], typing.List[int]] = {}
+    answers: typing.List[str] = []
+    for i, submission in enumerate(submissions):
+        try:
+            set_id, question_id, user_answer = submission_fields(submission)
+        except InvalidSubmissionsError as error:
+            raise InvalidSubmissionsError(f'Submission {i}: {error}')
+        grouped.setdefault((set_id, question_id), []).append(i)
+        answers.append(user_answer)
+    return grouped, answers
+
+
+# Marks many submissions at once, grouping them by question so each question is looked up and marked together.
+# Verdicts are returned in submission order. With a marking executor, every distinct answer is marked on its worker
+# processes with the same timeout as a single answer, and MarkingQueueFullError is raised if its queue fills up.
+def mark_submissions(file_manager: backend.file_manager.FileManager,
+                     submissions: typing.List[typing.Union[dict, list]],
+                     marking_executor: typing.Optional[backend.marking_executor.MarkingExecutor] = None
+                     ) -> typing.List[str]:
+    grouped, answers = group_submissions(submissions)
+    verdicts: typing.List[str] = [QUESTION_NOT_FOUND] * len(submissions)
+    batches: typing.List[typing.Tuple[typing.List[int], backend.marking_executor.MarkingBatch]] = []
+    for (set_id, question_id), indices in grouped.items():
+        try:
+            question: typing.Optional[backend.file_manager.Question] = file_manager.retrieve_question(set_id,
+                                                                                                        question_id)
+        except FileNotFoundError:
+            question = None
+        if question is None:
+            continue
+        question_answers: typing.List[str] = [answers[i] for i in indices]
+        if marking_executor is not None:
+            batches.append((indices, marking_executor.submit_batch(
+                question_answers, question.correct_formula, question.prohibited_formula, question.correct_grammar,
+                question.artifact)))
+            continue
+        question_verdicts: typing.List[str] = backend.logic_engine.validate_answers(
+            question_answers, question.correct_formula, question.prohibited_formula, question.correct_grammar,
+            question.artifact)
+        for i, verdict in zip(indices, question_verdicts):
+            verdicts[i] = verdict
+    for indices, batch in batches:
+        for i, verdict in zip(indices, marking_executor.batch_result(batch)):
+            verdicts[i] = verdict
+    return verdicts
+
+
+# The same as mark_submissions with a marking executor, for callers running in an asyncio event loop
+async def mark_submissions_async(store: backend.async_store.AsyncFileManager,
+                                 submissions: typing.List[typing.Union[dict, list]],
+                                 marking_executor: backend.marking_executor.MarkingExecutor) -> typing.List[str]:
+    grouped, answers = group_submissions(submissions)
+    verdicts: typing.List[str] = [QUESTION_NOT_FOUND] * len(submissions)
+    batches: typing.List[typing.Tuple[typing.List[int], backend.marking_executor.MarkingBatch]] = []
+    for (set_id, question_id), indices in grouped.items():
+        try:
+            question: typing.Optional[backend.file_manager.Question] = await store.retrieve_question(set_id,
+                                                                                                       question_id)
+        except FileNotFoundError:
+            question = None
+        if question is None:
+            continue
+        batches.append((indices, marking_executor.submit_batch(
+            [answers[i] for i in indices], question.correct_formula, question.prohibited_formula,
+            question.correct_grammar, question.artifact)))
+    for indices, batch in batches:
+        for i, verdict in zip(indices, await marking_executor.batch_result_async(batch)):
+            verdicts[i] = verdict
+    return verdicts
@@ -0,0 +1,267 @@
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import typing
+
+import backend.logic_engine
+import backend.metrics
+from backend.artifacts import QuestionArtifact
+
+MARKING_TIMED_OUT: str = backend.logic_engine.MARKING_TIMED_OUT
+
+
+class MarkingQueueFullError(Exception):
+    pass
+
+
+class _MarkingTimeout(Exception):
+    pass
+
+
+def _raise_marking_timeout(signum, frame) -> typing.NoReturn:
+    raise _MarkingTimeout
+
+
+def _worker_context() -> multiprocessing.context.BaseContext:
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# Runs once in every worker process, so the first job a worker gets doesn't pay for building and warming the parsers
+def _initialize_worker() -> typing.NoReturn:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # leave interrupts to the server process
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _raise_marking_timeout)
+    backend.logic_engine.validate_answer("p", "p", "", "prop")
+    backend.logic_engine.validate_answer("a", "a", "", "bool")
+    backend.logic_engine.validate_answer("p", "p", "", "dnf")
+    backend.metrics.registry.drain()    # warming up isn't marking, so keep it out of the metrics
+
+
+# Marks an answer inside a worker process, giving up after timeout seconds so a pathological formula can't hold on
+# to the worker forever. The metrics the worker recorded while marking are returned with the verdict, for the server
+# process to merge into its own.
+def _mark_in_worker(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+                    artifact: typing.Optional[QuestionArtifact], timeout: float) -> typing.Tuple[str, backend.metrics.Samples]:
+    return _mark_with_timeout(answer_formula, correct_formula, prohibited_formula, grammar, artifact, timeout), \
+        backend.metrics.registry.drain()
+
+
+def _mark_with_timeout(answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+                       artifact: typing.Optional[QuestionArtifact], timeout: float) -> str:
+    if not hasattr(signal, 'setitimer'):
+        return backend.logic_engine.validate_answer(answer_formula, correct_formula, prohibited_formula, grammar,
+                                                    artifact)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return backend.logic_engine.validate_answer(answer_formula, correct_formula, prohibited_formula, grammar,
+                                                    artifact)
+    except _MarkingTimeout:
+        return MARKING_TIMED_OUT + correct_formula
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+# Resolves future with the verdict of a worker's job, merging the metrics that came with it
+def _forward_verdict(job: concurrent.futures.Future, future: concurrent.futures.Future) -> typing.NoReturn:
+    if job.cancelled():
+        future.cancel()
+        future.set_running_or_notify_cancel()
+        return
+    error: typing.Optional[BaseException] = job.exception()
+    if error is not None:
+        future.set_exception(error)
+        return
+    verdict, samples = job.result()
+    backend.metrics.registry.merge(samples)
+    future.set_result(verdict)
+
+
+# The answers to one question submitted together by MarkingExecutor.submit_batch, whose verdicts are collected with
+# MarkingExecutor.batch_result or batch_result_async
+class MarkingBatch:
+    __slots__ = ('answers', 'correct_formula', 'verdicts', 'jobs', 'deadline')
+
+    def __init__(self, answers: typing.List[str], correct_formula: str, verdicts: typing.Dict[str, str],
+                 jobs: typing.Dict[str, typing.Tuple[typing.Tuple[str, str, str, str], concurrent.futures.Future]],
+                 deadline: float) -> typing.NoReturn:
+        self.answers: typing.List[str] = answers
+        self.correct_formula: str = correct_formula
+        self.verdicts: typing.Dict[str, str] = verdicts    # answers that were in the verdict cache
+        self.jobs: typing.Dict[str, typing.Tuple[typing.Tuple[str, str, str, str], concurrent.futures.Future]] = jobs
+        self.deadline: float = deadline    # time.monotonic() after which unfinished jobs count as timed out
+
+
+# Marks answers on a pool of worker processes, so CPU bound equivalence checks run on every core instead of one
+# request thread at a time. At most max_pending jobs are queued or running; further submissions are rejected.
+class MarkingExecutor:
+    def __init__(self, max_workers: typing.Optional[int] = None, max_pending: int = 256,
+                 timeout: float = 5.0) -> typing.NoReturn:
+        self.max_workers: int = max_workers or os.cpu_count() or 1
+        self.max_pending: int = max_pending
+        self.timeout: float = timeout
+        self.__pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.__pool_lock: threading.Lock = threading.Lock()
+        self.__slots: threading.BoundedSemaphore = threading.BoundedSemaphore(max_pending)
+        self.__counter_lock: threading.Lock = threading.Lock()
+        self.__pending: int = 0
+        self.__submitted: int = 0
+        self.__completed: int = 0
+        self.__timed_out: int = 0
+        self.__rejected: int = 0
+
+    # the pool is started on first use, so importing the server doesn't start workers. By then request threads and the
+    # question pool may hold locks (the formula intern table, caches, metrics, parsers), which a forked worker would
+    # inherit locked forever, so workers are started by a fork server, or spawned where there is none
+    def __get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self.__pool_lock:
+            if self.__pool is None:
+                self.__pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                                                     mp_context=_worker_context(),
+                                                                     initializer=_initialize_worker)
+            return self.__pool
+
+    # Drops a broken pool, so the next job starts a new one. Other threads may have replaced it already.
+    def __replace_pool(self, broken: concurrent.futures.ProcessPoolExecutor) -> typing.NoReturn:
+        with self.__pool_lock:
+            if self.__pool is broken:
+                self.__pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+               artifact: typing.Optional[QuestionArtifact] = None) -> 'concurrent.futures.Future[str]':
+        if not self.__slots.acquire(blocking=False):
+            with self.__counter_lock:
+                self.__rejected += 1
+            raise MarkingQueueFullError(f"{self.max_pending} marking jobs already pending")
+        with self.__counter_lock:
+            self.__pending += 1
+            self.__submitted += 1
+        arguments: tuple = (answer_formula, correct_formula, prohibited_formula, grammar, artifact, self.timeout)
+        try:
+            pool: concurrent.futures.ProcessPoolExecutor = self.__get_pool()
+            try:
+                job: concurrent.futures.Future = pool.submit(_mark_in_worker, *arguments)
+            except concurrent.futures.process.BrokenProcessPool:
+                # a worker died, e.g. killed for running out of memory, which breaks the whole pool for good
+                self.__replace_pool(pool)
+                job = self.__get_pool().submit(_mark_in_worker, *arguments)
+        except BaseException:
+            self.__job_done(None)
+            raise
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.add_done_callback(self.__job_done)
+        job.add_done_callback(lambda finished: _forward_verdict(finished, future))
+        return future
+
+    def __job_done(self, future: typing.Optional[concurrent.futures.Future]) -> typing.NoReturn:
+        with self.__counter_lock:
+            self.__pending -= 1
+            self.__completed += 1
+        self.__slots.release()
+
+    # Marks an answer, answering from the verdict cache without using a worker when possible
+    def mark(self, answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+             artifact: typing.Optional[QuestionArtifact] = None) -> str:
+        key: typing.Tuple[str, str, str, str] = backend.logic_engine.verdict_key(answer_formula, correct_formula,
+                                                                                 prohibited_formula, grammar)
+        verdict: typing.Optional[str] = backend.logic_engine.verdict_cache.get(key)
+        if verdict is not None:
+            return verdict
+
+        future: concurrent.futures.Future = self.submit(answer_formula, correct_formula, prohibited_formula, grammar,
+                                                        artifact)
+        try:
+            verdict = future.result(timeout=self.timeout + 1.0)     # workers time out themselves, allow them a moment
+        except concurrent.futures.TimeoutError:
+            verdict = self.__timed_out_verdict(correct_formula)
+        return self.__remember(key, verdict)
+
+    # The same as mark, for callers running in an asyncio event loop
+    async def mark_async(self, answer_formula: str, correct_formula: str, prohibited_formula: str, grammar: str,
+                         artifact: typing.Optional[QuestionArtifact] = None) -> str:
+        key: typing.Tuple[str, str, str, str] = backend.logic_engine.verdict_key(answer_formula, correct_formula,
+                                                                                 prohibited_formula, grammar)
+        verdict: typing.Optional[str] = backend.logic_engine.verdict_cache.get(key)
+        if verdict is not None:
+            return verdict
+
+        future: concurrent.futures.Future = self.submit(answer_formula, correct_formula, prohibited_formula, grammar,
+                                                        artifact)
+        try:
+            verdict = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout + 1.0)
+        except asyncio.TimeoutError:
+            verdict = self.__timed_out_verdict(correct_formula)
+        return self.__remember(key, verdict)
+
+    # Submits each distinct answer that isn't in the verdict cache, so a batch's jobs all run at once and the batch
+    # waits at most as long as a single answer would. Raises MarkingQueueFullError like submit, in which case the jobs
+    # already submitted still run to completion.
+    def submit_batch(self, answer_formulas: typing.List[str], correct_formula: str, prohibited_formula: str,
+                     grammar: str, artifact: typing.Optional[QuestionArtifact] = None) -> MarkingBatch:
+        verdicts: typing.Dict[str, str] = {}
+        jobs: typing.Dict[str, typing.Tuple[typing.Tuple[str, str, str, str], concurrent.futures.Future]] = {}
+        answer: str
+        for answer in dict.fromkeys(answer_formulas):
+            key: typing.Tuple[str, str, str, str] = backend.logic_engine.verdict_key(answer, correct_formula,
+                                                                                     prohibited_formula, grammar)
+            verdict: typing.Optional[str] = backend.logic_engine.verdict_cache.get(key)
+            if verdict is not None:
+                verdicts[answer] = verdict
+            else:
+                jobs[answer] = key, self.submit(answer, correct_formula, prohibited_formula, grammar, artifact)
+        return MarkingBatch(answer_formulas, correct_formula, verdicts, jobs,
+                            time.monotonic() + self.timeout + 1.0)
+
+    # The verdicts of a batch's answers, in the order they were submitted
+    def batch_result(self, batch: MarkingBatch) -> typing.List[str]:
+        for answer, (key, future) in batch.jobs.items():
+            try:
+                verdict: str = future.result(timeout=max(0.0, batch.deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                verdict = self.__timed_out_verdict(batch.correct_formula)
+            batch.verdicts[answer] = self.__remember(key, verdict)
+        return [batch.verdicts[answer] for answer in batch.answers]
+
+    async def batch_result_async(self, batch: MarkingBatch) -> typing.List[str]:
+        for answer, (key, future) in batch.jobs.items():
+            try:
+                verdict: str = await asyncio.wait_for(asyncio.wrap_future(future),
+                                                      timeout=max(0.0, batch.deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                verdict = self.__timed_out_verdict(batch.correct_formula)
+            batch.verdicts[answer] = self.__remember(key, verdict)
+        return [batch.verdicts[answer] for answer in batch.answers]
+
+    @staticmethod
+    def __timed_out_verdict(correct_formula: str) -> str:
+        return MARKING_TIMED_OUT + correct_formula
+
+    # Caches a verdict and counts timeouts, whether the worker gave up on the job or we stopped waiting for it, once
+    # per job
+    def __remember(self, key: typing.Tuple[str, str, str, str], verdict: str) -> str:
+        if verdict.startswith(MARKING_TIMED_OUT):   # a timeout may not happen next time, so don't cache it
+            with self.__counter_lock:
+                self.__timed_out += 1
+        else:
+            backend.logic_engine.verdict_cache.put(key, verdict)
+        return verdict
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        with self.__counter_lock:
+            return {'workers': self.max_workers, 'max_pending': self.max_pending, 'pending': self.__pending,
+                    'submitted': self.__submitted, 'completed': self.__completed, 'timed_out': self.__timed_out,
+                    'rejected': self.__rejected}
+
+    def shutdown(self, wait: bool = True) -> typing.NoReturn:
+        with self.__pool_lock:
+            if self.__pool is not None:
+                self.__pool.shutdown(wait=wait, cancel_futures=True)
+                self.__pool = None
@@ -0,0 +1,214 @@
+import bisect
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+import typing
+
+# Lightweight in-process metrics: counters and latency histograms, keyed by a metric name and a set of labels, and
+# rendered in the Prometheus text format for the /metrics endpoint. Timing a stage costs two clock reads and one
+# short locked update, so the marking and storage hot paths are always instrumented.
+# Set LOGIC_LEARNER_METRICS=0 to turn recording off.
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]     # sorted (name, value) pairs
+# what a registry has recorded, by metric and labels: a counter's value, or a histogram's bucket counts, sum and count
+Samples = typing.Dict[typing.Tuple[str, Labels], typing.Union[float, typing.Tuple[typing.List[int], float, int]]]
+Gauge = typing.Tuple[str, typing.Dict[str, str], float]
+
+# latency histogram bucket upper bounds in seconds, from half a millisecond to ten seconds
+LATENCY_BUCKETS: typing.Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                                             2.5, 5.0, 10.0)
+
+STAGE_SECONDS: str = "logic_learner_stage_seconds"
+REQUEST_SECONDS: str = "logic_learner_request_seconds"
+VERDICTS: str = "logic_learner_verdicts_total"
+
+HELP: typing.Dict[str, str] = {
+    STAGE_SECONDS: "Time spent in each stage of marking and storage",
+    REQUEST_SECONDS: "Time spent serving each HTTP route",
+    VERDICTS: "Answers marked, by verdict",
+}
+
+
+def _labels(labels: typing.Dict[str, typing.Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: typing.Iterable[typing.Tuple[str, str]]) -> str:
+    rendered: str = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + rendered + "}" if rendered else ""
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# Measures the time spent in a with block. Labels can still be added inside the block, for values such as the number
+# of letters of a formula that are only known part way through.
+class Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: typing.Dict[str, typing.Any]):
+        self.registry: MetricsRegistry = registry
+        self.name: str = name
+        self.labels: typing.Dict[str, typing.Any] = labels
+        self.start: float = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> bool:
+        self.registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True, buckets: typing.Tuple[float, ...] = LATENCY_BUCKETS):
+        self.enabled: bool = enabled
+        self.buckets: typing.Tuple[float, ...] = buckets
+        self.__counters: typing.Dict[typing.Tuple[str, Labels], float] = {}
+        self.__histograms: typing.Dict[typing.Tuple[str, Labels], typing.List[typing.Any]] = {}    # [counts, sum, count]
+        self.__collectors: typing.List[typing.Callable[[], typing.Iterable[Gauge]]] = []
+        self.__lock: threading.Lock = threading.Lock()
+
+    def increment(self, name: str, labels: typing.Dict[str, typing.Any], amount: float = 1) -> typing.NoReturn:
+        if not self.enabled:
+            return
+        key: typing.Tuple[str, Labels] = (name, _labels(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: typing.Dict[str, typing.Any]) -> typing.NoReturn:
+        if not self.enabled:
+            return
+        key: typing.Tuple[str, Labels] = (name, _labels(labels))
+        bucket: int = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            histogram: typing.Optional[typing.List[typing.Any]] = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def time(self, name: str, **labels: typing.Any) -> Timer:
+        return Timer(self, name, labels)
+
+    # Gauges are read from collectors when the metrics are rendered, e.g. the sizes of caches and queues
+    def add_collector(self, collector: typing.Callable[[], typing.Iterable[Gauge]]) -> typing.NoReturn:
+        self.__collectors.append(collector)
+
+    # Returns everything recorded since the last drain and forgets it, so a worker process can hand its samples over
+    # to the server process's registry with merge
+    def drain(self) -> Samples:
+        with self.__lock:
+            samples: Samples = dict(self.__counters)
+            samples.update({key: (counts, total, count) for key, (counts, total, count) in self.__histograms.items()})
+            self.__counters = {}
+            self.__histograms = {}
+        return samples
+
+    def merge(self, samples: Samples) -> typing.NoReturn:
+        with self.__lock:
+            for key, sample in samples.items():
+                if not isinstance(sample, tuple):
+                    self.__counters[key] = self.__counters.get(key, 0) + sample
+                    continue
+                counts, total, count = sample
+                histogram: typing.Optional[typing.List[typing.Any]] = self.__histograms.get(key)
+                if histogram is None:
+                    histogram = self.__histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    # The Prometheus text exposition format
+    def render(self) -> str:
+        with self.__lock:
+            counters: typing.Dict[typing.Tuple[str, Labels], float] = dict(self.__counters)
+            histograms: typing.Dict[typing.Tuple[str, Labels], typing.List[typing.Any]] = {
+                key: [list(counts), total, count] for key, (counts, total, count) in self.__histograms.items()}
+        lines: typing.List[str] = []
+
+        def header(name: str, kind: str) -> typing.NoReturn:
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name in sorted({name for name, _ in counters}):
+            header(name, "counter")
+            for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+
+        for name in sorted({name for name, _ in histograms}):
+            header(name, "histogram")
+            for (_, labels), (counts, total, count) in sorted(item for item in histograms.items() if item[0][0] == name):
+                cumulative: int = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        gauges: typing.Dict[str, typing.List[str]] = {}
+        for collector in self.__collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append(f"{name}{_format_labels(sorted(labels.items()))} "
+                                                   f"{_format_number(value)}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry: MetricsRegistry = MetricsRegistry(os.environ.get("LOGIC_LEARNER_METRICS", "1") != "0")
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def stage(name: str, **labels: typing.Any) -> Timer:
+    return registry.time(STAGE_SECONDS, stage=name, **labels)
+
+
+# Profiles a random sample of requests with cProfile, writing one .prof file per profiled request, readable with
+# python -m pstats. Off unless LOGIC_LEARNER_PROFILE_RATE is above 0; only one request is profiled at a time, as
+# Python allows only one active profiler.
+class RequestProfiler:
+    def __init__(self, rate: float, directory: str):
+        self.rate: float = rate
+        self.directory: str = directory
+        self.__lock: threading.Lock = threading.Lock()
+
+    def start(self) -> typing.Optional[cProfile.Profile]:
+        if self.rate <= 0 or random.random() >= self.rate or not self.__lock.acquire(blocking=False):
+            return None
+        profile: cProfile.Profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is already running in this process
+            self.__lock.release()
+            return None
+        return profile
+
+    def finish(self, profile: typing.Optional[cProfile.Profile], route: str) -> typing.NoReturn:
+        if profile is None:
+            return
+        try:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            name: str = re.sub(r'[^A-Za-z0-9_]+', '_', route).strip('_') or 'root'
+            profile.dump_stats(os.path.join(self.directory, f"{name}-{time.time_ns()}.prof"))
+        finally:
+            self.__lock.release()
+
+
+profiler: RequestProfiler = RequestProfiler(float(os.environ.get("LOGIC_LEARNER_PROFILE_RATE", "0")),
+                                            os.environ.get("LOGIC_LEARNER_PROFILE_DIR", "profiles"))
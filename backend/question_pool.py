@@ -0,0 +1,98 @@
+import collections
+import random
+import threading
+import typing
+
+import lark
+
+import backend.logic_engine
+
+GeneratedQuestion = typing.Tuple[str, str, str, str, str]
+
+
+# Keeps a buffer of ready generated questions for every question type, refilled by a background thread, so that
+# /random can hand out questions without generating them while the request waits
+class QuestionPool:
+    def __init__(self, size_per_type: int = 32) -> typing.NoReturn:
+        self.size_per_type: int = size_per_type
+        self.__buffers: typing.Dict[int, typing.Deque[GeneratedQuestion]] = {
+            question_type: collections.deque() for question_type in backend.logic_engine.QUESTION_TYPES}
+        self.__condition: threading.Condition = threading.Condition()
+        self.__producer: typing.Optional[threading.Thread] = None
+        self.__running: bool = False
+        self.hits: int = 0
+        self.misses: int = 0
+
+    # the producer is started on first use, so importing the server doesn't start generating
+    def start(self) -> typing.NoReturn:
+        with self.__condition:
+            if self.__producer is None:
+                self.__running = True
+                self.__producer = threading.Thread(target=self.__produce, name='question-pool', daemon=True)
+                self.__producer.start()
+
+    def stop(self) -> typing.NoReturn:
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+            producer: typing.Optional[threading.Thread] = self.__producer
+            self.__producer = None
+        if producer is not None:
+            producer.join()
+
+    # Draws a question of a random type (or of the given type) from the pool, generating one directly if that
+    # type's buffer has run dry
+    def take(self, question_type: typing.Optional[int] = None) -> GeneratedQuestion:
+        self.start()
+        if question_type is None:
+            question_type = random.choice(backend.logic_engine.QUESTION_TYPES)
+        with self.__condition:
+            buffer: typing.Deque[GeneratedQuestion] = self.__buffers[question_type]
+            question: typing.Optional[GeneratedQuestion] = buffer.popleft() if buffer else None
+            if question is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.__condition.notify()
+        if question is None:
+            question = self.__generate(question_type)
+        return question
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        with self.__condition:
+            stats: typing.Dict[str, int] = {f'buffered_type_{question_type}': len(buffer)
+                                            for question_type, buffer in self.__buffers.items()}
+            stats.update({'size_per_type': self.size_per_type, 'hits': self.hits, 'misses': self.misses})
+            return stats
+
+    def __lowest_buffer(self) -> typing.Optional[int]:
+        question_type: int = min(self.__buffers, key=lambda t: len(self.__buffers[t]))
+        if len(self.__buffers[question_type]) >= self.size_per_type:
+            return None
+        return question_type
+
+    def __produce(self) -> typing.NoReturn:
+        while True:
+            with self.__condition:
+                question_type: typing.Optional[int] = self.__lowest_buffer()
+                while self.__running and question_type is None:
+                    self.__condition.wait()
+                    question_type = self.__lowest_buffer()
+                if not self.__running:
+                    return
+            question: GeneratedQuestion = self.__generate(question_type)
+            with self.__condition:
+                self.__buffers[question_type].append(question)
+
+    # generated questions are checked to parse before they are handed out
+    @staticmethod
+    def __generate(question_type: int) -> GeneratedQuestion:
+        while True:
+            question: GeneratedQuestion = backend.logic_engine.generate_question(question_type)
+            grammar: str = "prop" if question[0] == "dnf" else question[0]
+            try:
+                backend.logic_engine.get_parser(grammar).parse(question[1])
+                return question
+            except lark.LarkError:
+                continue
@@ -0,0 +1,253 @@
+import typing
+
+# A small CDCL SAT solver, used to decide the equivalence of formulas with too many letters to enumerate their truth table.
+# Variables are numbered from 1, and literal 2*v is "v is true" while literal 2*v+1 is "v is false", so that negating a
+# literal is "lit ^ 1" and its variable is "lit >> 1".
+
+Clause = typing.List[int]
+
+
+class SolverBudgetExceeded(Exception):
+    pass
+
+
+def positive(variable: int) -> int:
+    return 2 * variable
+
+
+def negative(variable: int) -> int:
+    return 2 * variable + 1
+
+
+class Solver:
+    def __init__(self) -> typing.NoReturn:
+        self.__variable_count: int = 0
+        self.__values: typing.List[typing.Optional[bool]] = [None, None]   # truth value of each literal
+        self.__levels: typing.List[int] = [0]
+        self.__reasons: typing.List[typing.Optional[Clause]] = [None]
+        self.__activity: typing.List[float] = [0.0]
+        self.__phases: typing.List[bool] = [False]
+        self.__watches: typing.List[typing.List[Clause]] = [[], []]
+        self.__trail: typing.List[int] = []
+        self.__trail_limits: typing.List[int] = []
+        self.__propagated: int = 0
+        self.__activity_increment: float = 1.0
+        self.__unsatisfiable: bool = False
+
+    @property
+    def variable_count(self) -> int:
+        return self.__variable_count
+
+    def new_variable(self) -> int:
+        self.__variable_count += 1
+        self.__values.extend([None, None])
+        self.__levels.append(0)
+        self.__reasons.append(None)
+        self.__activity.append(0.0)
+        self.__phases.append(False)
+        self.__watches.extend([[], []])
+        return self.__variable_count
+
+    def add_clause(self, literals: typing.Iterable[int]) -> typing.NoReturn:
+        clause: Clause = []
+        for literal in literals:
+            if literal ^ 1 in clause:   # tautologies never constrain anything
+                return
+            if literal not in clause:
+                clause.append(literal)
+
+        if len(clause) == 0:
+            self.__unsatisfiable = True
+        elif len(clause) == 1:
+            if self.__values[clause[0]] is False:
+                self.__unsatisfiable = True
+            elif self.__values[clause[0]] is None:
+                self.__assign(clause[0], None)
+        else:
+            self.__watches[clause[0]].append(clause)
+            self.__watches[clause[1]].append(clause)
+
+    # returns the value of every variable (index 0 unused) in a satisfying assignment, or None if there is none
+    def solve(self, max_conflicts: typing.Optional[int] = None) -> typing.Optional[typing.List[bool]]:
+        if self.__unsatisfiable:
+            return None
+
+        conflicts: int = 0
+        while True:
+            conflict: typing.Optional[Clause] = self.__propagate()
+            if conflict is not None:
+                if len(self.__trail_limits) == 0:
+                    self.__unsatisfiable = True
+                    return None
+                conflicts += 1
+                if max_conflicts is not None and conflicts > max_conflicts:
+                    self.__backtrack(0)
+                    raise SolverBudgetExceeded
+                learnt, backtrack_level = self.__analyze(conflict)
+                self.__backtrack(backtrack_level)
+                if len(learnt) == 1:
+                    self.__assign(learnt[0], None)
+                else:
+                    self.__watches[learnt[0]].append(learnt)
+                    self.__watches[learnt[1]].append(learnt)
+                    self.__assign(learnt[0], learnt)
+                self.__activity_increment /= 0.95
+            else:
+                variable: typing.Optional[int] = self.__pick_branch_variable()
+                if variable is None:
+                    model: typing.List[bool] = [False] + [self.__values[positive(v)] for v in
+                                                          range(1, self.__variable_count + 1)]
+                    self.__backtrack(0)
+                    return model
+                self.__trail_limits.append(len(self.__trail))
+                self.__assign(positive(variable) if self.__phases[variable] else negative(variable), None)
+
+    def __assign(self, literal: int, reason: typing.Optional[Clause]) -> typing.NoReturn:
+        variable: int = literal >> 1
+        self.__values[literal] = True
+        self.__values[literal ^ 1] = False
+        self.__levels[variable] = len(self.__trail_limits)
+        self.__reasons[variable] = reason
+        self.__trail.append(literal)
+
+    # unit propagation with two watched literals per clause, returning a conflicting clause if one is found
+    def __propagate(self) -> typing.Optional[Clause]:
+        values = self.__values
+        while self.__propagated < len(self.__trail):
+            false_literal: int = self.__trail[self.__propagated] ^ 1
+            self.__propagated += 1
+            watchers: typing.List[Clause] = self.__watches[false_literal]
+            self.__watches[false_literal] = kept = []
+            for i, clause in enumerate(watchers):
+                if clause[0] == false_literal:
+                    clause[0], clause[1] = clause[1], clause[0]
+                if values[clause[0]] is True:
+                    kept.append(clause)
+                    continue
+                for k in range(2, len(clause)):
+                    if values[clause[k]] is not False:
+                        clause[1], clause[k] = clause[k], clause[1]
+                        self.__watches[clause[1]].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if values[clause[0]] is False:
+                        kept.extend(watchers[i + 1:])
+                        return clause
+                    self.__assign(clause[0], clause)
+        return None
+
+    # first unique implication point conflict analysis, returning the learnt clause and the level to backtrack to
+    def __analyze(self, conflict: Clause) -> typing.Tuple[Clause, int]:
+        current_level: int = len(self.__trail_limits)
+        seen: typing.Set[int] = set()
+        learnt: Clause = [0]
+        pending: int = 0
+        literal: typing.Optional[int] = None
+        index: int = len(self.__trail) - 1
+        clause: Clause = conflict
+
+        while True:
+            for other in (clause if literal is None else clause[1:]):
+                variable: int = other >> 1
+                if variable not in seen and self.__levels[variable] > 0:
+                    seen.add(variable)
+                    self.__bump_activity(variable)
+                    if self.__levels[variable] == current_level:
+                        pending += 1
+                    else:
+                        learnt.append(other)
+            while (self.__trail[index] >> 1) not in seen:
+                index -= 1
+            literal = self.__trail[index]
+            index -= 1
+            clause = self.__reasons[literal >> 1]
+            seen.discard(literal >> 1)
+            pending -= 1
+            if pending == 0:
+                break
+
+        learnt[0] = literal ^ 1
+        backtrack_level: int = 0
+        if len(learnt) > 1:
+            deepest: int = max(range(1, len(learnt)), key=lambda i: self.__levels[learnt[i] >> 1])
+            learnt[1], learnt[deepest] = learnt[deepest], learnt[1]
+            backtrack_level = self.__levels[learnt[1] >> 1]
+        return learnt, backtrack_level
+
+    def __backtrack(self, level: int) -> typing.NoReturn:
+        if len(self.__trail_limits) <= level:
+            return
+        for literal in self.__trail[self.__trail_limits[level]:]:
+            self.__phases[literal >> 1] = literal & 1 == 0
+            self.__values[literal] = None
+            self.__values[literal ^ 1] = None
+            self.__reasons[literal >> 1] = None
+        del self.__trail[self.__trail_limits[level]:]
+        del self.__trail_limits[level:]
+        self.__propagated = len(self.__trail)
+
+    def __bump_activity(self, variable: int) -> typing.NoReturn:
+        self.__activity[variable] += self.__activity_increment
+        if self.__activity[variable] > 1e100:
+            self.__activity = [a * 1e-100 for a in self.__activity]
+            self.__activity_increment *= 1e-100
+
+    def __pick_branch_variable(self) -> typing.Optional[int]:
+        best: typing.Optional[int] = None
+        for variable in range(1, self.__variable_count + 1):
+            if self.__values[positive(variable)] is None and (
+                    best is None or self.__activity[variable] > self.__activity[best]):
+                best = variable
+        return best
+
+
+# Tseitin encoding of a postfix formula program (as built by logic_engine.CompiledFormula) into the solver's clauses,
+# where letter_variables maps each letter index of the program to a solver variable. Returns the literal of the output.
+def encode_program(solver: Solver, program: typing.List[typing.Tuple[str, typing.Optional[int]]],
+                   letter_variables: typing.List[int]) -> int:
+    stack: typing.List[int] = []
+    for operation, argument in program:
+        if operation == "letter":
+            stack.append(positive(letter_variables[argument]))
+        elif operation == "not_formula":
+            stack.append(stack.pop() ^ 1)
+        else:
+            right: int = stack.pop()
+            left: int = stack.pop()
+            if operation == "implies":
+                operation, left = "_or", left ^ 1
+            gate: int = positive(solver.new_variable())
+            if operation == "_and":
+                solver.add_clause([gate ^ 1, left])
+                solver.add_clause([gate ^ 1, right])
+                solver.add_clause([gate, left ^ 1, right ^ 1])
+            elif operation == "_or":
+                solver.add_clause([gate, left ^ 1])
+                solver.add_clause([gate, right ^ 1])
+                solver.add_clause([gate ^ 1, left, right])
+            else:   # equivalent
+                solver.add_clause([gate ^ 1, left ^ 1, right])
+                solver.add_clause([gate ^ 1, left, right ^ 1])
+                solver.add_clause([gate, left, right])
+                solver.add_clause([gate, left ^ 1, right ^ 1])
+            stack.append(gate)
+    return stack[0]
+
+
+# finds a valuation of the letters under which the two programs disagree, by checking "f1 XOR f2" for satisfiability
+# letter_count is the number of distinct letters, and both programs index into the same letters
+def find_difference(f1_program: typing.List[typing.Tuple[str, typing.Optional[int]]],
+                    f2_program: typing.List[typing.Tuple[str, typing.Optional[int]]],
+                    letter_count: int, max_conflicts: typing.Optional[int] = None) -> typing.Optional[typing.List[bool]]:
+    solver: Solver = Solver()
+    letter_variables: typing.List[int] = [solver.new_variable() for _ in range(letter_count)]
+    f1_output: int = encode_program(solver, f1_program, letter_variables)
+    f2_output: int = encode_program(solver, f2_program, letter_variables)
+    solver.add_clause([f1_output, f2_output])
+    solver.add_clause([f1_output ^ 1, f2_output ^ 1])
+
+    model: typing.Optional[typing.List[bool]] = solver.solve(max_conflicts)
+    if model is None:
+        return None
+    return [model[v] for v in letter_variables]
@@ -0,0 +1,72 @@
+import os
+import typing
+
+import backend.file_manager
+import backend.live_check
+import backend.logic_engine
+import backend.marking_executor
+import backend.metrics
+import backend.question_pool
+import backend.sqlite_store
+
+
+# Question sets are stored in the SQLite database at LOGIC_LEARNER_DATABASE if it is set, otherwise as JSON files
+def create_file_manager() -> backend.file_manager.FileManager:
+    if os.environ.get('LOGIC_LEARNER_DATABASE'):
+        return backend.sqlite_store.SQLiteFileManager(os.environ['LOGIC_LEARNER_DATABASE'])
+    return backend.file_manager.FileManager(os.environ.get('LOGIC_LEARNER_DATA_DIR', 'data'))
+
+
+# Marking runs on a pool of worker processes unless LOGIC_LEARNER_MARKING_WORKERS is 0
+def create_marking_executor() -> typing.Optional[backend.marking_executor.MarkingExecutor]:
+    marking_workers: int = int(os.environ.get('LOGIC_LEARNER_MARKING_WORKERS', os.cpu_count() or 1))
+    if marking_workers <= 0:
+        return None
+    return backend.marking_executor.MarkingExecutor(
+        marking_workers, timeout=float(os.environ.get('LOGIC_LEARNER_MARKING_TIMEOUT', '5')))
+
+
+# /random draws from a pool of pre-generated questions holding LOGIC_LEARNER_QUESTION_POOL_SIZE questions per type,
+# unless that is 0
+def create_question_pool() -> typing.Optional[backend.question_pool.QuestionPool]:
+    size_per_type: int = int(os.environ.get('LOGIC_LEARNER_QUESTION_POOL_SIZE', '32'))
+    if size_per_type <= 0:
+        return None
+    return backend.question_pool.QuestionPool(size_per_type)
+
+
+# Live answer checks are debounced by LOGIC_LEARNER_LIVE_CHECK_DEBOUNCE seconds, and each session may send
+# LOGIC_LEARNER_LIVE_CHECK_RATE checks per second on average, in bursts of up to LOGIC_LEARNER_LIVE_CHECK_BURST.
+# All the sessions of one client address may send LOGIC_LEARNER_LIVE_CHECK_ADDRESS_RATE checks per second together,
+# in bursts of up to LOGIC_LEARNER_LIVE_CHECK_ADDRESS_BURST.
+def create_live_checker() -> backend.live_check.LiveChecker:
+    return backend.live_check.LiveChecker(float(os.environ.get('LOGIC_LEARNER_LIVE_CHECK_DEBOUNCE', '0.15')),
+                                          float(os.environ.get('LOGIC_LEARNER_LIVE_CHECK_RATE', '10')),
+                                          int(os.environ.get('LOGIC_LEARNER_LIVE_CHECK_BURST', '20')),
+                                          float(os.environ.get('LOGIC_LEARNER_LIVE_CHECK_ADDRESS_RATE', '200')),
+                                          int(os.environ.get('LOGIC_LEARNER_LIVE_CHECK_ADDRESS_BURST', '400')))
+
+
+# Exposes the sizes and hit counts of the caches, the marking queue, the question pool and the live checks as /metrics
+# gauges
+def register_metrics(file_manager: backend.file_manager.FileManager,
+                     marking_executor: typing.Optional[backend.marking_executor.MarkingExecutor],
+                     question_pool: typing.Optional[backend.question_pool.QuestionPool],
+                     live_checker: typing.Optional[backend.live_check.LiveChecker] = None) -> typing.NoReturn:
+    def collect() -> typing.Iterator[backend.metrics.Gauge]:
+        caches: typing.Dict[str, typing.Dict[str, int]] = dict(backend.logic_engine.cache_stats())
+        caches['question_sets'] = file_manager.cache_stats
+        for cache, stats in caches.items():
+            for stat, value in stats.items():
+                yield 'logic_learner_cache', {'cache': cache, 'stat': stat}, value
+        if marking_executor is not None:
+            for stat, value in marking_executor.stats.items():
+                yield 'logic_learner_marking_executor', {'stat': stat}, value
+        if question_pool is not None:
+            for stat, value in question_pool.stats.items():
+                yield 'logic_learner_question_pool', {'stat': stat}, value
+        if live_checker is not None:
+            for stat, value in live_checker.stats.items():
+                yield 'logic_learner_live_checks', {'stat': stat}, value
+
+    backend.metrics.registry.add_collector(collect)
@@ -0,0 +1,192 @@
+import argparse
+import glob
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import typing
+
+import backend.artifacts
+import backend.metrics
+from backend.file_manager import (FileManager, InvalidJsonFormatError, NonUniqueQuestionIdError, Question, QuestionSet,
+                                  compile_question_set, dict_to_question_set)
+
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS question_sets (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS questions (
+    set_id TEXT NOT NULL REFERENCES question_sets (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    input_method TEXT NOT NULL,
+    correct_grammar TEXT NOT NULL,
+    correct_formula TEXT NOT NULL,
+    prohibited_formula TEXT NOT NULL,
+    compiled TEXT,
+    PRIMARY KEY (set_id, id)
+) WITHOUT ROWID;
+'''
+
+QUESTION_COLUMNS: str = 'id, source, prompt, input_method, correct_grammar, correct_formula, prohibited_formula, ' \
+                        'compiled'
+
+
+# A row of QUESTION_COLUMNS, whose compiled column holds the question's artifact as JSON
+def _row_to_question(row: tuple) -> Question:
+    compiled: typing.Optional[str] = row[-1]
+    return Question(*row[:-1], backend.artifacts.artifact_from_dict(None if compiled is None else json.loads(compiled)))
+
+
+def _artifact_json(question: Question) -> typing.Optional[str]:
+    return None if question.artifact is None else json.dumps(question.artifact.to_dict)
+
+
+# FileManager compatible store keeping every question set in a single SQLite database file
+class SQLiteFileManager(FileManager):
+    # Set ids start with 6 digits like FileManager's, and grow by a digit whenever random ids keep colliding
+    ID_DIGITS: int = 6
+    ID_ATTEMPTS_PER_LENGTH: int = 16
+
+    def __init__(self, database_path: str, cache_size: int = 256):
+        super().__init__(os.path.dirname(database_path), cache_size)
+        self.database_path: str = database_path
+        self.__local: threading.local = threading.local()
+        with self.__connection() as connection:
+            connection.executescript(SCHEMA)
+            columns: typing.List[str] = [column[1] for column in connection.execute('PRAGMA table_info(questions)')]
+            if 'compiled' not in columns:   # databases created before questions were compiled
+                connection.execute('ALTER TABLE questions ADD COLUMN compiled TEXT')
+
+    # sqlite3 connections can't be shared between threads, so each thread gets its own
+    def __connection(self) -> sqlite3.Connection:
+        connection: typing.Optional[sqlite3.Connection] = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA foreign_keys = ON')
+            self.__local.connection = connection
+        return connection
+
+    def retrieve_question(self, set_id: str, question_id: str) -> typing.Optional[Question]:
+        with backend.metrics.stage('retrieve_question', store=type(self).__name__):
+            row: typing.Optional[tuple] = self.__connection().execute(
+                f'SELECT {QUESTION_COLUMNS} FROM questions WHERE set_id = ? AND id = ?', (set_id, question_id)).fetchone()
+        if row is None:
+            return None
+        return _row_to_question(row)
+
+    def _read_set(self, identifier: str) -> QuestionSet:
+        connection: sqlite3.Connection = self.__connection()
+        row: typing.Optional[tuple] = connection.execute('SELECT name FROM question_sets WHERE id = ?',
+                                                         (identifier,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No question set {identifier} in {self.database_path}')
+        questions: typing.List[Question] = [_row_to_question(question) for question in connection.execute(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE set_id = ? ORDER BY position', (identifier,))]
+        return QuestionSet(identifier, row[0], questions)
+
+    def _write_set(self, question_set: QuestionSet) -> str:
+        connection: sqlite3.Connection = self.__connection()
+        with connection:
+            identifier: str = self.__allocate_set_id(connection, question_set.name)
+            question_set.set_id(identifier)
+            self.__insert_questions(connection, question_set)
+        return identifier
+
+    # Stores a set under its existing id, replacing any set already stored with that id
+    def import_set(self, question_set: QuestionSet) -> typing.NoReturn:
+        self.write_compiled_sets([compile_question_set(question_set)], keep_ids=True)
+
+    # The whole batch is written in one transaction
+    def write_compiled_sets(self, question_sets: typing.List[QuestionSet], keep_ids: bool = False) -> typing.List[str]:
+        connection: sqlite3.Connection = self.__connection()
+        question_set: QuestionSet
+        with connection:
+            for question_set in question_sets:
+                if keep_ids:
+                    connection.execute('DELETE FROM question_sets WHERE id = ?', (question_set.id,))
+                    connection.execute('INSERT INTO question_sets (id, name) VALUES (?, ?)',
+                                       (question_set.id, question_set.name))
+                else:
+                    question_set.set_id(self.__allocate_set_id(connection, question_set.name))
+                self.__insert_questions(connection, question_set)
+        for question_set in question_sets:
+            self.invalidate(question_set.id)
+        return [question_set.id for question_set in question_sets]
+
+    def _set_ids(self) -> typing.Iterator[str]:
+        # a connection of its own, so sets can be read while the ids are still being fetched
+        connection: sqlite3.Connection = sqlite3.connect(self.database_path)
+        try:
+            for (identifier,) in connection.execute('SELECT id FROM question_sets ORDER BY id'):
+                yield identifier
+        finally:
+            connection.close()
+
+    # The primary key makes allocation collision free: an id is only ours once its row has been inserted
+    def __allocate_set_id(self, connection: sqlite3.Connection, name: str) -> str:
+        digits: int = self.ID_DIGITS
+        while True:
+            for _ in range(self.ID_ATTEMPTS_PER_LENGTH):
+                code: str = ''.join(random.choice('0123456789') for _ in range(digits))
+                try:
+                    connection.execute('INSERT INTO question_sets (id, name) VALUES (?, ?)', (code, name))
+                    return code
+                except sqlite3.IntegrityError:
+                    continue
+            digits += 1
+
+    @staticmethod
+    def __insert_questions(connection: sqlite3.Connection, question_set: QuestionSet) -> typing.NoReturn:
+        connection.executemany(
+            f'INSERT INTO questions (set_id, position, {QUESTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(question_set.id, position, question.id, question.source, question.prompt, question.input_method,
+              question.correct_grammar, question.correct_formula, question.prohibited_formula,
+              _artifact_json(question))
+             for position, question in enumerate(question_set.questions)])
+
+
+# Imports every data/<id>.json question set file into a database, keeping their ids. A file that can't be imported is
+# skipped without stopping the migration, and returned with why, so it can be fixed and the migration run again.
+def migrate(data_dir: str, database_path: str) -> typing.Tuple[int, typing.Dict[str, str]]:
+    store: SQLiteFileManager = SQLiteFileManager(database_path)
+    count: int = 0
+    errors: typing.Dict[str, str] = {}
+    path: str
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.json'))):
+        try:
+            with open(path, 'r') as file:
+                record: typing.Any = json.load(file)
+            if not isinstance(record, dict):
+                errors[path] = 'Expected a JSON object'
+                continue
+            store.import_set(dict_to_question_set(record))
+        except (OSError, ValueError, TypeError, InvalidJsonFormatError, NonUniqueQuestionIdError) as error:
+            errors[path] = str(error) or type(error).__name__
+            continue
+        count += 1
+    return count, errors
+
+
+def main() -> typing.NoReturn:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Import JSON question set files into a SQLite question store')
+    parser.add_argument('data_dir', help='directory of <id>.json question set files')
+    parser.add_argument('database', help='SQLite database file to create or update')
+    args: argparse.Namespace = parser.parse_args()
+    count, errors = migrate(args.data_dir, args.database)
+    for path, error in errors.items():
+        print(f'Skipped {path}: {error}', file=sys.stderr)
+    print(f'Imported {count} question sets into {args.database}, skipped {len(errors)}')
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
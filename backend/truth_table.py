@@ -0,0 +1,56 @@
+import json
+import typing
+
+# Renderers for truth table rows, as yielded by logic_engine.iter_truth_table_rows, writing to a text stream
+
+Row = typing.Tuple[typing.Tuple[bool, ...], bool]
+
+
+def _cell(value: bool) -> str:
+    return "<td>\\(1\\)</td>" if value else "<td>\\(0\\)</td>"
+
+
+# The table used in question prompts
+def write_html(rows: typing.Iterable[Row], letters: typing.List[str], stream: typing.TextIO) -> typing.NoReturn:
+    stream.write("<table class ='table'><thead><tr>")
+    for l in letters:
+        stream.write("<th scope='col'>\\(" + l + "\\)</th>")
+    stream.write("<th scope='col'>\\(?\\)</th></tr></thead><tbody>")
+    for valuation, value in rows:
+        stream.write("<tr>" + "".join(_cell(t) for t in valuation) + _cell(value) + "</tr>")
+    stream.write("</tbody></table>")
+
+
+# {"letters": [...], "rows": [[valuation bits..., value bit], ...]}, with any extra fields first
+def write_json(rows: typing.Iterable[Row], letters: typing.List[str], stream: typing.TextIO,
+               extra: typing.Optional[typing.Dict[str, typing.Any]] = None) -> typing.NoReturn:
+    stream.write("{")
+    for key, value in (extra or {}).items():
+        stream.write(json.dumps(key) + ": " + json.dumps(value) + ", ")
+    stream.write('"letters": ' + json.dumps(letters) + ', "rows": [')
+    first: bool = True
+    for valuation, value in rows:
+        if not first:
+            stream.write(", ")
+        stream.write("[" + ", ".join("1" if t else "0" for t in valuation) + (", 1]" if value else ", 0]"))
+        first = False
+    stream.write("]}")
+
+
+# Only the formula's value in each row, as a string of 0s and 1s, since the valuations follow from the row order
+def write_bitstring(rows: typing.Iterable[Row], letters: typing.List[str], stream: typing.TextIO) -> typing.NoReturn:
+    for _, value in rows:
+        stream.write("1" if value else "0")
+
+
+WRITERS: typing.Dict[str, typing.Callable[[typing.Iterable[Row], typing.List[str], typing.TextIO], None]] = {
+    "html": write_html,
+    "json": write_json,
+    "bits": write_bitstring,
+}
+
+CONTENT_TYPES: typing.Dict[str, str] = {
+    "html": "text/html; charset=utf-8",
+    "json": "application/json",
+    "bits": "text/plain; charset=utf-8",
+}
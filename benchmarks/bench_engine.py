@@ -0,0 +1,111 @@
+# Times the logic engine and question stores on seeded formula corpora of controlled size and letter count
+# Run from the repository root with: python -m benchmarks.bench_engine --output engine.json
+# and compare two runs with: python -m benchmarks.compare before.json after.json
+import argparse
+import os
+import random
+import tempfile
+import typing
+
+import backend.file_manager
+import backend.logic_engine
+import backend.sqlite_store
+from benchmarks import common, corpus
+
+
+def bench_formulas(grammar: str, operator_count: int, letter_count: int, args: argparse.Namespace) -> typing.List[common.Result]:
+    texts: typing.List[str] = corpus.make_texts(grammar, args.corpus_size, operator_count, letter_count, args.seed)
+    parser = backend.logic_engine.get_parser(grammar)
+    trees = [parser.parse(text) for text in texts]
+    # equivalent but differently written formulas, so equivalence and prohibited checks can't stop at the first node
+    variants = [parser.parse("-(-(" + text + "))") for text in texts]
+    rng: random.Random = random.Random(args.seed)
+    letters: typing.List[str] = corpus.letters_for(letter_count)
+    valuations: typing.List[typing.Dict[str, bool]] = [{l: rng.random() < 0.5 for l in letters} for _ in texts]
+
+    parameters: typing.Dict[str, typing.Any] = {"grammar": grammar, "operators": operator_count,
+                                                "letters": letter_count, "formulas": len(texts)}
+    benchmarks: typing.Dict[str, typing.Callable[[], typing.Any]] = {
+        "parse": lambda: [parser.parse(text) for text in texts],
+        "evaluate_tree": lambda: [backend.logic_engine.evaluate_tree(tree, valuation)
+                                  for tree, valuation in zip(trees, valuations)],
+        "check_equivalent": lambda: [backend.logic_engine.check_equivalent(tree, variant)
+                                     for tree, variant in zip(trees, variants)],
+        "is_prohibited": lambda: [backend.logic_engine.is_prohibited(variant, tree)
+                                  for tree, variant in zip(trees, variants)],
+    }
+    if letter_count <= args.truth_table_max_letters:
+        benchmarks["gen_truth_table"] = lambda: [backend.logic_engine.gen_truth_table(text, letters, grammar)
+                                                 for text in texts]
+    return [common.result(name, parameters, common.measure(function, args.repeat))
+            for name, function in benchmarks.items()]
+
+
+def bench_generate_question(args: argparse.Namespace) -> typing.List[common.Result]:
+    results: typing.List[common.Result] = []
+    for question_type in backend.logic_engine.QUESTION_TYPES:
+        rng: random.Random = random.Random(args.seed)
+        results.append(common.result(
+            "generate_question", {"type": question_type, "questions": args.corpus_size},
+            common.measure(lambda: [backend.logic_engine.generate_question(question_type, rng)
+                                    for _ in range(args.corpus_size)], args.repeat)))
+    return results
+
+
+def bench_store(name: str, create: typing.Callable[[int], backend.file_manager.FileManager],
+                args: argparse.Namespace) -> typing.List[common.Result]:
+    random.seed(args.seed)
+    question_set: backend.file_manager.QuestionSet = backend.file_manager.generate_random_questions(args.set_size)
+    cold: backend.file_manager.FileManager = create(0)    # no in-memory cache, so every read goes to storage
+    warm: backend.file_manager.FileManager = create(256)
+    identifier: str = warm.write_to_file(question_set)
+    question_id: str = question_set.questions[-1].id
+
+    parameters: typing.Dict[str, typing.Any] = {"store": name, "questions": args.set_size}
+    return [
+        common.result("store.write", parameters, common.measure(lambda: cold.write_to_file(question_set), args.repeat)),
+        common.result("store.read_cold", parameters,
+                      common.measure(lambda: cold.retrieve_from_file(identifier, hide_answer=False), args.repeat)),
+        common.result("store.read_warm", parameters,
+                      common.measure(lambda: warm.retrieve_from_file(identifier, hide_answer=False), args.repeat)),
+        common.result("store.read_question_cold", parameters,
+                      common.measure(lambda: cold.retrieve_question(identifier, question_id), args.repeat)),
+    ]
+
+
+def main() -> typing.NoReturn:
+    argument_parser = argparse.ArgumentParser(description="Logic engine and question store benchmarks")
+    argument_parser.add_argument("--grammars", nargs="+", choices=["prop", "bool"], default=["prop", "bool"])
+    argument_parser.add_argument("--operators", type=int, nargs="+", default=[4, 16, 64],
+                                 help="binary operators per formula")
+    argument_parser.add_argument("--letters", type=int, nargs="+", default=[2, 5, 10], help="letters per formula")
+    argument_parser.add_argument("--corpus-size", type=int, default=20, help="formulas (or questions) per timed run")
+    argument_parser.add_argument("--truth-table-max-letters", type=int, default=10,
+                                 help="most letters to render truth tables for, as they have 2^letters rows")
+    argument_parser.add_argument("--set-size", type=int, default=50, help="questions per stored question set")
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument("--output", help="file to write the results to as JSON")
+    args = argument_parser.parse_args()
+
+    results: typing.List[common.Result] = []
+    for grammar in args.grammars:
+        for operator_count in args.operators:
+            for letter_count in args.letters:
+                if operator_count + 1 >= letter_count:
+                    results.extend(bench_formulas(grammar, operator_count, letter_count, args))
+    results.extend(bench_generate_question(args))
+
+    with tempfile.TemporaryDirectory() as directory:
+        results.extend(bench_store("json", lambda cache_size: backend.file_manager.FileManager(directory, cache_size),
+                                   args))
+        database: str = os.path.join(directory, "questions.db")
+        results.extend(bench_store("sqlite", lambda cache_size: backend.sqlite_store.SQLiteFileManager(database,
+                                                                                                       cache_size),
+                                   args))
+
+    common.report("engine", results, args.output)
+
+
+if __name__ == '__main__':
+    main()
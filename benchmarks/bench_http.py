@@ -0,0 +1,102 @@
+# Load tests the Flask routes in main.py through Flask's test client, without a network or a separate server
+# Run from the repository root with: python -m benchmarks.bench_http --output http.json
+# Question sets are written to a temporary directory, and marking runs in process unless --marking-workers is given
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import random
+import tempfile
+import time
+import typing
+
+from benchmarks import common
+
+Request = typing.Tuple[str, str, typing.Dict[str, str], typing.Optional[bytes]]     # method, path, headers, body
+
+
+def route_requests(question_set: dict, seed: int) -> typing.Dict[str, typing.Callable[[], Request]]:
+    rng: random.Random = random.Random(seed)
+    set_id: str = question_set["id"]
+    questions: typing.List[dict] = question_set["questions"]
+    answers: typing.List[str] = ["p ^ q", "-(p < q)", "p -> q", "a . b", "-a + b", "(p ^ q) < r", "p <"]
+    body: bytes = json.dumps(question_set).encode()
+    submissions: bytes = json.dumps([{"set_id": set_id, "question_id": question["id"], "user_answer": rng.choice(answers)}
+                                     for question in questions]).encode()
+    return {
+        "/random": lambda: ("GET", "/random", {"question_count": "10"}, None),
+        "/post_json": lambda: ("POST", "/post_json", {}, body),
+        "/get_json": lambda: ("GET", "/get_json", {"identifier": set_id}, None),
+        "/mark_answer": lambda: ("GET", "/mark_answer", {"set_id": set_id, "question_id": rng.choice(questions)["id"],
+                                                         "user_answer": rng.choice(answers)}, None),
+        "/mark_answers": lambda: ("POST", "/mark_answers", {}, submissions),
+        "/truth_table": lambda: ("GET", "/truth_table", {"formula": "(p -> q) <-> (-r ^ s) < t", "format": "json",
+                                                         "page": str(rng.randrange(4)), "page_size": "8"}, None),
+    }
+
+
+def send(client, request: Request) -> float:
+    method, path, headers, body = request
+    start: float = time.perf_counter()
+    response = client.open(path, method=method, headers=headers, data=body)
+    elapsed: float = (time.perf_counter() - start) * 1000
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}")
+    return elapsed
+
+
+# Sends "requests" requests to one route from "threads" threads, returning latency statistics and throughput
+def load(client, make_request: typing.Callable[[], Request], requests: int, threads: int) -> typing.Dict[str, float]:
+    prepared: typing.List[Request] = [make_request() for _ in range(requests)]
+    send(client, prepared[0])   # warm up
+    start: float = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        timings: typing.List[float] = list(executor.map(lambda request: send(client, request), prepared))
+    elapsed: float = time.perf_counter() - start
+    return {**common.summarize(timings), "requests_per_second": requests / elapsed}
+
+
+def main() -> typing.NoReturn:
+    argument_parser = argparse.ArgumentParser(description="Flask route load test through the test client")
+    argument_parser.add_argument("--routes", nargs="+", help="routes to test, all of them by default")
+    argument_parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    argument_parser.add_argument("--threads", type=int, default=1, help="concurrent clients")
+    argument_parser.add_argument("--marking-workers", type=int, default=0,
+                                 help="marking processes, 0 to mark in the request thread")
+    argument_parser.add_argument("--question-pool-size", type=int, default=0,
+                                 help="questions to keep generated per type, 0 to generate on demand")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument("--output", help="file to write the results to as JSON")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # main.py configures itself from the environment when imported
+        os.environ["LOGIC_LEARNER_DATA_DIR"] = directory
+        os.environ.pop("LOGIC_LEARNER_DATABASE", None)
+        os.environ["LOGIC_LEARNER_MARKING_WORKERS"] = str(args.marking_workers)
+        os.environ["LOGIC_LEARNER_QUESTION_POOL_SIZE"] = str(args.question_pool_size)
+        random.seed(args.seed)
+        server = importlib.import_module("main")
+        client = server.app.test_client()
+
+        # a generated set to read and mark, with its answers, which /random itself hides
+        identifier: str = json.loads(client.get("/random", headers={"question_count": "20"}).get_data())["id"]
+        question_set: dict = server.file_manager.retrieve_from_file(identifier, hide_answer=False).to_dict
+
+        routes: typing.Dict[str, typing.Callable[[], Request]] = route_requests(question_set, args.seed)
+        results: typing.List[common.Result] = []
+        for route in args.routes or list(routes):
+            results.append(common.result("http" + route, {"requests": args.requests, "threads": args.threads},
+                                         load(client, routes[route], args.requests, args.threads)))
+
+        if server.marking_executor is not None:
+            server.marking_executor.shutdown()
+        if server.question_pool is not None:
+            server.question_pool.stop()
+
+    common.report("http", results, args.output)
+
+
+if __name__ == '__main__':
+    main()
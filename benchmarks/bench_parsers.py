@@ -0,0 +1,57 @@
+# Compares parse time against formula length for the LALR and Earley grammars
+# Run from the repository root with: python -m benchmarks.bench_parsers
+import argparse
+import random
+import timeit
+import typing
+
+import backend.logic_engine
+
+PROP_OPERATORS: typing.List[str] = [" ^ ", " < ", " -> ", " <-> "]
+BOOL_OPERATORS: typing.List[str] = [" . ", " + "]
+
+
+def make_formula(grammar: str, operator_count: int, rng: random.Random) -> str:
+    operators: typing.List[str] = PROP_OPERATORS if grammar == "prop" else BOOL_OPERATORS
+    letters: str = "pqrst" if grammar == "prop" else "abcde"
+    formula: str = rng.choice(letters)
+    for _ in range(operator_count):
+        operand: str = rng.choice(letters)
+        if rng.randint(0, 3) == 0:
+            operand = "-" + operand
+        formula += rng.choice(operators) + operand
+        if rng.randint(0, 5) == 0:
+            formula = "(" + formula + ")"
+    return formula
+
+
+def time_parse(parser, formula: str, repeat: int) -> float:
+    return min(timeit.repeat(lambda: parser.parse(formula), number=1, repeat=repeat))
+
+
+def main() -> typing.NoReturn:
+    argument_parser = argparse.ArgumentParser(description="Parse time versus formula length")
+    argument_parser.add_argument("--grammar", choices=["prop", "bool"], default="prop")
+    argument_parser.add_argument("--lengths", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64, 128])
+    argument_parser.add_argument("--earley-max-length", type=int, default=32,
+                                 help="longest formula to parse with Earley, which is super-linear on these grammars")
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args()
+
+    rng: random.Random = random.Random(args.seed)
+    lalr = backend.logic_engine.build_parser(args.grammar, "lalr")
+    earley = backend.logic_engine.build_parser(args.grammar, "earley")
+
+    print(f"{'operators':>10} {'characters':>11} {'lalr (ms)':>10} {'earley (ms)':>12}")
+    for length in args.lengths:
+        formula: str = make_formula(args.grammar, length, rng)
+        lalr_time: float = time_parse(lalr, formula, args.repeat) * 1000
+        earley_column: str = "-"
+        if length <= args.earley_max_length:
+            earley_column = f"{time_parse(earley, formula, args.repeat) * 1000:.3f}"
+        print(f"{length:>10} {len(formula):>11} {lalr_time:>10.3f} {earley_column:>12}")
+
+
+if __name__ == '__main__':
+    main()
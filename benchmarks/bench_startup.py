@@ -0,0 +1,79 @@
+# Times how long a fresh process takes to import the backend and parse its first formula, with the parser table cache
+# empty, filled, and turned off, as every new server worker or marking process pays this before serving anything
+# Run from the repository root with: python -m benchmarks.bench_startup --output startup.json
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import typing
+
+from benchmarks import common
+
+# the child prints the milliseconds taken to import the module, then to import it and parse one formula per grammar
+CHILD: str = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{parse}
+print((imported - start) * 1000, (time.perf_counter() - start) * 1000)
+"""
+
+PARSE: str = """
+import backend.logic_engine
+backend.logic_engine.get_parser("prop").parse("p -> q")
+backend.logic_engine.get_parser("bool").parse("a.b")
+backend.logic_engine.get_parser("dnf").parse("(p ^ q) < -p")
+"""
+
+MODULES: typing.List[str] = ["backend.file_manager", "backend.logic_engine", "main"]
+
+
+def run_child(module: str, parse: bool, cache_directory: str) -> typing.Tuple[float, float]:
+    environment: typing.Dict[str, str] = dict(os.environ, LOGIC_LEARNER_PARSER_CACHE=cache_directory,
+                                              LOGIC_LEARNER_MARKING_WORKERS="0", LOGIC_LEARNER_QUESTION_POOL_SIZE="0")
+    output: str = subprocess.run([sys.executable, "-c", CHILD.format(module=module, parse=PARSE if parse else "")],
+                                 capture_output=True, text=True, check=True, env=environment).stdout
+    imported_ms, parsed_ms = output.split()[-2:]
+    return float(imported_ms), float(parsed_ms)
+
+
+# cache is "off" (no cache directory), "cold" (an empty directory for every run) or "warm" (filled before the runs)
+def bench_startup(module: str, cache: str, args: argparse.Namespace) -> typing.List[common.Result]:
+    import_timings: typing.List[float] = []
+    parse_timings: typing.List[float] = []
+    with tempfile.TemporaryDirectory() as directory:
+        if cache == "warm":
+            run_child(module, True, directory)
+        for run in range(args.repeat):
+            cache_directory: str = ""
+            if cache == "cold":
+                cache_directory = os.path.join(directory, str(run))
+            elif cache == "warm":
+                cache_directory = directory
+            imported_ms, parsed_ms = run_child(module, True, cache_directory)
+            import_timings.append(imported_ms)
+            parse_timings.append(parsed_ms)
+    parameters: typing.Dict[str, typing.Any] = {"module": module, "cache": cache}
+    return [common.result("startup.import", parameters, common.summarize(import_timings)),
+            common.result("startup.first_parse", parameters, common.summarize(parse_timings))]
+
+
+def main() -> typing.NoReturn:
+    argument_parser = argparse.ArgumentParser(description="Process startup benchmarks")
+    argument_parser.add_argument("--modules", nargs="+", choices=MODULES, default=MODULES)
+    argument_parser.add_argument("--cache", nargs="+", choices=["off", "cold", "warm"], default=["off", "cold", "warm"])
+    argument_parser.add_argument("--repeat", type=int, default=10, help="processes started per benchmark")
+    argument_parser.add_argument("--output", help="file to write the results to as JSON")
+    args = argument_parser.parse_args()
+
+    results: typing.List[common.Result] = []
+    for module in args.modules:
+        for cache in args.cache:
+            results.extend(bench_startup(module, cache, args))
+    common.report("startup", results, args.output)
+
+
+if __name__ == '__main__':
+    main()
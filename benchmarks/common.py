@@ -0,0 +1,66 @@
+# Timing and result output shared by the benchmarks, so every benchmark reports in the same JSON format
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+Result = typing.Dict[str, typing.Any]
+
+
+# Runs function "repeat" times after "warmup" untimed runs, returning summary statistics in milliseconds
+def measure(function: typing.Callable[[], typing.Any], repeat: int, warmup: int = 1) -> typing.Dict[str, float]:
+    for _ in range(warmup):
+        function()
+    timings: typing.List[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def summarize(timings_ms: typing.List[float]) -> typing.Dict[str, float]:
+    ordered: typing.List[float] = sorted(timings_ms)
+    return {
+        "runs": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+def result(name: str, parameters: typing.Dict[str, typing.Any], timings: typing.Dict[str, float]) -> Result:
+    return {"name": name, "parameters": parameters, **timings}
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> typing.Dict[str, typing.Any]:
+    return {"commit": git_commit(), "python": sys.version.split()[0], "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "arguments": sys.argv[1:]}
+
+
+# Prints a table of the results, and writes them with the environment as JSON when an output path is given
+def report(suite: str, results: typing.List[Result], output: typing.Optional[str]) -> typing.NoReturn:
+    print(f"{'benchmark':<28} {'parameters':<44} {'median (ms)':>12} {'p95 (ms)':>10}")
+    for entry in results:
+        parameters: str = " ".join(f"{key}={value}" for key, value in entry["parameters"].items())
+        print(f"{entry['name']:<28} {parameters:<44} {entry['median_ms']:>12.4f} {entry['p95_ms']:>10.4f}")
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump({"suite": suite, "environment": environment(), "results": results}, file, indent=1)
+
+
+def result_key(entry: Result) -> str:
+    return entry["name"] + " " + json.dumps(entry["parameters"], sort_keys=True)
@@ -0,0 +1,32 @@
+# Compares two JSON benchmark results, e.g. from before and after a change
+# Run from the repository root with: python -m benchmarks.compare before.json after.json
+import argparse
+import json
+import typing
+
+from benchmarks import common
+
+
+def main() -> typing.NoReturn:
+    argument_parser = argparse.ArgumentParser(description="Compare the median times of two benchmark runs")
+    argument_parser.add_argument("before")
+    argument_parser.add_argument("after")
+    args = argument_parser.parse_args()
+
+    with open(args.before) as file:
+        before: typing.Dict[str, common.Result] = {common.result_key(entry): entry for entry in json.load(file)["results"]}
+    with open(args.after) as file:
+        after: typing.List[common.Result] = json.load(file)["results"]
+
+    print(f"{'benchmark':<72} {'before (ms)':>12} {'after (ms)':>12} {'speedup':>8}")
+    for entry in after:
+        key: str = common.result_key(entry)
+        if key not in before:
+            continue
+        old: float = before[key]["median_ms"]
+        new: float = entry["median_ms"]
+        print(f"{key:<72} {old:>12.4f} {new:>12.4f} {old / new if new else float('inf'):>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
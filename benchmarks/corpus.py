@@ -0,0 +1,48 @@
+# Seeded corpora of random formulas with an exact number of operators and letters, for the benchmarks
+import random
+import typing
+
+import backend.formula
+from backend.formula import Formula
+
+OPERATIONS: typing.Dict[str, typing.List[str]] = {
+    "prop": ["_and", "_or", "implies", "equivalent"],
+    "bool": ["_and", "_or"],
+}
+
+LETTERS: str = "pqrstuvwxyzabcdefghijklmno"
+
+
+def letters_for(letter_count: int) -> typing.List[str]:
+    if not 1 <= letter_count <= len(LETTERS):
+        raise ValueError(f"letter_count must be between 1 and {len(LETTERS)}")
+    return list(LETTERS[:letter_count])
+
+
+# A formula with exactly operator_count binary operators over exactly letter_count letters (so operator_count must be
+# at least letter_count - 1). Its shape is random: operands are merged pairwise at random positions, which needs no
+# recursion however large the formula is.
+def make_formula(grammar: str, operator_count: int, letter_count: int, rng: random.Random) -> Formula:
+    letters: typing.List[str] = letters_for(letter_count)
+    if operator_count + 1 < letter_count:
+        raise ValueError("too few operators to use every letter")
+    names: typing.List[str] = letters + [rng.choice(letters) for _ in range(operator_count + 1 - letter_count)]
+    rng.shuffle(names)
+    operands: typing.List[Formula] = [backend.formula.not_letter(name) if rng.randint(0, 3) == 0
+                                      else backend.formula.letter(name) for name in names]
+    while len(operands) > 1:
+        i: int = rng.randrange(len(operands) - 1)
+        formula: Formula = backend.formula.binary(rng.choice(OPERATIONS[grammar]), operands[i], operands[i + 1])
+        if rng.randint(0, 5) == 0:
+            formula = backend.formula.not_formula(formula)
+        operands[i:i + 2] = [formula]
+    return operands[0]
+
+
+def make_corpus(grammar: str, count: int, operator_count: int, letter_count: int, seed: int) -> typing.List[Formula]:
+    rng: random.Random = random.Random(f"{seed}:{grammar}:{operator_count}:{letter_count}")
+    return [make_formula(grammar, operator_count, letter_count, rng) for _ in range(count)]
+
+
+def make_texts(grammar: str, count: int, operator_count: int, letter_count: int, seed: int) -> typing.List[str]:
+    return [formula.render(grammar) for formula in make_corpus(grammar, count, operator_count, letter_count, seed)]
@@ -162,4 +162,21 @@ function getQuestionAnswer(setId, questionId, userAnswer) {
             console.log("Answer not received");
         }
     }).responseText;
+}
+
+// Checks a partly typed answer for live feedback. Responses to checks superseded by a later one are ignored.
+function checkPartialAnswer(setId, questionId, sessionId, userAnswer, onResult) {
+    $.ajax({
+        url: "http://127.0.0.1:8888/check_partial",
+        type: "GET",
+        headers: {'set_id': setId, 'question_id': questionId, 'session_id': sessionId, 'user_answer': userAnswer},
+        success: function (response) {
+            if (!response.superseded) {
+                onResult(response);
+            }
+        },
+        error: function () {
+            console.log("Live check not received");
+        }
+    });
 }
\ No newline at end of file
@@ -1,11 +1,58 @@
+import os
+import time
+import typing
 import flask
 import flask_cors
+import backend.bulk_io
 import backend.file_manager
+import backend.live_check
 import backend.logic_engine
+import backend.marking
+import backend.marking_executor
+import backend.metrics
+import backend.question_pool
+import backend.server_config
+import backend.truth_table
 
 app: flask.Flask = flask.Flask(__name__)
 flask_cors.CORS(app)
-file_manager: backend.file_manager.FileManager = backend.file_manager.FileManager('data')
+file_manager: backend.file_manager.FileManager = backend.server_config.create_file_manager()
+marking_executor: typing.Optional[backend.marking_executor.MarkingExecutor] = \
+    backend.server_config.create_marking_executor()
+question_pool: typing.Optional[backend.question_pool.QuestionPool] = backend.server_config.create_question_pool()
+live_checker: backend.live_check.LiveChecker = backend.server_config.create_live_checker()
+backend.server_config.register_metrics(file_manager, marking_executor, question_pool, live_checker)
+
+
+# every request is timed by route for /metrics, and a sample of requests is profiled if LOGIC_LEARNER_PROFILE_RATE is set
+@app.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+    flask.g.profile = backend.metrics.profiler.start()
+
+
+def request_route() -> str:
+    return flask.request.url_rule.rule if flask.request.url_rule is not None else 'unmatched'
+
+
+@app.after_request
+def record_request_time(response: flask.Response) -> flask.Response:
+    backend.metrics.registry.observe(backend.metrics.REQUEST_SECONDS, time.perf_counter() - flask.g.request_start,
+                                     {'route': request_route(), 'method': flask.request.method,
+                                      'status': response.status_code})
+    return response
+
+
+# runs even when a request fails, so the profiler is always released
+@app.teardown_request
+def finish_request_profile(error: typing.Optional[BaseException]):
+    backend.metrics.profiler.finish(flask.g.pop('profile', None), request_route())
+
+
+# sets whose JSON is missing fields or whose formulas don't parse are rejected
+@app.errorhandler(backend.file_manager.InvalidJsonFormatError)
+def invalid_question_set(error: backend.file_manager.InvalidJsonFormatError):
+    return str(error), 400
 
 
 @app.route('/post_json', methods=['POST'])
@@ -23,20 +70,123 @@ def get_json():
 @app.route('/random', methods=['GET'])
 def get_random_question_set():
     if flask.request.method == 'GET':
-        set_id: str = file_manager.write_to_file(
-            backend.file_manager.generate_random_questions(int(flask.request.headers.get('question_count'))))
-        return file_manager.retrieve_from_file(set_id, hide_answer=True).to_json_string
+        questions: backend.file_manager.QuestionSet = backend.file_manager.generate_random_questions(
+            int(flask.request.headers.get('question_count')),
+            backend.logic_engine.generate_question if question_pool is None else question_pool.take)
+        file_manager.write_to_file(questions)
+        return file_manager.hide_answers(questions).to_json_string
 
 
 @app.route('/mark_answer', methods=['GET'])
 def mark_answer():
     if flask.request.method == 'GET':
-        question_set = file_manager.retrieve_from_file(flask.request.headers.get('set_id'), hide_answer=False).get_question_by_id(
-            flask.request.headers.get('question_id'))
-        return backend.logic_engine.validate_answer(flask.request.headers.get('user_answer'),
-                                                    question_set.correct_formula, question_set.prohibited_formula,
-                                                    question_set.correct_grammar)
+        question_set = file_manager.retrieve_question(flask.request.headers.get('set_id'),
+                                                      flask.request.headers.get('question_id'))
+        if marking_executor is None:
+            return backend.logic_engine.validate_answer(flask.request.headers.get('user_answer'),
+                                                        question_set.correct_formula, question_set.prohibited_formula,
+                                                        question_set.correct_grammar, question_set.artifact)
+        try:
+            return marking_executor.mark(flask.request.headers.get('user_answer'), question_set.correct_formula,
+                                         question_set.prohibited_formula, question_set.correct_grammar,
+                                         question_set.artifact)
+        except backend.marking_executor.MarkingQueueFullError:
+            flask.abort(503)
+
+
+@app.route('/mark_answers', methods=['POST'])
+def mark_answers():
+    if flask.request.method == 'POST':
+        try:
+            return flask.jsonify(backend.marking.mark_submissions(file_manager, flask.request.get_json(force=True),
+                                                                  marking_executor))
+        except backend.marking.InvalidSubmissionsError as error:
+            return str(error), 400
+        except backend.marking_executor.MarkingQueueFullError:
+            flask.abort(503)
+
+
+# checks an answer as it is typed, see backend.live_check. each client should send its own random session_id
+@app.route('/check_partial', methods=['GET'])
+def check_partial():
+    if flask.request.method == 'GET':
+        headers = flask.request.headers
+        if not headers.get('session_id'):
+            flask.abort(400)
+        try:
+            question = file_manager.retrieve_question(headers.get('set_id'), headers.get('question_id'))
+        except FileNotFoundError:
+            question = None
+        if question is None:
+            flask.abort(404)
+        try:
+            pending = live_checker.admit(flask.request.remote_addr or '', headers.get('session_id'),
+                                         headers.get('set_id'), question, headers.get('user_answer', ''))
+        except backend.live_check.RateLimitedError as error:
+            return str(error), 429
+        except backend.live_check.AnswerTooLongError as error:
+            return str(error), 413
+        time.sleep(pending.delay)
+        return flask.jsonify(live_checker.check(pending))
+
+
+# streams question banks in and out as JSON Lines, see backend.bulk_io. the import's report is streamed back as each
+# batch of sets is written, so neither the bank nor the report is ever held in memory
+@app.route('/import_jsonl', methods=['POST'])
+def import_jsonl():
+    if flask.request.method == 'POST':
+        headers = flask.request.headers
+        if not backend.bulk_io.is_authorized(headers.get('bank_token')):
+            flask.abort(403)
+        try:
+            reports = backend.bulk_io.import_lines(file_manager, flask.request.stream,
+                                                   int(headers.get('set_size', '50')),
+                                                   headers.get('name', 'Imported questions'),
+                                                   int(headers.get('batch_size', '100')),
+                                                   headers.get('keep_ids', 'false') == 'true')
+        except ValueError:
+            return 'set_size and batch_size must be whole numbers of at least 1', 400
+        return flask.Response(flask.stream_with_context(backend.bulk_io.report_lines(reports)),
+                              mimetype=backend.bulk_io.CONTENT_TYPE)
+
+
+@app.route('/export_jsonl', methods=['GET'])
+def export_jsonl():
+    if flask.request.method == 'GET':
+        if not backend.bulk_io.is_authorized(flask.request.headers.get('bank_token')):
+            flask.abort(403)
+        return flask.Response(backend.bulk_io.export_lines(file_manager), mimetype=backend.bulk_io.CONTENT_TYPE)
+
+
+@app.route('/truth_table', methods=['GET'])
+def truth_table():
+    if flask.request.method == 'GET':
+        headers = flask.request.headers
+        output_format: str = headers.get('format', 'json')
+        if output_format not in backend.truth_table.CONTENT_TYPES:
+            flask.abort(400)
+        try:
+            page: int = int(headers.get('page', '0'))
+            page_size: int = int(headers.get('page_size', '256'))
+        except ValueError:
+            return 'page and page_size must be whole numbers', 400
+        try:
+            return flask.Response(backend.logic_engine.render_truth_table_page(
+                headers.get('formula'), headers.get('grammar', 'prop'), output_format, headers.get('order', 'binary'),
+                page, page_size), content_type=backend.truth_table.CONTENT_TYPES[output_format])
+        except backend.logic_engine.InvalidTruthTableRequestError as error:
+            return str(error), 400
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if flask.request.method == 'GET':
+        return flask.Response(backend.metrics.registry.render(), content_type=backend.metrics.CONTENT_TYPE)
 
 
 if __name__ == '__main__':
+    # the reloader runs this in a watcher process and again in the serving process, which it marks with
+    # WERKZEUG_RUN_MAIN, so only the serving process fills the pool ahead of time (it starts on first use otherwise)
+    if question_pool is not None and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        question_pool.start()
     app.run(host="127.0.0.1", port=8888, debug=True)